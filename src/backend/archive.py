@@ -0,0 +1,226 @@
+# Python built-in modules and packages
+import argparse
+import logging
+import os
+import sqlite3
+import sys
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# Third-party modules and packages
+import pandas as pd
+import toml
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:  # optional, only needed to export archives
+    pa = ds = None
+
+# Local modules and packages
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import shards
+
+
+# --- Useful type hints ---
+RowID = int
+ExportState = Dict[str, Dict]  # {"sources": {file: {table: rowid}}, "exported_until"}
+CageNames = Dict[int, str]  # {tbr_serial_id: cage_name}
+
+logger = logging.getLogger("mqtt_client.archive")
+
+archivePath = "src/backend/dbmanager/archive/"
+metadataFile = "src/backend/.config/metadata.toml"
+stateFile = "export_state.toml"  # in archive directory, read by frontend archive
+chunkSize = 100000
+unknownCage = "unknown"
+
+# Compact column types, the dtypes iof_app.clean_df casts to
+# | Other columns keep the type sqlite3 gives them (int64, float64 or string)
+columnTypes = {
+    "timestamp": "uint32",
+    "hour": "uint8",
+    "comm_protocol": "category",
+    "frequency": "uint8",
+    "tag_id": "uint32",
+    "tag_data_raw": "uint16",
+    "snr": "uint8",
+    "millisecond": "uint16",
+    "tbr_serial_id": "uint16",
+    "temperature_data_raw": "uint16",
+    "noise_avg": "uint8",
+    "noise_peak": "uint8",
+    "cage_name": "category",
+    "fix": "category",
+    "slim_status": "category",
+    "num_sat_tracked": "uint8",
+}
+# Files of a table are partitioned by local date of 'date' column and cage
+partitionColumns = ("day", "cage")
+
+
+def _arrow_type(dtype: str) -> "pa.DataType":
+    if dtype == "category":
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.from_numpy_dtype(dtype)
+
+
+def load_cage_names() -> CageNames:
+    """Cage of each TBR in 'tbrs' of metadata.toml, empty if there is no metadata."""
+    try:
+        tbrs = toml.load(metadataFile).get("tbrs", {})
+    except FileNotFoundError:
+        logger.warning(f"No {metadataFile}, all rows are archived as cage 'unknown'")
+        return {}
+    return {int(tbr["tbr_serial_id"]): str(tbr["cage_name"]) for tbr in tbrs.values()}
+
+
+def load_export_state(root: str) -> ExportState:
+    try:
+        state = toml.load(os.path.join(root, stateFile))
+    except FileNotFoundError:
+        state = {}
+    state.setdefault("sources", {})
+    state.setdefault("exported_until", {})
+    return state
+
+
+def _save_export_state(root: str, state: ExportState) -> None:
+    # Written to a temporary file first, so readers never see a partial file
+    path = os.path.join(root, stateFile)
+    with open(path + ".tmp", "w") as f:
+        toml.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+
+def _source_databases(mainPath: str) -> List[str]:
+    """Main database and its shards, oldest first."""
+    with sqlite3.connect(f"file:{mainPath}?mode=ro", uri=True) as con:
+        router = shards.ShardRouter(mainPath)
+        return [mainPath] + [router.path(s) for s in router.shards_between(con)]
+
+
+def _to_arrow(df: pd.DataFrame, table: str, cages: CageNames) -> "pa.Table":
+    df["day"] = df["date"].str.slice(0, 10)
+    if table == "positions":
+        df["cage"] = df["cage_name"]
+    else:
+        df["cage"] = df["tbr_serial_id"].map(cages).fillna(unknownCage)
+    fields = []
+    for column in df.columns:
+        dtype = columnTypes.get(column)
+        if dtype is None:
+            fields.append(pa.field(column, pa.Schema.from_pandas(df[[column]])[0].type))
+        else:
+            fields.append(pa.field(column, _arrow_type(dtype)))
+    return pa.Table.from_pandas(df, schema=pa.schema(fields), preserve_index=False)
+
+
+def export_table(
+    con: sqlite3.Connection,
+    table: str,
+    root: str,
+    source: str,
+    lastRowID: RowID,
+    cages: CageNames,
+) -> Tuple[RowID, Optional[int], int]:
+    """
+    Writes rows of table with rowid > lastRowID to Parquet files in root/table,
+    partitioned by day and cage, in chunks of chunkSize rows. Dummy rows are skipped.
+    File names are given by source and first rowid of the chunk, so an interrupted
+    export that is run again overwrites its files instead of duplicating rows.
+    Returns (last exported rowid, largest exported timestamp, number of rows).
+    """
+    maxTimestamp: Optional[int] = None
+    exported = 0
+    stem = Path(source).stem
+    partitioning = ds.partitioning(
+        pa.schema([(column, pa.string()) for column in partitionColumns]),
+        flavor="hive",
+    )
+    # Parquet 2.x format keeps uint32 columns, 1.0 widens them to int64
+    fileOptions = ds.ParquetFileFormat().make_write_options(version="2.4")
+    while True:
+        df = pd.read_sql(
+            f"SELECT rowid AS _rowid, * FROM {table} WHERE rowid > ? "
+            "ORDER BY rowid LIMIT ?",
+            con,
+            params=(lastRowID, chunkSize),
+        )
+        if df.empty:
+            return (lastRowID, maxTimestamp, exported)
+        firstRowID, lastRowID = int(df["_rowid"].iloc[0]), int(df["_rowid"].iloc[-1])
+        df = df[df["timestamp"] >= 0].drop(columns="_rowid")  # dummy rows are -1
+        if df.empty:
+            continue
+        ds.write_dataset(
+            _to_arrow(df, table, cages),
+            os.path.join(root, table),
+            format="parquet",
+            file_options=fileOptions,
+            partitioning=partitioning,
+            basename_template=f"{stem}-{firstRowID}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        timestamp = int(df["timestamp"].max())
+        if maxTimestamp is None or timestamp > maxTimestamp:
+            maxTimestamp = timestamp
+        exported += len(df.index)
+        logger.info(f"Exported {exported} rows of {table} from {source}")
+
+
+def export_database(mainPath: str, root: str = archivePath) -> Dict[str, int]:
+    """
+    Exports rows of 'tag', 'tbr', 'gps' and 'positions' of main database and its shards
+    that were added since the last export to Parquet archive in root. The last exported
+    rowid of each table and database, and the largest exported timestamp of each table
+    are kept in root/export_state.toml. Returns number of exported rows per table.
+    """
+    os.makedirs(root, exist_ok=True)
+    state = load_export_state(root)
+    cages = load_cage_names()
+    counts = dict.fromkeys(shards.shardTables, 0)
+    for source in _source_databases(mainPath):
+        name = os.path.basename(source)
+        sourceState = state["sources"].setdefault(name, {})
+        with sqlite3.connect(f"file:{source}?mode=ro", uri=True) as con:
+            for table in shards.shardTables:
+                lastRowID, maxTimestamp, exported = export_table(
+                    con, table, root, source, sourceState.get(table, 0), cages
+                )
+                sourceState[table] = lastRowID
+                if maxTimestamp is not None:
+                    until = max(maxTimestamp, state["exported_until"].get(table, 0))
+                    state["exported_until"][table] = until
+                counts[table] += exported
+                _save_export_state(root, state)
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Exports new rows of tag, tbr, gps and positions tables to a Parquet "
+            "archive partitioned by day and cage. Run from repo root."
+        )
+    )
+    parser.add_argument(
+        "database",
+        nargs="?",
+        default=dbinit.dbPath + dbinit.dbDict.get("main_database", ""),
+        help="path of main database, default is main database of db_names.toml",
+    )
+    parser.add_argument("--output", default=archivePath, help="archive directory")
+    args = parser.parse_args()
+    if pa is None:
+        sys.exit("Exporting archives requires pyarrow: pip install pyarrow")
+    if not os.path.isfile(args.database):
+        parser.error(f"no database at '{args.database}'")
+    logging.basicConfig(level=logging.INFO)
+    counts = export_database(args.database, args.output)
+    for table, count in counts.items():
+        print(f"Exported {count} new rows of {table} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
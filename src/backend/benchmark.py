@@ -0,0 +1,983 @@
+# Python built-in modules and packages
+import argparse
+import base64
+import contextlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Third-party modules and packages
+import numpy as np
+import pandas as pd
+
+# Local modules and packages
+from src.backend import ingest
+from src.backend import loadgen
+from src.backend import workers
+from src.backend.dbmanager import dbformat
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+from src.backend.dbmanager import msgbackup
+from src.backend.dbmanager import msgconversion
+from src.backend.dbmanager import positioning
+from src.backend.dbmanager import tdoa
+from src.backend.msghandler import batchdecode
+from src.backend.msghandler import conversion
+from src.backend.msghandler import msghandler
+from src.backend.msghandler import packet as pack
+from src.backend.msghandler import protocol as C
+from src.backend.msghandler import records
+
+
+# --- Useful type hints ---
+MQTTPayload = bytes
+BenchmarkResult = Dict[str, float]
+
+logger = logging.getLogger("mqtt_client.benchmark")
+
+# Start time of synthetic messages, 2019-04-29 16:29:29 UTC
+_startTimestamp = 1556555369
+
+# S64K is spelled 'S64k' in protocol.comm_protocols (KeyError when handled)
+_failingProtocols = ("S64K",)
+
+# What sqlite3 does without a storage profile: rollback journal, python's 5 s timeout
+_rollbackProfile = {
+    **dbmanager._storageDefaults,
+    "journal_mode": "delete",
+    "synchronous": "full",
+    "cache_size": -2000,
+    "mmap_size": 0,
+    "checkpoint_interval": 0,
+}
+
+
+def synthetic_mqtt_payload(tbr: int, timestamp: int, tags: int = 2) -> MQTTPayload:
+    """MQTT payload of a TBR message with tags S256 detections, as sent by gateway."""
+    data = ((tbr << 2) | 0).to_bytes(2, "big") + timestamp.to_bytes(4, "big")
+    for i in range(tags):
+        # timestamp offset, S256 code, tag id, tag data, (snr << 10 | millisecond)
+        data += bytes([i, 3, 10 + i, 35]) + ((20 << 10) | (5 * i)).to_bytes(2, "big")
+    return json.dumps({"data": base64.b64encode(data).decode(), "snr": 7.5}).encode()
+
+
+def _create_databases(directory: str, name: str) -> None:
+    """Creates empty main and backup database and points the backend to them."""
+    main = os.path.join(directory, f"{name}.db")
+    backup = os.path.join(directory, f"{name}_backup.db")
+    dbObj = dbmanager.DatabaseManager(main)
+    dbinit._create_database_tables(dbObj)
+    dbObj.close()
+    dbObj = dbmanager.DatabaseManager(backup)
+    msgbackup.create_backup_tables(dbObj)
+    dbObj.close()
+    dbmanager._dbPath = main
+    msgbackup.db = backup
+    dbmanager._msgIdAllocator.reset()
+
+
+def _clean_data_reader(
+    db: str, stop: threading.Event, profile: dbmanager.StorageProfile
+) -> List[float]:
+    """Runs the query of frontend 'clean_data' over and over, returns read times."""
+    import pandas as pd  # same read path as the frontend
+
+    query = (
+        "SELECT timestamp, tbr_serial_id, tag_id, frequency, tag_data, snr FROM tag "
+        f"WHERE timestamp BETWEEN {_startTimestamp} AND {_startTimestamp + 10**7} "
+        "ORDER BY timestamp ASC"
+    )
+    readTimes = []
+    while not stop.is_set():
+        con = sqlite3.connect(db, timeout=profile["busy_timeout"] / 1000)
+        con.execute(f"pragma cache_size = {int(profile['cache_size'])}")
+        con.execute(f"pragma mmap_size = {int(profile['mmap_size'])}")
+        t0 = time.perf_counter()
+        try:
+            pd.read_sql(query, con)
+        except Exception as e:
+            logger.error(f"{e} | clean_data read failed")
+        else:
+            readTimes.append(time.perf_counter() - t0)
+        con.close()
+    return readTimes
+
+
+def run_storage_benchmark(
+    profile: dbmanager.StorageProfile,
+    messages: int,
+    prefill: int,
+    directory: str,
+    name: str,
+    reader: bool = True,
+) -> BenchmarkResult:
+    """Ingest throughput of profile, while a clean_data read runs concurrently."""
+    dbmanager._storageProfile = profile
+    _create_databases(directory, name)
+    # Data for the reader to scan, written with the same profile
+    payloads = [
+        synthetic_mqtt_payload(1 + i % 3, _startTimestamp + i) for i in range(prefill)
+    ]
+    ingest.IngestPipeline(False)._write_batch(
+        [ingest.ReceivedMessage(time.time(), "", p) for p in payloads]
+    )
+    dbmanager.close_database_managers()
+
+    stop = threading.Event()
+    readTimes: List[float] = []
+    readThread: Optional[threading.Thread] = None
+    if reader:
+        readThread = threading.Thread(
+            target=lambda: readTimes.extend(
+                _clean_data_reader(dbmanager._dbPath, stop, profile)
+            )
+        )
+        readThread.start()
+
+    config = ingest.load_ingest_config()
+    pipeline = ingest.IngestPipeline(
+        False,
+        maxQueueSize=config["max_queue_size"],
+        batchSize=config["batch_size"],
+        flushInterval=config["flush_interval"],
+    )
+    payloads = [
+        synthetic_mqtt_payload(1 + i % 3, _startTimestamp + prefill + i)
+        for i in range(messages)
+    ]
+    pipeline.start()
+    t0 = time.perf_counter()
+    for payload in payloads:
+        pipeline.submit("benchmark", payload)
+    pipeline.stop()
+    elapsed = time.perf_counter() - t0
+    stop.set()
+    if readThread is not None:
+        readThread.join()
+
+    with sqlite3.connect(dbmanager._dbPath) as con:
+        query = "SELECT count(DISTINCT message_id) FROM tag WHERE message_id >= 0"
+        stored = con.execute(query).fetchone()[0]  # not counting dummy row
+    return {
+        "messages/s": messages / elapsed,
+        "stored": stored - prefill,
+        "reads": len(readTimes),
+        "mean read s": sum(readTimes) / len(readTimes) if readTimes else 0.0,
+    }
+
+
+def _run_worker(
+    main: str,
+    backup: str,
+    partition: workers.WorkerPartition,
+    messages: int,
+    ready: threading.Barrier,
+) -> None:
+    """Client worker without broker, handling its part of the synthetic messages."""
+    logging.basicConfig(level=logging.ERROR)
+    dbmanager._dbPath, msgbackup.db = main, backup
+    payloads = [
+        synthetic_mqtt_payload(1 + i % 7, _startTimestamp + i) for i in range(messages)
+    ]
+    pipeline = ingest.IngestPipeline(False)
+    pipeline.start()
+    ready.wait()  # all workers start receiving at the same time
+    for payload in payloads:
+        if partition.accepts(payload):
+            pipeline.submit("benchmark", payload)
+    pipeline.stop()
+
+
+def run_workers_benchmark(
+    count: int, messages: int, directory: str
+) -> BenchmarkResult:
+    """
+    Runs count client workers with tbr partitioning on the same databases, and checks
+    that every message is stored once, with a unique message_id.
+    """
+    _create_databases(directory, f"workers{count}")
+    ctx = multiprocessing.get_context("spawn")
+    ready = ctx.Barrier(count + 1)
+    processes = [
+        ctx.Process(
+            target=_run_worker,
+            args=(
+                dbmanager._dbPath,
+                msgbackup.db,
+                workers.WorkerPartition(i, count, "tbr"),
+                messages,
+                ready,
+            ),
+        )
+        for i in range(count)
+    ]
+    for p in processes:
+        p.start()
+    ready.wait()
+    t0 = time.perf_counter()
+    for p in processes:
+        p.join()
+    elapsed = time.perf_counter() - t0
+
+    with sqlite3.connect(dbmanager._dbPath) as con:
+        query = "SELECT count(DISTINCT message_id) FROM tag WHERE message_id >= 0"
+        stored = con.execute(query).fetchone()[0]
+    backupIDs = [
+        msgID
+        for rows in msgbackup.stream_backup_rows(msgbackup.db, 10000)
+        for _, msgID, _, _ in rows
+    ]
+    backups, backupIDs = len(backupIDs), len(set(backupIDs))
+    if not stored == backups == backupIDs == messages:
+        logger.error(
+            f"{count} workers stored {stored} messages, {backups} backups with "
+            f"{backupIDs} unique message_ids, expected {messages}"
+        )
+    return {"messages/s": messages / elapsed, "stored": stored, "backups": backups}
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def run_load_test(
+    generator: loadgen.MessageGenerator,
+    rate: float,
+    duration: float,
+    burstSize: int,
+    burstEvery: float,
+    directory: str,
+) -> BenchmarkResult:
+    """
+    Publishes synthetic messages to an in-process broker, which delivers them to an
+    ingest pipeline like the paho network thread of mqttclient. End-to-end latency is
+    from publish until the batch of the message is stored in main and backup database.
+    Recovery time of a burst is from the burst is published until all of it is stored.
+    """
+    _create_databases(directory, "load")
+    lock = threading.Lock()
+    # id(payload): (payload, published, burst number), payload kept so id is unique
+    sent: Dict[int, Tuple[bytes, float, int]] = {}
+    latencies: List[float] = []
+    burstStart: Dict[int, float] = {}
+    burstEnd: Dict[int, float] = {}
+    lastWritten = 0.0
+
+    def on_publish(payload: bytes, burst: int) -> None:
+        now = time.perf_counter()
+        with lock:
+            sent[id(payload)] = (payload, now, burst)
+            burstStart.setdefault(burst, now)
+
+    def on_written(batch: List[ingest.ReceivedMessage]) -> None:
+        nonlocal lastWritten
+        now = time.perf_counter()
+        with lock:
+            for item in batch:
+                _, published, burst = sent.pop(id(item.payload))
+                latencies.append(now - published)
+                if burst:
+                    burstEnd[burst] = now
+            lastWritten = now
+
+    config = ingest.load_ingest_config()
+    pipeline = ingest.IngestPipeline(
+        False,
+        maxQueueSize=config["max_queue_size"],
+        batchSize=config["batch_size"],
+        flushInterval=config["flush_interval"],
+        onWritten=on_written,
+    )
+    broker = loadgen.LocalBroker()
+
+    # Same as mqttclient.on_message, without its debug logging
+    def on_message(client: object, userdata: object, msg: loadgen.BrokerMessage):
+        pipeline.submit(msg.topic, msg.payload)
+
+    broker.subscribe("iof/load", on_message)
+    pipeline.start()
+    t0 = time.perf_counter()
+    published = loadgen.publish_load(
+        broker, generator, "iof/load", rate, duration, burstSize, burstEvery, on_publish
+    )
+    broker.stop()
+    pipeline.stop()
+
+    failed = sum(
+        msgID is None
+        for rows in msgbackup.stream_backup_rows(msgbackup.db, 10000)
+        for _, msgID, _, _ in rows
+    )
+    latencies.sort()
+    recovery = [burstEnd[b] - burstStart[b] for b in burstEnd]
+    return {
+        "published": published,
+        "messages/s": len(latencies) / (lastWritten - t0) if latencies else 0.0,
+        "p50 latency s": _percentile(latencies, 50),
+        "p99 latency s": _percentile(latencies, 99),
+        "max latency s": latencies[-1] if latencies else 0.0,
+        "bursts": len(recovery),
+        "mean recovery s": sum(recovery) / len(recovery) if recovery else 0.0,
+        "max recovery s": max(recovery, default=0.0),
+        "failed handling": failed,
+    }
+
+
+def _generic_decode(code: int, packetData: bytes) -> pack.Packet:
+    """Packet decoding as done before the decoder registry, for reference."""
+    length, _, format = pack.get_packet_length_type_and_format(code)
+    return pack.unpack_packet(packetData[:length], format)
+
+
+def _compiled_decode(code: int, packetData: bytes) -> records.PacketRecord:
+    length, _, _, decode = pack.get_packet_decoder(code)
+    return decode(packetData[:length])
+
+
+def check_decoders(samples: int, seed: Optional[int] = None) -> int:
+    """
+    Compares compiled decoders with generic unpacking for random bytes of every code
+    (including truncated packets), message headers and gps. Codes the generic path
+    can not unpack must raise the same error. Returns number of mismatches.
+    """
+    rand = random.Random(seed)
+    mismatches = 0
+    formats = [("header", C.header), ("gps", C.gps)]
+    for name, format in formats:
+        decode = pack.compile_decoder(format)
+        length = sum(segment.numBytes for segment in format)
+        for _ in range(samples):
+            data = rand.getrandbits(8 * length).to_bytes(length, "big")
+            if decode(data) != pack.unpack_packet(data, format):
+                logger.error(f"{name} decoded differently: {data.hex()}")
+                mismatches += 1
+    for code in range(256):
+        try:
+            length, _, _ = pack.get_packet_length_type_and_format(code)
+        except (ValueError, KeyError) as e:
+            try:
+                pack.get_packet_decoder(code)
+            except type(e):
+                continue
+            logger.error(f"code {code} does not raise {type(e).__name__}")
+            mismatches += 1
+            continue
+        for i in range(samples):
+            data = bytearray(rand.getrandbits(8 * length).to_bytes(length, "big"))
+            data[C.CODE_INDEX] = code
+            data = bytes(data[: rand.randrange(1, length)] if i % 10 == 0 else data)
+            packet = _compiled_decode(code, data).asdict()
+            del packet["packetType"]
+            if packet != _generic_decode(code, data):
+                logger.error(f"code {code} decoded differently: {data.hex()}")
+                mismatches += 1
+    return mismatches
+
+
+def run_decode_benchmark(
+    packets: int, seed: Optional[int] = None
+) -> Dict[str, BenchmarkResult]:
+    """Packets per second of generic and compiled decoding, per comm protocol."""
+    rand = random.Random(seed)
+    codes: Dict[str, List[int]] = {"TBR": [C.CODE_TBR]}
+    for code, (comm, _) in C.codetypes.items():
+        if comm not in _failingProtocols:
+            codes.setdefault(comm, []).append(code)
+    results = {}
+    for comm, commCodes in codes.items():
+        samples = []
+        for _ in range(packets):
+            code = rand.choice(commCodes)
+            length = pack.decoders[code].length
+            data = bytearray(rand.getrandbits(8 * length).to_bytes(length, "big"))
+            data[C.CODE_INDEX] = code
+            samples.append((code, bytes(data)))
+        result = {}
+        decoders = (("generic", _generic_decode), ("compiled", _compiled_decode))
+        for label, decode in decoders:
+            t0 = time.perf_counter()
+            for code, data in samples:
+                decode(code, data)
+            result[f"{label} packets/s"] = packets / (time.perf_counter() - t0)
+        result["speedup"] = result["compiled packets/s"] / result["generic packets/s"]
+        results[comm] = result
+    return results
+
+
+def run_batch_decode_benchmark(
+    generator: loadgen.MessageGenerator, messages: int
+) -> BenchmarkResult:
+    """
+    Decodes messages to database rows one at a time with msghandler, and at once with
+    msghandler.batchdecode. Returns messages/s of both, and the number of rows that
+    differ (messages failing handling must fail in both).
+    """
+    data = [generator.message(_startTimestamp + 60 * i) for i in range(messages)]
+    t0 = time.perf_counter()
+    expected: msgconversion.DatabaseRows = {}
+    for i, message in enumerate(data):
+        try:
+            msg = msghandler.handle_message(message)
+        except Exception:
+            continue
+        for packet in msgconversion.convert_msg_to_database_format(msg, i):
+            key = (packet.table, packet.columns)
+            expected.setdefault(key, []).append((i, packet.values))
+    t1 = time.perf_counter()
+    batch = batchdecode.decode_messages(data)
+    rows = msgconversion.convert_batch_to_database_format(batch, range(messages))
+    t2 = time.perf_counter()
+
+    mismatches = 0
+    for key in set(expected) | set(rows):
+        mismatches += len(set(expected.get(key, [])) ^ set(rows.get(key, [])))
+    return {
+        "msghandler messages/s": messages / (t1 - t0),
+        "batchdecode messages/s": messages / (t2 - t1),
+        "mismatched rows": mismatches,
+    }
+
+
+def _dict_packet(header: pack.Packet, packet: Dict, type: str) -> Dict:
+    """Packet dict with tbr_serial_id, packetType and converted datafields."""
+    if type == "gps":
+        packet["timestamp"] = 0
+    offset = packet["timestamp"]
+    timestamp = header["ref_timestamp"] + offset
+    if offset > 250:
+        timestamp = header["ref_timestamp"] - (255 - offset)
+    tbr_id = header["tbr_serial_id"]
+    packet.update({"tbr_serial_id": tbr_id, "timestamp": timestamp, "packetType": type})
+    return conversion.convert_packet_payload(packet)
+
+
+# Compiled decoders giving packet dicts, for _handle_message_dicts
+_dictDecoders = {
+    code: pack.compile_decoder(decoder.format)
+    for code, decoder in pack.decoders.items()
+}
+_dictHeader = pack.compile_decoder(C.header)
+_dictGps = pack.compile_decoder(C.gps)
+
+
+def _handle_message_dicts(data: bytes) -> msghandler.Message:
+    """Message handling with a dict per packet, as before packet records."""
+    header = _dictHeader(data[: C.HEADER_00B_INDEX])
+    index, payload = C.HEADER_00B_INDEX, []
+    if header["headerType"] == C.HEADER_TYPE_GPS:
+        packet = _dictGps(data[index : C.HEADER_GPS_INDEX])
+        payload.append(_dict_packet(header, packet, "gps"))
+        index = C.HEADER_GPS_INDEX
+    while index < len(data):
+        code = data[index + C.CODE_INDEX]
+        length, type = pack.decoders[code].length, pack.decoders[code].type
+        packet = _dictDecoders[code](data[index : index + length])
+        payload.append(_dict_packet(header, packet, type))
+        index += length
+    return msghandler.Message(header, payload)
+
+
+def _dict_rows(msg: msghandler.Message, msgID: int) -> List[Tuple[str, Tuple]]:
+    rows = []
+    for packet in msgconversion.convert_msg_to_database_format(msg, msgID):
+        rows.append((packet.sql_query, packet.values))
+    return rows
+
+
+def _record_rows(msg: msghandler.Message, msgID: int) -> List[Tuple[str, Tuple]]:
+    return [(packet.sql_insert, packet.values(msgID)) for packet in msg.payload]
+
+
+def run_records_benchmark(
+    generator: loadgen.MessageGenerator, messages: int
+) -> Dict[str, BenchmarkResult]:
+    """
+    Decodes, converts and turns messages into database rows with packet dicts and
+    with packet records. Reports messages/s, memory kept by the decoded messages and
+    its number of allocated blocks per packet, and peak memory allocated while making
+    rows. Memory is traced with tracemalloc, separately from timing.
+    """
+    data = [generator.message(_startTimestamp + 60 * i) for i in range(messages)]
+    paths: Dict[str, Tuple[Callable[[bytes], Any], Callable]] = {
+        "dicts": (_handle_message_dicts, _dict_rows),
+        "records": (msghandler.handle_message, _record_rows),
+    }
+    results = {}
+    for label, (handle, to_rows) in paths.items():
+        t0 = time.perf_counter()
+        for i, message in enumerate(data):
+            to_rows(handle(message), i)
+        elapsed = time.perf_counter() - t0
+
+        tracemalloc.start()
+        decoded = [handle(message) for message in data]
+        kept, _ = tracemalloc.get_traced_memory()
+        statistics = tracemalloc.take_snapshot().statistics("filename")
+        tracemalloc.stop()
+        tracemalloc.start()
+        rows = [to_rows(msg, i) for i, msg in enumerate(decoded)]
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        packets = sum(len(msg.payload) for msg in decoded)
+        results[label] = {
+            "messages/s": len(data) / elapsed,
+            "decoded KiB": kept / 1024,
+            "blocks/packet": sum(s.count for s in statistics) / packets,
+            "rows peak KiB": peak / 1024,
+        }
+        del decoded, rows
+    return results
+
+
+def run_backup_benchmark(
+    generator: loadgen.MessageGenerator, messages: int, batchSize: int, directory: str
+) -> Dict[str, BenchmarkResult]:
+    """
+    Stores messages in backup database one row and commit per message as base64 text
+    (as done before backup blocks), and in compressed blocks per batch of batchSize
+    messages with each available compression. Reports bytes per message of the
+    database file, messages/s, and messages that do not read back to their payload.
+    """
+    payloads = [
+        msgbackup.mqtt_payload(generator.message(_startTimestamp + i), 7.5)
+        for i in range(messages)
+    ]
+    msgs = [(json.loads(payload), i) for i, payload in enumerate(payloads)]
+    compressions = ["none", "zlib"] + ["zstd"] * (msgbackup.zstandard is not None)
+    profile = dbmanager.load_storage_profile()
+    results = {}
+    for label in ["base64 rows"] + [f"{c} blocks" for c in compressions]:
+        path = os.path.join(directory, f"{label.replace(' ', '_')}.db")
+        dbObj = dbmanager.DatabaseManager(path)
+        if label == "base64 rows":
+            dbObj.add_del_update_db_record(dbformat.sql_query_backup_create_table())
+            t0 = time.perf_counter()
+            for msg, msgID in msgs:
+                dbObj.add_del_update_db_record(
+                    "INSERT INTO backup (message_id, data, snr) VALUES (?, ?, ?)",
+                    (msgID, msg["data"], msg["snr"]),
+                )
+        else:
+            msgbackup.create_backup_tables(dbObj)
+            dbmanager._storageProfile = {
+                **profile,
+                "backup_compression": label.split()[0],
+            }
+            msgbackup.db = path
+            t0 = time.perf_counter()
+            for i in range(0, messages, batchSize):
+                msgbackup.store_messages_to_backup_db(msgs[i : i + batchSize])
+        elapsed = time.perf_counter() - t0
+        dbObj.close()
+        dbmanager.close_database_managers()
+
+        mismatched = messages
+        for rows in msgbackup.stream_backup_rows(path, 10000):
+            for _, msgID, data, snr in rows:
+                mismatched -= msgbackup.mqtt_payload(data, snr) == payloads[msgID]
+        results[label] = {
+            "bytes/message": os.path.getsize(path) / messages,
+            "messages/s": messages / elapsed,
+            "mismatched": mismatched,
+        }
+    dbmanager._storageProfile = profile
+    return results
+
+
+def _synthetic_triplets(
+    stations: tdoa.StationData, triplets: int, seed: Optional[int] = None
+) -> positioning.TripletArrays:
+    """
+    Triplets of tags in a 40 m radius around the stations, with arrival times rounded
+    to milliseconds plus noise. Every tenth triplet arrives at the same time in station
+    A and B, and every hundredth in all stations, the special cases of the algorithm.
+    """
+    rand = np.random.default_rng(seed)
+    points = [stations.xyz_A, stations.xyz_B, stations.xyz_C]
+    center = np.mean([[p.x, p.y] for p in points], axis=0)
+    angle = rand.uniform(0, 2 * np.pi, triplets)
+    radius = 40 * np.sqrt(rand.uniform(0, 1, triplets))
+    x = center[0] + radius * np.cos(angle)
+    y = center[1] + radius * np.sin(angle)
+    depths = rand.uniform(stations.depth, 20, triplets)
+    z = depths - stations.depth
+    toa = np.stack(
+        [np.sqrt((x - p.x) ** 2 + (y - p.y) ** 2 + z ** 2) / 1500 for p in points],
+        axis=1,
+    )
+    ms = np.round(toa * 1000 + rand.normal(0, 2, (triplets, 3))).astype(np.int64)
+    ms += 1000 * _startTimestamp + 995
+    ms[::10, 1] = ms[::10, 0]
+    ms[::100, 2] = ms[::100, 0]
+    return (depths, ms // 1000, ms % 1000)
+
+
+def run_tdoa_benchmark(triplets: int, seed: Optional[int] = None) -> BenchmarkResult:
+    """
+    Positions synthetic triplets one at a time with positioning.position_tag, and at
+    once with positioning.position_tags. Returns triplets/s of both, and the number of
+    triplets whose validity or position differ (by more than a micrometre).
+    """
+    stations = tdoa.StationData(
+        730,
+        734,
+        836,
+        tdoa.LatLong(63.4390, 10.3984),
+        tdoa.LatLong(63.4395, 10.3990),
+        tdoa.LatLong(63.4391, 10.3995),
+        3.0,
+    )
+    cage = positioning.CageMeta("synthetic", [[730, 734, 836]], 3.0, None)
+    depths, sec, msec = _synthetic_triplets(stations, triplets, seed)
+    t0 = time.perf_counter()
+    expected = []
+    with contextlib.redirect_stdout(io.StringIO()):  # special cases are printed
+        for depth, (sec_a, sec_b, sec_c), (msec_a, msec_b, msec_c) in zip(
+            depths, sec.tolist(), msec.tolist()
+        ):
+            tstamps = tdoa.Timestamps(sec_a, sec_b, sec_c, msec_a, msec_b, msec_c)
+            expected.append(positioning.position_tag(cage, stations, depth, tstamps))
+    t1 = time.perf_counter()
+    x, y, z, valid = positioning.position_tags(cage, stations, depths, sec, msec)
+    t2 = time.perf_counter()
+
+    mismatches = 0
+    for i, position in enumerate(expected):
+        if position is None or not valid[i]:
+            mismatches += (position is None) == valid[i]
+            continue
+        xyz = (position.x, position.y, position.z)
+        mismatches += not np.allclose(xyz, (x[i], y[i], z[i]), rtol=0, atol=1e-6)
+    return {
+        "scalar triplets/s": triplets / (t1 - t0),
+        "batch triplets/s": triplets / (t2 - t1),
+        "positioned": int(valid.sum()),
+        "mismatches": mismatches,
+    }
+
+
+def _synthetic_detections(messages: int, seed: Optional[int] = None) -> pd.DataFrame:
+    """
+    Detections of messages of a tag by three TBRs, 3 to 30 s apart, with arrival
+    times around a second boundary. Some detections are missing, repeated, or have
+    the TBR ID of another detection of the message.
+    """
+    rand = np.random.default_rng(seed)
+    sent = _startTimestamp + np.cumsum(rand.integers(3, 31, messages))
+    ms = 1000 * np.repeat(sent, 3) + 990 + rand.integers(0, 30, 3 * messages)
+    tbr = np.tile([730, 734, 836], messages)
+    tbr[rand.random(tbr.size) < 0.02] = 730
+    keep = rand.random(tbr.size) >= 0.02
+    rows = np.repeat(np.flatnonzero(keep), 1 + (rand.random(keep.sum()) < 0.02))
+    return pd.DataFrame(
+        {
+            "timestamp": (ms[rows] // 1000).astype("uint32"),
+            "tbr_serial_id": tbr[rows].astype("uint16"),
+            "tag_data": np.repeat(rand.uniform(0, 20, messages), 3)[rows],
+            "millisecond": (ms[rows] % 1000).astype("uint16"),
+        }
+    )
+
+
+def run_triplets_benchmark(
+    messages: int, seed: Optional[int] = None
+) -> BenchmarkResult:
+    """
+    Finds triplets of synthetic detections as a list of DataFrames that are checked
+    one by one, like positioning did before, and with positioning.find_triplets.
+    Returns detections/s of both, and the number of triplets that differ.
+    """
+    df = _synthetic_detections(messages, seed)
+    detections = len(df.index)
+    t0 = time.perf_counter()
+    expected = [
+        triplet
+        for triplet in positioning._adjust_tstamp_drift_of_triplet(df)
+        if len(triplet.tbr_serial_id.unique()) == 3 and len(triplet.index) == 3
+    ]
+    t1 = time.perf_counter()
+    rows, timestamps = positioning.find_triplets(
+        df.timestamp.to_numpy(), df.millisecond.to_numpy(), df.tbr_serial_id.to_numpy()
+    )
+    t2 = time.perf_counter()
+
+    mismatches = abs(len(expected) - len(rows))
+    for triplet, tripletRows in zip(expected, rows):
+        found = df.iloc[tripletRows].assign(timestamp=timestamps[tripletRows])
+        columns = ["timestamp", "millisecond", "tbr_serial_id", "tag_data"]
+        mismatches += not np.array_equal(
+            triplet[columns].to_numpy(), found[columns].to_numpy()
+        )
+    return {
+        "dataframes detections/s": detections / (t1 - t0),
+        "arrays detections/s": detections / (t2 - t1),
+        "triplets": len(rows),
+        "mismatches": mismatches,
+    }
+
+
+def records_benchmark(args: argparse.Namespace) -> None:
+    generator = loadgen.MessageGenerator(
+        tbrs=range(1, args.tbrs + 1),
+        protocols=args.protocols,
+        packets=args.packets,
+        seed=args.seed,
+    )
+    for label, result in run_records_benchmark(generator, args.messages).items():
+        values = ", ".join(f"{k}: {v:.6g}" for k, v in result.items())
+        print(f"{label:10s} {values}")
+
+
+def backup(args: argparse.Namespace) -> None:
+    generator = loadgen.MessageGenerator(
+        tbrs=range(1, args.tbrs + 1), packets=args.packets, seed=args.seed
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        results = run_backup_benchmark(
+            generator, args.messages, args.batch_size, directory
+        )
+    for label, result in results.items():
+        values = ", ".join(f"{k}: {v:.6g}" for k, v in result.items())
+        print(f"{label:15s} {values}")
+    if any(result["mismatched"] for result in results.values()):
+        raise SystemExit(1)
+
+
+def batch_decode(args: argparse.Namespace) -> None:
+    generator = loadgen.MessageGenerator(
+        tbrs=range(1, args.tbrs + 1),
+        protocols=args.protocols,
+        packets=args.packets,
+        seed=args.seed,
+    )
+    result = run_batch_decode_benchmark(generator, args.messages)
+    for key, value in result.items():
+        print(f"{key:25s} {value:.6g}")
+    if result["mismatched rows"]:
+        raise SystemExit(1)
+
+
+def tdoa_batch(args: argparse.Namespace) -> None:
+    result = run_tdoa_benchmark(args.triplets, args.seed)
+    for key, value in result.items():
+        print(f"{key:20s} {value:.6g}")
+    if result["mismatches"]:
+        raise SystemExit(1)
+
+
+def triplets(args: argparse.Namespace) -> None:
+    result = run_triplets_benchmark(args.messages, args.seed)
+    for key, value in result.items():
+        print(f"{key:25s} {value:.6g}")
+    if result["mismatches"]:
+        raise SystemExit(1)
+
+
+def decode(args: argparse.Namespace) -> None:
+    mismatches = check_decoders(args.samples, args.seed)
+    print(f"{'equivalence':20s} {mismatches} mismatches")
+    for comm, result in run_decode_benchmark(args.packets, args.seed).items():
+        values = ", ".join(f"{k}: {v:.6g}" for k, v in result.items())
+        print(f"{comm:20s} {values}")
+    if mismatches:
+        raise SystemExit(1)
+
+
+def load(args: argparse.Namespace) -> None:
+    generator = loadgen.MessageGenerator(
+        tbrs=range(1, args.tbrs + 1),
+        protocols=args.protocols,
+        packets=args.packets,
+        seed=args.seed,
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        result = run_load_test(
+            generator,
+            args.rate,
+            args.duration,
+            args.burst_size,
+            args.burst_every,
+            directory,
+        )
+    for key, value in result.items():
+        print(f"{key:20s} {value:.6g}")
+
+
+def storage(args: argparse.Namespace) -> None:
+    profiles = {
+        "rollback (sqlite3 defaults)": _rollbackProfile,
+        "configured (db_names.toml)": dbmanager.load_storage_profile(),
+    }
+    with tempfile.TemporaryDirectory() as directory:
+        for i, (label, profile) in enumerate(profiles.items()):
+            result = run_storage_benchmark(
+                profile, args.messages, args.prefill, directory, f"run{i}", args.reader
+            )
+            values = ", ".join(f"{k}: {v:.6g}" for k, v in result.items())
+            print(f"{label:30s} {values}")
+
+
+def worker_processes(args: argparse.Namespace) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        for count in args.workers:
+            result = run_workers_benchmark(count, args.messages, directory)
+            values = ", ".join(f"{k}: {v:.6g}" for k, v in result.items())
+            print(f"{count} workers{'':20s} {values}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Benchmarks of the MQTT client backend, run from repo root"
+    )
+    subparsers = parser.add_subparsers(dest="benchmark")
+    subparsers.required = True
+
+    p = subparsers.add_parser(
+        "storage",
+        help="ingest throughput per storage profile, with concurrent clean_data read",
+    )
+    p.add_argument("--messages", type=int, default=20000)
+    p.add_argument("--prefill", type=int, default=50000)
+    p.add_argument("--no-reader", dest="reader", action="store_false")
+    p.set_defaults(func=storage)
+
+    p = subparsers.add_parser(
+        "workers",
+        help="ingest throughput and message_id uniqueness with N client workers",
+    )
+    p.add_argument("--messages", type=int, default=20000)
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    p.set_defaults(func=worker_processes)
+
+    p = subparsers.add_parser(
+        "load",
+        help=(
+            "throughput, end-to-end latency and burst recovery of synthetic load, "
+            "published to an in-process broker"
+        ),
+    )
+    p.add_argument("--rate", type=float, default=200, help="messages per second")
+    p.add_argument("--duration", type=float, default=20, help="seconds")
+    p.add_argument("--burst-size", type=int, default=0, help="messages per burst")
+    p.add_argument("--burst-every", type=float, default=5, help="seconds")
+    p.add_argument("--tbrs", type=int, default=3, help="number of TBRs")
+    p.add_argument("--packets", type=int, default=4, help="tag packets per message")
+    p.add_argument(
+        "--protocols",
+        nargs="+",
+        default=[p for p in loadgen.C.COMM_PROTOCOL_LIST if p not in _failingProtocols],
+        choices=loadgen.C.COMM_PROTOCOL_LIST,
+        help=(
+            f"comm protocols of tag packets, {' and '.join(_failingProtocols)} must be "
+            "chosen explicitly since its packets currently fail handling"
+        ),
+    )
+    p.add_argument("--seed", type=int)
+    p.set_defaults(func=load)
+
+    p = subparsers.add_parser(
+        "decode",
+        help=(
+            "equivalence of compiled packet decoders with generic unpacking, and "
+            "packets/s of both per comm protocol"
+        ),
+    )
+    p.add_argument("--samples", type=int, default=500, help="random packets per code")
+    p.add_argument("--packets", type=int, default=100000, help="per comm protocol")
+    p.add_argument("--seed", type=int)
+    p.set_defaults(func=decode)
+
+    p = subparsers.add_parser(
+        "batchdecode",
+        help=(
+            "messages/s of msghandler and batchdecode decoding to database rows, and "
+            "that both give the same rows"
+        ),
+    )
+    p.add_argument("--messages", type=int, default=20000)
+    p.add_argument("--tbrs", type=int, default=10, help="number of TBRs")
+    p.add_argument("--packets", type=int, default=4, help="tag packets per message")
+    p.add_argument(
+        "--protocols",
+        nargs="+",
+        default=loadgen.C.COMM_PROTOCOL_LIST,
+        choices=loadgen.C.COMM_PROTOCOL_LIST,
+    )
+    p.add_argument("--seed", type=int)
+    p.set_defaults(func=batch_decode)
+
+    p = subparsers.add_parser(
+        "records",
+        help=(
+            "messages/s and memory of message handling to database rows, with packet "
+            "dicts and with packet records"
+        ),
+    )
+    p.add_argument("--messages", type=int, default=20000)
+    p.add_argument("--tbrs", type=int, default=10, help="number of TBRs")
+    p.add_argument("--packets", type=int, default=4, help="tag packets per message")
+    p.add_argument(
+        "--protocols",
+        nargs="+",
+        default=[p for p in loadgen.C.COMM_PROTOCOL_LIST if p != "S64K"],
+        choices=[p for p in loadgen.C.COMM_PROTOCOL_LIST if p != "S64K"],
+        help="comm protocols of tag packets, S64K can not be handled",
+    )
+    p.add_argument("--seed", type=int)
+    p.set_defaults(func=records_benchmark)
+
+    p = subparsers.add_parser(
+        "backup",
+        help=(
+            "size and messages/s of backup database, with base64 rows and with "
+            "compressed blocks, and that messages read back to their payload"
+        ),
+    )
+    p.add_argument("--messages", type=int, default=20000)
+    p.add_argument("--batch-size", type=int, default=100, help="messages per batch")
+    p.add_argument("--tbrs", type=int, default=10, help="number of TBRs")
+    p.add_argument("--packets", type=int, default=4, help="tag packets per message")
+    p.add_argument("--seed", type=int)
+    p.set_defaults(func=backup)
+
+    p = subparsers.add_parser(
+        "tdoa",
+        help=(
+            "triplets/s of TDOA positioning one triplet at a time and in batches, "
+            "and that both give the same positions"
+        ),
+    )
+    p.add_argument("--triplets", type=int, default=20000)
+    p.add_argument("--seed", type=int)
+    p.set_defaults(func=tdoa_batch)
+
+    p = subparsers.add_parser(
+        "triplets",
+        help=(
+            "detections/s of finding tag triplets with dataframes and arrays, and "
+            "that both find the same triplets"
+        ),
+    )
+    p.add_argument("--messages", type=int, default=30000)
+    p.add_argument("--seed", type=int)
+    p.set_defaults(func=triplets)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
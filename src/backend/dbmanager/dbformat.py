@@ -1,5 +1,6 @@
 # Python built-in modules and packages
-from typing import Tuple, Union
+from functools import lru_cache
+from typing import Dict, List, Tuple, Union
 
 
 # --- Useful type hints ---
@@ -7,6 +8,7 @@ TableQuerySQL = str
 TableInsertSQL = str
 RowQuerySQL = str
 TableDummySQL = Tuple[TableQuerySQL, RowQuerySQL, Tuple[Union[int, str]]]
+IndexSQL = str
 
 
 # *-----------------------------*
@@ -18,6 +20,22 @@ def _sql_values_string(numOfValues: int) -> str:
     return f"({'?, '*(numOfValues-1)}?)"
 
 
+@lru_cache(maxsize=None)
+def sql_insert_strings(
+    table: str, columns: Tuple[str, ...]
+) -> Tuple[str, str, TableInsertSQL]:
+    """
+    Returns columns string '(col_1, ..., col_n)', values string '(?, ..., ?)' and
+    insert query of table and columns. Cached, so the strings of each distinct table
+    and columns are built once, and packets of the same shape share one query text
+    (also hitting the statement cache of the sqlite3 connection).
+    """
+    sql_columns = f"({', '.join(columns)})"
+    sql_values = _sql_values_string(len(columns))
+    sql_query = sql_query_insert_packet(table, sql_columns, sql_values)
+    return sql_columns, sql_values, sql_query
+
+
 def conversion_columns_values_len() -> Tuple[str, str, str, str, int]:
     # create sql insertion queries
     conv = """
@@ -40,7 +58,7 @@ def conversion_columns_values_len() -> Tuple[str, str, str, str, int]:
 # *--------------------------*
 
 
-def sql_query_gps_create_table_dummy() -> TableDummySQL:
+def sql_query_gps_create_table_dummy(schema: str = "main") -> TableDummySQL:
     """
     returns table gps create statement, dummy data insertion, and dummy data.
     The dummy data is not constructed correctly, all are equal to -1 for
@@ -56,8 +74,8 @@ def sql_query_gps_create_table_dummy() -> TableDummySQL:
     5 decimal places.
 
     """
-    query = """
-        CREATE TABLE IF NOT EXISTS gps (
+    query = f"""
+        CREATE TABLE IF NOT EXISTS {schema}.gps (
             message_id INTEGER NOT NULL,
             timestamp INTEGER NOT NULL,
             date TEXT NOT NULL,
@@ -82,7 +100,7 @@ def sql_query_gps_create_table_dummy() -> TableDummySQL:
     return (query, dummy_query, dummy_data)
 
 
-def sql_query_tag_create_table_dummy() -> TableDummySQL:
+def sql_query_tag_create_table_dummy(schema: str = "main") -> TableDummySQL:
     """
     returns table tage create statement, dummy data insertion, and dummy data.
     The dummy data is not constructed correctly, all are equal to -1 for
@@ -91,8 +109,8 @@ def sql_query_tag_create_table_dummy() -> TableDummySQL:
     Example where the right types of data is used in gps message:
         | (1, 33, 754605000, "S256", 69, 88, 6.2, 31, 17, 330)
     """
-    query = """
-        CREATE TABLE IF NOT EXISTS tag (
+    query = f"""
+        CREATE TABLE IF NOT EXISTS {schema}.tag (
             message_id INTEGER NOT NULL,
             timestamp INTEGER NOT NULL,
             date TEXT NOT NULL,
@@ -118,7 +136,7 @@ def sql_query_tag_create_table_dummy() -> TableDummySQL:
     return (query, dummy_query, dummy_data)
 
 
-def sql_query_tbr_create_table_dummy() -> TableDummySQL:
+def sql_query_tbr_create_table_dummy(schema: str = "main") -> TableDummySQL:
     """
     returns table tbr create statement, dummy data insertion, and dummy data.
     The dummy data is not constructed correctly, all are equal to -1 for
@@ -133,8 +151,8 @@ def sql_query_tbr_create_table_dummy() -> TableDummySQL:
     these numbers should have fixed-precision set to 1 decimal places.
 
     """
-    query = """
-        CREATE TABLE IF NOT EXISTS tbr (
+    query = f"""
+        CREATE TABLE IF NOT EXISTS {schema}.tbr (
             message_id INTEGER NOT NULL,
             timestamp INTEGER NOT NULL,
             date TEXT NOT NULL,
@@ -182,9 +200,9 @@ def sql_query_metadata_create_table() -> TableQuerySQL:
     return query
 
 
-def sql_query_positions_create_table() -> TableQuerySQL:
-    query = """
-        CREATE TABLE IF NOT EXISTS positions (
+def sql_query_positions_create_table(schema: str = "main") -> TableQuerySQL:
+    query = f"""
+        CREATE TABLE IF NOT EXISTS {schema}.positions (
             timestamp INTEGER NOT NULL,
             date TEXT NOT NULL,
             hour INTEGER NOT NULL,
@@ -202,7 +220,80 @@ def sql_query_positions_create_table() -> TableQuerySQL:
     return query
 
 
+def sql_query_message_sequence_create_table() -> TableQuerySQL:
+    """
+    Returns table message_sequence create statement. The table holds the next unused
+    message_id, so that message_ids can be reserved in blocks without looking through
+    the 'tag', 'tbr' and 'gps' tables.
+    """
+    query = """
+        CREATE TABLE IF NOT EXISTS message_sequence (
+            name TEXT PRIMARY KEY,
+            next_id INTEGER NOT NULL
+        );"""
+    return query
+
+
+def sql_query_shards_create_table() -> TableQuerySQL:
+    """
+    Returns table shards create statement. The table is the catalog of shard databases
+    of the main database, with file name and time range [start, end) of each shard.
+    """
+    query = """
+        CREATE TABLE IF NOT EXISTS main.shards (
+            name TEXT PRIMARY KEY,
+            start_timestamp INTEGER NOT NULL,
+            end_timestamp INTEGER NOT NULL
+        );"""
+    return query
+
+
+def sql_query_station_fixes_create_table() -> TableQuerySQL:
+    """
+    Returns table station_fixes create statement. The table holds the newest '3D-fix'
+    position of each TBR in the 'gps' table for each pdop class, where class k holds
+    pdop in [k - 1, k), see sql_query_station_fixes_upsert.
+    """
+    query = """
+        CREATE TABLE IF NOT EXISTS main.station_fixes (
+            tbr_serial_id INTEGER NOT NULL,
+            pdop_class INTEGER NOT NULL,
+            timestamp INTEGER NOT NULL,
+            latitude DECIMAL(7,5),
+            longitude DECIMAL(8,5),
+            PRIMARY KEY (tbr_serial_id, pdop_class)
+        );"""
+    return query
+
+
+def sql_query_positioning_watermark_create_table() -> TableQuerySQL:
+    """
+    Returns table positioning_watermark create statement. The table holds the largest
+    rowid of 'tag' rows that python -m src.backend.reposition has positioned, for each
+    depth tag, set of TBRs and source database (file name of main database or shard).
+    Rowids grow in order of insertion within a database, message_ids do not: each
+    worker process reserves its own block of message_ids.
+    """
+    query = """
+        CREATE TABLE IF NOT EXISTS main.positioning_watermark (
+            tag_id INTEGER NOT NULL,
+            frequency INTEGER NOT NULL,
+            tbr_a INTEGER NOT NULL,
+            tbr_b INTEGER NOT NULL,
+            tbr_c INTEGER NOT NULL,
+            source TEXT NOT NULL,
+            last_rowid INTEGER NOT NULL,
+            PRIMARY KEY (tag_id, frequency, tbr_a, tbr_b, tbr_c, source)
+        );"""
+    return query
+
+
 def sql_query_backup_create_table() -> TableQuerySQL:
+    """
+    Returns table backup create statement. Backup databases created before the
+    backup_block and backup_message tables stored one base64 message per row here,
+    the table is only read by msgbackup now.
+    """
     query = """
         CREATE TABLE IF NOT EXISTS backup (
             message_id INTEGER,
@@ -212,6 +303,262 @@ def sql_query_backup_create_table() -> TableQuerySQL:
     return query
 
 
+def sql_query_backup_block_create_table() -> TableQuerySQL:
+    """
+    Returns table backup_block create statement. Each row holds count messages of a
+    batch, packed by msgbackup and compressed as given by compression. The smallest
+    and largest message_id of the block are kept to find the block of a message.
+    """
+    query = """
+        CREATE TABLE IF NOT EXISTS backup_block (
+            block_id INTEGER PRIMARY KEY,
+            first_message_id INTEGER,
+            last_message_id INTEGER,
+            count INTEGER NOT NULL,
+            compression TEXT NOT NULL,
+            data BLOB NOT NULL
+        );"""
+    return query
+
+
+# *-------------------*
+# | INDEX SQL QUERIES |
+# *-------------------*
+
+# Secondary indexes of the main database, {index name: (table, columns)}
+# | tag_df and all_tag_freq_detections of positioning look up tag_id and frequency
+# | (and timestamp range), latest_TBR_pos looks up tbr_serial_id and fix ordered by
+# | timestamp, frontend reads filter on timestamp range, and message_id seeds the
+# | message_sequence. positions needs no timestamp index, its UNIQUE constraint
+# | already indexes (timestamp, tag_id, frequency).
+indexes: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "idx_tag_tag_id_frequency_timestamp": ("tag", ("tag_id", "frequency", "timestamp")),
+    "idx_tag_timestamp": ("tag", ("timestamp",)),
+    "idx_tag_message_id": ("tag", ("message_id",)),
+    "idx_tbr_timestamp": ("tbr", ("timestamp",)),
+    "idx_tbr_message_id": ("tbr", ("message_id",)),
+    "idx_gps_tbr_serial_id_fix_timestamp": (
+        "gps",
+        ("tbr_serial_id", "fix", "timestamp"),
+    ),
+    "idx_gps_message_id": ("gps", ("message_id",)),
+    "idx_positions_tag_id_frequency_timestamp": (
+        "positions",
+        ("tag_id", "frequency", "timestamp"),
+    ),
+}
+
+
+def sql_query_create_index(name: str, schema: str = "main") -> IndexSQL:
+    table, columns = indexes[name]
+    sql_query = (
+        f"CREATE INDEX IF NOT EXISTS {schema}.{name} ON {table} ({', '.join(columns)});"
+    )
+    return sql_query
+
+
+def sql_query_create_indexes(schema: str = "main") -> List[IndexSQL]:
+    return [sql_query_create_index(name, schema) for name in indexes]
+
+
+def sql_query_get_indexes() -> RowQuerySQL:
+    sql_query = "SELECT name FROM sqlite_master WHERE type = 'index';"
+    return sql_query
+
+
+def sql_query_backup_block_create_index() -> IndexSQL:
+    # Backup database, finds the blocks that may hold a message_id
+    sql_query = """
+        CREATE INDEX IF NOT EXISTS idx_backup_block_message_id
+        ON backup_block (first_message_id, last_message_id);"""
+    return sql_query
+
+
+# *--------------------*
+# | ROLLUP SQL QUERIES |
+# *--------------------*
+
+# Rollup tables of the dashboards, {table: (group columns, value columns)}
+# | '{table}_rollup_{granularity}' holds the number of rows, and the count of non-NULL
+# | values, sum, min and max of each value column, per bucket of its granularity and
+# | group. bucket is the first timestamp of the bucket (UTC).
+rollups: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {
+    "tag": (
+        ("tag_id", "frequency", "tbr_serial_id", "comm_protocol"),
+        ("tag_data", "snr"),
+    ),
+    "tbr": (("tbr_serial_id",), ("temperature", "noise_avg", "noise_peak")),
+}
+rollupGranularities = {"minute": 60, "hour": 3600, "day": 86400}
+
+
+def rollup_table(table: str, granularity: str) -> str:
+    return f"{table}_rollup_{granularity}"
+
+
+def sql_query_rollup_create_table(table: str, granularity: str) -> TableQuerySQL:
+    groupColumns, valueColumns = rollups[table]
+    columns = ["bucket INTEGER NOT NULL"]
+    for column in groupColumns:
+        type = "TEXT" if column == "comm_protocol" else "INTEGER"
+        columns.append(f"{column} {type} NOT NULL")
+    columns.append("count INTEGER NOT NULL")
+    for column in valueColumns:
+        columns += [
+            f"{column}_count INTEGER NOT NULL",
+            f"{column}_sum REAL NOT NULL",
+            f"{column}_min REAL",
+            f"{column}_max REAL",
+        ]
+    columns.append(f"PRIMARY KEY (bucket, {', '.join(groupColumns)})")
+    query = (
+        f"CREATE TABLE IF NOT EXISTS {rollup_table(table, granularity)} "
+        f"({', '.join(columns)});"
+    )
+    return query
+
+
+def rollup_columns(table: str) -> List[str]:
+    """Columns of the rollup tables of table, in order."""
+    groupColumns, valueColumns = rollups[table]
+    columns = ["bucket", *groupColumns, "count"]
+    for column in valueColumns:
+        columns += [f"{column}_{name}" for name in ("count", "sum", "min", "max")]
+    return columns
+
+
+def sql_query_rollup_select(table: str, granularity: str, rowFilter: str) -> str:
+    """Rollup rows (rollup_columns) of the rows of table matching rowFilter."""
+    groupColumns, valueColumns = rollups[table]
+    seconds = rollupGranularities[granularity]
+    selects = [f"timestamp / {seconds} * {seconds} AS bucket", *groupColumns]
+    selects.append("count(*)")
+    for column in valueColumns:
+        selects += [f"{aggregate}({column})" for aggregate in ("count", "total")]
+        selects += [f"{aggregate}({column})" for aggregate in ("min", "max")]
+    sql_query = (
+        f"SELECT {', '.join(selects)} FROM {table} WHERE {rowFilter} "
+        f"GROUP BY {', '.join(['bucket', *groupColumns])}"
+    )
+    return sql_query
+
+
+def sql_query_rollup_upsert(table: str, granularity: str, rowFilter: str) -> str:
+    """
+    Adds the rows of table matching rowFilter to the rollup table of granularity.
+    Buckets that are already in the rollup table are merged with the new rows.
+    """
+    groupColumns, _ = rollups[table]
+    columns = rollup_columns(table)
+    updates = []
+    for column in columns[len(groupColumns) + 1 :]:
+        if column.endswith("_min") or column.endswith("_max"):
+            # min()/max() of sqlite are NULL if any argument is NULL
+            func = column[-3:]
+            updates.append(
+                f"{column} = {func}(coalesce({column}, excluded.{column}), "
+                f"coalesce(excluded.{column}, {column}))"
+            )
+        else:
+            updates.append(f"{column} = {column} + excluded.{column}")
+    keys = ", ".join(["bucket", *groupColumns])
+    sql_query = (
+        f"INSERT INTO {rollup_table(table, granularity)} ({', '.join(columns)}) "
+        f"{sql_query_rollup_select(table, granularity, rowFilter)} "
+        f"ON CONFLICT ({keys}) DO UPDATE SET {', '.join(updates)};"
+    )
+    return sql_query
+
+
+def sql_query_inserted_messages_create_table() -> TableQuerySQL:
+    # Message_ids of the rows added to rollups and station_fixes by dbmanager
+    query = (
+        "CREATE TEMP TABLE IF NOT EXISTS inserted_message "
+        "(message_id INTEGER PRIMARY KEY);"
+    )
+    return query
+
+
+# *---------------------------*
+# | STATION FIXES SQL QUERIES |
+# *---------------------------*
+
+# Positioning accepts the newest fix of the lowest pdop class below this
+stationFixMaxPdop = 6
+
+
+def sql_query_station_fixes_upsert(rowFilter: str) -> str:
+    """
+    Adds the '3D-fix' rows of 'gps' matching rowFilter to station_fixes, replacing the
+    fix of their TBR and pdop class if they are newer. pdop below 1 is class 1.
+    """
+    sql_query = f"""
+        INSERT INTO main.station_fixes
+            (tbr_serial_id, pdop_class, timestamp, latitude, longitude)
+        SELECT tbr_serial_id, max(CAST(pdop AS INTEGER) + 1, 1), timestamp,
+            latitude, longitude
+        FROM gps
+        WHERE fix = '3D-fix' AND pdop < {stationFixMaxPdop} AND {rowFilter}
+        ORDER BY timestamp
+        ON CONFLICT (tbr_serial_id, pdop_class) DO UPDATE SET
+            timestamp = excluded.timestamp,
+            latitude = excluded.latitude,
+            longitude = excluded.longitude
+        WHERE excluded.timestamp >= station_fixes.timestamp;"""
+    return sql_query
+
+
+def sql_query_get_station_fixes(numOfTBRs: int) -> RowQuerySQL:
+    # Fixes of TBRs, the fix of the lowest pdop class of each TBR comes first
+    sql_query = (
+        "SELECT tbr_serial_id, latitude, longitude FROM main.station_fixes "
+        f"WHERE tbr_serial_id IN {_sql_values_string(numOfTBRs)} "
+        "ORDER BY tbr_serial_id, pdop_class;"
+    )
+    return sql_query
+
+
+# *-----------------------------------*
+# | POSITIONING WATERMARK SQL QUERIES |
+# *-----------------------------------*
+
+
+def sql_query_get_positioning_watermark() -> RowQuerySQL:
+    # (source, last_rowid) watermarks of (tag_id, frequency, tbr_a, tbr_b, tbr_c)
+    sql_query = (
+        "SELECT source, last_rowid FROM main.positioning_watermark "
+        "WHERE tag_id = ? AND frequency = ? AND tbr_a = ? AND tbr_b = ? AND tbr_c = ?;"
+    )
+    return sql_query
+
+
+def sql_query_positioning_watermark_upsert() -> str:
+    # (tag_id, frequency, tbr_a, tbr_b, tbr_c, source, last_rowid), only increases
+    sql_query = """
+        INSERT INTO main.positioning_watermark
+            (tag_id, frequency, tbr_a, tbr_b, tbr_c, source, last_rowid)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (tag_id, frequency, tbr_a, tbr_b, tbr_c, source) DO UPDATE SET
+            last_rowid = max(last_rowid, excluded.last_rowid);"""
+    return sql_query
+
+
+def sql_query_get_tag_detection_chunks(tag_id: int, frequency: int) -> RowQuerySQL:
+    """
+    Returns query of the time chunks with detections of tag by TBRs (?, ?, ?) with
+    rowid > ? and timestamp in [?, ?], as (first timestamp of the chunk, number of
+    detections, largest rowid). Chunks are ? seconds long, the first parameter.
+    """
+    sql_query = (
+        "SELECT timestamp - timestamp % ? AS chunk, count(*), max(rowid) "
+        f"FROM tag WHERE tbr_serial_id IN {_sql_values_string(3)} "
+        f"AND frequency = {frequency} AND tag_id = {tag_id} "
+        "AND rowid > ? AND timestamp BETWEEN ? AND ? "
+        "GROUP BY chunk ORDER BY chunk;"
+    )
+    return sql_query
+
+
 # *-------------------------*
 # | INSERT TO TABLE QUERIES |
 # *-------------------------*
@@ -224,25 +571,25 @@ def sql_query_insert_packet(
     return sql_query
 
 
-def sql_query_insert_position() -> TableInsertSQL:
+def sql_query_insert_position(
+    schema: str = "main", ignore: bool = False
+) -> TableInsertSQL:
+    # With ignore, positions already in the table are skipped without an error
     columns = """
         (timestamp, date, hour, tag_id, frequency, cage_name, millisecond,
         x, y, z, latitude, longitude)"""  # 12 columns
-    table = "positions"
+    table = f"{schema}.positions"
     numOfValues = 12
     valuesString = _sql_values_string(numOfValues)
-    sql_query = f"INSERT INTO {table} {columns} VALUES {valuesString};"
+    insert = "INSERT OR IGNORE" if ignore else "INSERT"
+    sql_query = f"{insert} INTO {table} {columns} VALUES {valuesString};"
     return sql_query
 
 
-def sql_query_insert_backup(msgID: int) -> TableInsertSQL:
-    table = "backup"
-    if msgID:
-        columns = "(message_id, data, snr)"
-        valuesString = _sql_values_string(3)
-    else:
-        columns = "(data, snr)"
-        valuesString = _sql_values_string(2)
+def sql_query_insert_backup_block() -> TableInsertSQL:
+    table = "backup_block"
+    columns = "(first_message_id, last_message_id, count, compression, data)"
+    valuesString = _sql_values_string(5)
     sql_query = f"INSERT INTO {table} {columns} VALUES {valuesString}"
     return sql_query
 
@@ -260,6 +607,39 @@ def sql_query_get_message_id(table: str) -> RowQuerySQL:
     return sql_query
 
 
+def sql_query_get_message_sequence() -> RowQuerySQL:
+    sql_query = "SELECT next_id FROM message_sequence WHERE name = 'message_id';"
+    return sql_query
+
+
+def sql_query_insert_message_sequence() -> TableInsertSQL:
+    columns = "(name, next_id)"
+    sql_query = f"INSERT INTO message_sequence {columns} VALUES ('message_id', ?);"
+    return sql_query
+
+
+def sql_query_reserve_message_ids() -> TableInsertSQL:
+    sql_query = (
+        "UPDATE message_sequence SET next_id = next_id + ? WHERE name = 'message_id';"
+    )
+    return sql_query
+
+
+def sql_query_insert_shard() -> TableInsertSQL:
+    columns = "(name, start_timestamp, end_timestamp)"
+    sql_query = f"INSERT OR IGNORE INTO main.shards {columns} VALUES (?, ?, ?);"
+    return sql_query
+
+
+def sql_query_get_shards_between() -> RowQuerySQL:
+    # Shards overlapping time range of parameters (start, end), oldest first
+    sql_query = (
+        "SELECT name, start_timestamp, end_timestamp FROM main.shards "
+        "WHERE end_timestamp > ? AND start_timestamp <= ? ORDER BY start_timestamp;"
+    )
+    return sql_query
+
+
 def sql_query_get_ROWID(table: str) -> RowQuerySQL:
     numOfValues = 1
     column = "ROWID"
@@ -268,6 +648,33 @@ def sql_query_get_ROWID(table: str) -> RowQuerySQL:
     return sql_query
 
 
+def sql_query_get_backup_rows() -> RowQuerySQL:
+    # Base64 rows of backup table with rowid > ?, in order of insertion (LIMIT ?)
+    sql_query = (
+        "SELECT rowid, message_id, data, SNR FROM backup WHERE rowid > ? "
+        "ORDER BY rowid LIMIT ?;"
+    )
+    return sql_query
+
+
+def sql_query_get_backup_blocks() -> RowQuerySQL:
+    # Blocks with block_id > ?, in order of insertion (LIMIT ?)
+    sql_query = (
+        "SELECT block_id, compression, data FROM backup_block WHERE block_id > ? "
+        "ORDER BY block_id LIMIT ?;"
+    )
+    return sql_query
+
+
+def sql_query_get_backup_blocks_of_message_id() -> RowQuerySQL:
+    # Blocks whose message_id range holds message_id (?, ?)
+    sql_query = (
+        "SELECT compression, data FROM backup_block "
+        "WHERE first_message_id <= ? AND last_message_id >= ?;"
+    )
+    return sql_query
+
+
 def sql_query_get_latest_TBR_pos(tbr_id: int, pdop: float) -> RowQuerySQL:
     # Get newest latitude/longitude positions for TBRs
     numOfValues = 1
@@ -307,15 +714,17 @@ def sql_query_tag_df(
     return sql_query
 
 
-def sql_query_get_db_all_tag_freq_detections(tag_id, frequency):
+def sql_query_get_db_all_tag_freq_detections(tag_id, frequency, timeRange=False):
+    # With timeRange, only detections with timestamp BETWEEN ? AND ? after the TBRs
     numOfTBRs = 3
     columns = "timestamp, tbr_serial_id, tag_data, millisecond"
     table = "tag"
     tbr_filter = f"tbr_serial_id IN {_sql_values_string(numOfTBRs)}"  # (?, ?, ?)
     freq_filter = f"frequency = {frequency}"
     tag_filter = f"tag_id = {tag_id}"
+    time_filter = " AND timestamp BETWEEN ? AND ?" if timeRange else ""
     sql_query = (
         f"SELECT {columns} FROM {table} "
-        f"WHERE {tbr_filter} AND {freq_filter} AND {tag_filter};"
+        f"WHERE {tbr_filter} AND {freq_filter} AND {tag_filter}{time_filter};"
     )
     return sql_query
@@ -1,7 +1,10 @@
 # Python built-in modules and packages
 import logging
 import os
+import sqlite3
+import time
 from pathlib import Path
+from typing import List
 
 # Third-party modules and packages
 import toml
@@ -9,6 +12,7 @@ import toml
 # Local modules and packages
 from src.backend.dbmanager import dbmanager
 from src.backend.dbmanager import dbformat
+from src.backend.dbmanager import msgbackup
 
 
 # workaround for sphinx
@@ -21,12 +25,14 @@ logger = logging.getLogger("main.dbmanager.databaseinit")
 dbPath = "src/backend/dbmanager/databases/"
 dbConfig = "src/backend/.config/db_names.toml"
 dbDict = dict()
+storageDict = dict()  # [storage] section, kept as is when db names are updated
 
 
 def _update_db_config_file(dbName="", dbBackupName="", reset=False) -> None:
     """
     Saves dbName and dbBackupName to 'src/backend/.config/db_names.toml'.
     If reset=True: saves with empty db names to 'src/backend/.config/db_names.toml'.
+    The storage profile of the file is kept.
     """
     global dbDict
     if reset:
@@ -34,7 +40,7 @@ def _update_db_config_file(dbName="", dbBackupName="", reset=False) -> None:
     else:
         dbDict = {"main_database": dbName, "backup_database": dbBackupName}
     with open(dbConfig, "w") as f:
-        toml.dump(dbDict, f)
+        toml.dump({**dbDict, "storage": storageDict} if storageDict else dbDict, f)
 
 
 # if db_names.toml doesn't exist: create it. If exists, load dbDict from it.
@@ -47,6 +53,7 @@ if not Path("src/backend/.config/db_names.toml").exists():
 else:
     try:
         dbDict = toml.load(dbConfig, _dict=dict)
+        storageDict = dbDict.pop("storage", {})
     except Exception:
         logger.exception("Caught an error while loading db names for backup")
 
@@ -174,8 +181,9 @@ def _delete_databases() -> bool:
 
 def _create_database_tables(dbObj: dbmanager.DatabaseManager) -> None:
     """
-    Creates 'gps', 'tag', 'tbr' database tables,
-    based on formats defined in src.dbmanager.databaseformat.
+    Creates 'gps', 'tag', 'tbr', 'positions' and 'message_sequence' database tables,
+    the rollup tables and 'station_fixes', based on formats defined in
+    src.dbmanager.databaseformat.
     """
     # add gps table and a dummy data row for gps table
     gps_sql, gps_dummy_sql, gps_dummy_data = dbformat.sql_query_gps_create_table_dummy()
@@ -196,6 +204,66 @@ def _create_database_tables(dbObj: dbmanager.DatabaseManager) -> None:
     sql_query = dbformat.sql_query_positions_create_table()
     dbObj.add_del_update_db_record(sql_query)
 
+    # add message_sequence table, seeded with first message_id by dbmanager
+    sql_query = dbformat.sql_query_message_sequence_create_table()
+    dbObj.add_del_update_db_record(sql_query)
+
+    # add rollup tables of the dashboards, updated with every inserted message
+    create_rollup_tables(dbObj)
+
+    # add latest TBR positions of positioning, updated with every inserted message
+    create_station_fixes_table(dbObj)
+
+    # add secondary indexes of hot queries
+    create_database_indexes(dbObj)
+
+
+def create_rollup_tables(dbObj: dbmanager.DatabaseManager) -> None:
+    """Creates the rollup tables of dbformat.rollups that main database is missing."""
+    for table in dbformat.rollups:
+        for granularity in dbformat.rollupGranularities:
+            sql_query = dbformat.sql_query_rollup_create_table(table, granularity)
+            dbObj.add_del_update_db_record(sql_query)
+
+
+def create_station_fixes_table(dbObj: dbmanager.DatabaseManager) -> bool:
+    """
+    Creates 'station_fixes' table if main database is missing it, filled from all
+    'gps' rows of the database (and of its attached shards). Returns True if created.
+    """
+    sql_query = "SELECT count(*) FROM sqlite_master WHERE name = 'station_fixes'"
+    if dbObj.select_from_db_record(sql_query)[0][0]:
+        return False
+    with dbObj.transaction(immediate=True):
+        dbObj.add_del_update_db_record(dbformat.sql_query_station_fixes_create_table())
+        dbObj.add_del_update_db_record(
+            dbformat.sql_query_station_fixes_upsert("timestamp >= 0")
+        )
+    return True
+
+
+def create_database_indexes(dbObj: dbmanager.DatabaseManager) -> List[str]:
+    """
+    Creates the indexes of dbformat.indexes that main database does not have yet, one
+    statement (and write lock) at a time, and returns their names. Indexes of missing
+    tables are skipped. Safe to run while the MQTT client is writing, see migrate.
+    """
+    rows = dbObj.select_from_db_record(dbformat.sql_query_get_indexes())
+    existing = {name for name, in rows}
+    created = []
+    for name, (table, _) in dbformat.indexes.items():
+        if name in existing:
+            continue
+        start = time.perf_counter()
+        try:
+            dbObj.add_del_update_db_record(dbformat.sql_query_create_index(name))
+        except sqlite3.OperationalError as e:
+            logger.warning(f"{e} | Could not create index {name} on {table}")
+            continue
+        logger.info(f"Created index {name} in {time.perf_counter() - start:.2f} s")
+        created.append(name)
+    return created
+
 
 def databases_ready() -> bool:
     """
@@ -248,15 +316,9 @@ def reset_databases() -> None:
             print(f"no databases found in {dbConfig}, none deleted")
 
 
-def init_databases(dbName: str, dbBackupName: str) -> None:
-    """
-    Creates main_database and backup_database in 'dbmanager/databases/'.
-    dbName is name of main_database, dbBackupName is name of backup_database.
-    The names will also be saved to 'src/backend/.config/db_names.toml'.
-    """
-    # Make main database
-    print("Creating databases")
-    dbObj = dbmanager.DatabaseManager(dbPath + dbName)
+def create_main_database(path: str) -> None:
+    """Creates main database at path, with data tables and metadata table."""
+    dbObj = dbmanager.DatabaseManager(path)
 
     # Create 'gps', 'tag', 'tbr' and 'positions' tables
     _create_database_tables(dbObj)
@@ -274,12 +336,22 @@ def init_databases(dbName: str, dbBackupName: str) -> None:
     # Close DB
     del dbObj
 
+
+def init_databases(dbName: str, dbBackupName: str) -> None:
+    """
+    Creates main_database and backup_database in 'dbmanager/databases/'.
+    dbName is name of main_database, dbBackupName is name of backup_database.
+    The names will also be saved to 'src/backend/.config/db_names.toml'.
+    """
+    # Make main database
+    print("Creating databases")
+    create_main_database(dbPath + dbName)
+
     # Make backup database
     dbObj = dbmanager.DatabaseManager(dbPath + dbBackupName)
 
-    # create and insert 'backup' table
-    backup_sql = dbformat.sql_query_backup_create_table()
-    dbObj.add_del_update_db_record(backup_sql)
+    # create 'backup_block' and 'backup_message' tables
+    msgbackup.create_backup_tables(dbObj)
 
     # Close DB
     del dbObj
@@ -1,15 +1,21 @@
 # Python built-in modules and packages
+import datetime as dt
 import logging
 import sqlite3
+import threading
 import toml
 import numpy as np  # Only needed for sqlite3.adapter
+from contextlib import contextmanager
 from dataclasses import astuple
-from typing import Dict, Union, List, Tuple, Optional
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+from typing import Tuple, Union
 
 # Local modules and packages
 from src.backend.dbmanager import msgconversion
 from src.backend.dbmanager import positioning as pos
 from src.backend.dbmanager import dbformat
+from src.backend.dbmanager import shards
+from src.backend.msghandler import batchdecode
 
 
 # --- Useful type hints ---
@@ -19,6 +25,7 @@ Packet = Dict[DatafieldName, PacketData]
 Message = Dict[str, List[Packet]]
 DatabasePacket = msgconversion.DatabasePacket
 MessageDB = List[DatabasePacket]
+StorageProfile = Dict[str, Union[str, int, float]]
 
 
 logger = logging.getLogger("mqtt_client.dbmanager")
@@ -27,6 +34,30 @@ _db = "src/backend/dbmanager/databases/"
 _dbConfig = "src/backend/.config/db_names.toml"
 _dbPath = ""
 
+# Storage profile applied to every connection, set in [storage] of db_names.toml
+# | cache_size is in KiB when negative (sqlite convention), mmap_size in bytes,
+# | busy_timeout in milliseconds and checkpoint_interval in seconds (0 disables)
+# | shard_months > 0 stores data tables in shards of that many months, see shards
+# | backup_compression ('none', 'zlib' or 'zstd') compresses blocks of at most
+# | backup_block_size raw messages in backup database, see msgbackup
+_storageDefaults: StorageProfile = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "cache_size": -16000,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+    "wal_autocheckpoint": 1000,
+    "checkpoint_interval": 60.0,
+    "checkpoint_mode": "passive",
+    "shard_months": 0,
+    "backup_compression": "zlib",
+    "backup_block_size": 100,
+}
+_journalModes = ("delete", "truncate", "persist", "memory", "wal", "off")
+_synchronousLevels = ("off", "normal", "full", "extra")
+_checkpointModes = ("passive", "full", "restart", "truncate")
+_backupCompressions = ("none", "zlib", "zstd")
+
 # TODO(perkjelsvik) - Better path handling for complete case
 # For positioning of complete database
 # _db = "databases/"
@@ -34,6 +65,57 @@ _dbPath = ""
 # _dbPath = "databases/iof.db"
 
 
+def load_storage_profile() -> StorageProfile:
+    """
+    Loads [storage] section of 'src/backend/.config/db_names.toml'.
+    Missing file or missing values fall back to the defaults of this module.
+    """
+    profile = dict(_storageDefaults)
+    try:
+        profile.update(toml.load(_dbConfig).get("storage", {}))
+    except FileNotFoundError:
+        pass  # database names not configured yet, defaults are fine
+    except toml.decoder.TomlDecodeError as e:
+        logger.error(f"{e} | db_names toml file wrongly formatted, default storage")
+    for key, valid in (
+        ("journal_mode", _journalModes),
+        ("synchronous", _synchronousLevels),
+        ("checkpoint_mode", _checkpointModes),
+        ("backup_compression", _backupCompressions),
+    ):
+        profile[key] = str(profile[key]).lower()
+        if profile[key] not in valid:
+            logger.error(f"Invalid {key} '{profile[key]}' in storage profile")
+            profile[key] = _storageDefaults[key]
+    return profile
+
+
+_storageProfile = load_storage_profile()
+
+
+def apply_storage_profile(
+    con: sqlite3.Connection, profile: Optional[StorageProfile] = None
+) -> None:
+    """Sets journal mode, synchronous level, cache, mmap and busy timeout pragmas."""
+    if profile is None:
+        profile = _storageProfile
+    # busy_timeout first, so that changing journal mode waits for other connections
+    con.execute(f"pragma busy_timeout = {int(profile['busy_timeout'])}")
+    con.execute(f"pragma journal_mode = {profile['journal_mode']}")
+    con.execute(f"pragma synchronous = {profile['synchronous']}")
+    con.execute(f"pragma cache_size = {int(profile['cache_size'])}")
+    con.execute(f"pragma mmap_size = {int(profile['mmap_size'])}")
+    con.execute(f"pragma wal_autocheckpoint = {int(profile['wal_autocheckpoint'])}")
+
+
+def register_numpy_adapters() -> None:
+    # Adapters needed to store np-values. Without them, values stored as binary blob
+    sqlite3.register_adapter(np.uint64, lambda val: int(val))
+    sqlite3.register_adapter(np.uint32, lambda val: int(val))
+    sqlite3.register_adapter(np.uint16, lambda val: int(val))
+    sqlite3.register_adapter(np.uint8, lambda val: int(val))
+
+
 def init_databasemanager(positionTags: bool):
     global _dbPath
     try:
@@ -46,11 +128,7 @@ def init_databasemanager(positionTags: bool):
         _dbPath = _db + dbDict["main_database"]
         logger.info("database manager (path to main database) successfully initalized")
     finally:
-        # Adapters needed to store np-values. Without them, values stored as binary blob
-        sqlite3.register_adapter(np.uint64, lambda val: int(val))
-        sqlite3.register_adapter(np.uint32, lambda val: int(val))
-        sqlite3.register_adapter(np.uint16, lambda val: int(val))
-        sqlite3.register_adapter(np.uint8, lambda val: int(val))
+        register_numpy_adapters()
         if positionTags:
             logger.info(
                 "Will attempt to position incoming tag data "
@@ -59,34 +137,236 @@ def init_databasemanager(positionTags: bool):
             pos.init_metadata()
 
 
+# Errors caused by a broken connection rather than by the sql query itself
+_reconnectErrors = (
+    "closed database",
+    "disk I/O error",
+    "unable to open database file",
+)
+
+
+def _is_connection_error(err: sqlite3.Error) -> bool:
+    if isinstance(err, sqlite3.ProgrammingError):
+        return "closed database" in str(err)
+    if isinstance(err, sqlite3.OperationalError):
+        return any(msg in str(err) for msg in _reconnectErrors)
+    return False
+
+
 class DatabaseManager:
+    """Connection to a sqlite database.
+
+    The connection runs in autocommit mode. Statements executed inside a transaction()
+    scope are committed together when the scope exits, and rolled back if it raises.
+    Outside of a scope, add_del_update_db_record commits every statement by itself.
+    If the connection breaks, it is reopened and a statement outside of a transaction
+    is retried once.
+
+    Instances are cheap to use but not to create. Use get_database_manager() to get a
+    connection that stays open for the lifetime of the process (one per thread).
+    """
+
     def __init__(self, name: str) -> None:
+        self.name = name
+        self._depth = 0  # number of nested transaction() scopes
         try:
-            self.con = sqlite3.connect(name)
-            self.con.execute("pragma foreign_keys = on")
-            self.con.commit()
-            self.cur = self.con.cursor()
+            self._connect()
         except Exception:
             logger.exception("Caught an error while connecting to database")
 
+    def _connect(self) -> None:
+        # uri, so that shards can be attached read-only
+        self.con = sqlite3.connect(self.name, isolation_level=None, uri=True)
+        self.attachedShards: Dict[str, bool] = {}  # {schema: readOnly}, see shards
+        self.con.execute("pragma foreign_keys = on")
+        apply_storage_profile(self.con)
+        self.cur = self.con.cursor()
+
+    def reconnect(self) -> None:
+        logger.warning(f"Reconnecting to database {self.name}")
+        self.close()
+        self._depth = 0
+        self._connect()
+
+    def _execute(self, method: str, *args):
+        """Calls cursor method, reconnects and retries once on a broken connection."""
+        try:
+            return getattr(self.cur, method)(*args)
+        except sqlite3.Error as e:
+            if self._depth or not _is_connection_error(e):
+                raise
+            logger.warning(f"{e} | Lost connection to database")
+        self.reconnect()
+        return getattr(self.cur, method)(*args)
+
+    @contextmanager
+    def transaction(self, immediate: bool = False) -> Iterator["DatabaseManager"]:
+        """
+        Scope where all statements are committed together. Nested scopes use
+        savepoints, so a failing inner scope only rolls back its own statements.
+        If immediate, the write lock is taken when the scope starts instead of at the
+        first write, so that no other connection can write in between.
+        """
+        if self._depth:
+            savepoint = f"scope_{self._depth}"
+            self.cur.execute(f"SAVEPOINT {savepoint}")
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self.cur.execute(f"ROLLBACK TO {savepoint}")
+                self.cur.execute(f"RELEASE {savepoint}")
+                raise
+            else:
+                self.cur.execute(f"RELEASE {savepoint}")
+            finally:
+                self._depth -= 1
+            return
+
+        self._execute("execute", "BEGIN IMMEDIATE" if immediate else "BEGIN")
+        self._depth = 1
+        try:
+            yield self
+        except BaseException as e:
+            try:
+                self.con.rollback()
+            except sqlite3.Error:
+                pass  # connection already broken, nothing to roll back
+            if isinstance(e, sqlite3.Error) and _is_connection_error(e):
+                self._depth = 0
+                self.reconnect()
+            raise
+        else:
+            self.con.commit()
+        finally:
+            self._depth = 0
+
+    def run_in_transaction(self, func: Callable, *args):
+        """
+        Calls func(*args) inside a transaction() scope. If the connection breaks, the
+        connection is reopened and func is called again in a new transaction.
+        """
+        try:
+            with self.transaction():
+                return func(*args)
+        except sqlite3.Error as e:
+            if not _is_connection_error(e):
+                raise
+            logger.warning(f"{e} | Retrying transaction on new connection")
+        with self.transaction():
+            return func(*args)
+
     def add_del_update_db_record(self, sql_query: str, args=()) -> None:
-        self.cur.execute(sql_query, args)
-        self.con.commit()
+        """Executes sql_query. Committed right away unless inside transaction()."""
+        self._execute("execute", sql_query, args)
         return
 
-    def select_from_db_record(self, sql_query: str) -> List[Tuple]:
-        return self.cur.execute(sql_query).fetchall()
+    def executemany_db_records(self, sql_query: str, rows: List[Tuple]) -> None:
+        """Executes sql_query for every row, committed with rest of transaction()."""
+        self._execute("executemany", sql_query, rows)
+
+    def select_from_db_record(self, sql_query: str, args=()) -> List[Tuple]:
+        return self._execute("execute", sql_query, args).fetchall()
+
+    def close(self) -> None:
+        try:
+            self.cur.close()
+            self.con.close()
+        except (AttributeError, sqlite3.Error):
+            pass  # never connected, or connection already broken
 
     def __del__(self) -> None:
-        self.cur.close()
-        self.con.close()
+        self.close()
+
+
+# Persistent connections, one per database per thread
+_managers = threading.local()
+
+
+def get_database_manager(name: str) -> DatabaseManager:
+    """
+    Returns a DatabaseManager connected to database 'name' for the calling thread.
+    The connection is opened on first use and reused until close_database_managers().
+    """
+    managers: Dict[str, DatabaseManager] = getattr(_managers, "managers", None)
+    if managers is None:
+        managers = _managers.managers = {}
+    if name not in managers:
+        logger.info(f"Opening persistent connection to database {name}")
+        managers[name] = DatabaseManager(name)
+    return managers[name]
+
+
+def close_database_managers() -> None:
+    """Closes all persistent connections opened by the calling thread."""
+    managers: Dict[str, DatabaseManager] = getattr(_managers, "managers", {})
+    for dbObj in managers.values():
+        dbObj.close()
+    managers.clear()
+
+
+class WalCheckpointer:
+    """Background thread that checkpoints the WAL of databases at a fixed interval.
+
+    sqlite only checkpoints automatically when a commit grows the WAL beyond
+    wal_autocheckpoint pages, which happens on the ingest thread. Checkpointing from
+    a separate thread keeps the WAL short without adding this cost to ingest.
+    """
+
+    def __init__(self, names: List[str], interval: float, mode: str) -> None:
+        self.names = names
+        self.interval = interval
+        self.mode = mode
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="wal-checkpointer", daemon=True
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            for name in self.names:
+                try:
+                    dbObj = get_database_manager(name)
+                    busy, log, done = dbObj.select_from_db_record(
+                        f"pragma wal_checkpoint({self.mode})"
+                    )[0]
+                except sqlite3.Error as e:
+                    logger.warning(f"{e} | WAL checkpoint of {name} failed")
+                else:
+                    logger.debug(f"Checkpointed {done}/{log} WAL pages of {name}")
+        close_database_managers()
+
+
+def start_wal_checkpointer(
+    extraDatabases: Sequence[str] = ()
+) -> Optional[WalCheckpointer]:
+    """
+    Starts checkpointing main database and extraDatabases in the background, if the
+    storage profile uses WAL and has a checkpoint_interval. Returns the checkpointer.
+    """
+    interval = float(_storageProfile["checkpoint_interval"])
+    if _storageProfile["journal_mode"] != "wal" or interval <= 0:
+        return None
+    names = [_dbPath, *extraDatabases]
+    checkpointer = WalCheckpointer(names, interval, _storageProfile["checkpoint_mode"])
+    checkpointer.start()
+    logger.info(f"Checkpointing WAL of {names} every {interval} seconds")
+    return checkpointer
 
 
-def _db_get_message_number(dbObj: DatabaseManager) -> Tuple[str, int]:
+def _db_get_message_number(dbObj: DatabaseManager) -> int:
     """
-    Function that returns the message number. Should be called once for every message.
+    Function that returns the first unused message number.
     Finds maximum by comparing last message_id of each table, returning maximum + 1.
     As database size grows, this should be faster than using sql command MAX().
+    Only used to seed the message_sequence table, see MessageIdAllocator.
     """
     msgID, dbTables = [], ("tag", "tbr", "gps")
     for table in dbTables:
@@ -96,32 +376,169 @@ def _db_get_message_number(dbObj: DatabaseManager) -> Tuple[str, int]:
     return max(msgID)
 
 
-def _db_insert_packet_in_table(dbObj: DatabaseManager, packet: DatabasePacket) -> None:
+class MessageIdAllocator:
+    """Hands out message_ids from memory.
+
+    message_ids are reserved from the 'message_sequence' table of the main database in
+    blocks of blockSize, and then handed out from memory until the block is used up.
+    The table always holds the first message_id after the last reserved block, so a
+    restarted client (or another client process) never hands out the same id twice.
+    Unused ids of a block are skipped when the client restarts.
+    If the table is empty, it is seeded once from the last message_id of the database.
     """
-    Function that inserts packet data to database.
-    Input packet is a dataclass containing necessary variables for insertion
-        | packet.table: name of table to insert into
-        | packet.numOfValues: for nicer printing and construction of sql_values
-        | packet.sql_columns: columns as 1 string instead of tuple of strings
-        | packet.sql_values: string of (?, ...) for safer sql insertion
-        | packet.values: tuple of data, matching order of sql_columns & sql_values
+
+    def __init__(self, blockSize: int = 1000) -> None:
+        self.blockSize = blockSize
+        self._next = 0  # next message_id to hand out
+        self._end = 0  # end of reserved block (exclusive)
+        self._lock = threading.Lock()
+
+    def allocate(self, dbObj: DatabaseManager, count: int = 1) -> int:
+        """Returns the first of count consecutive unused message_ids."""
+        with self._lock:
+            if self._end - self._next < count:
+                size = max(count, self.blockSize)
+                self._next, self._end = self._reserve_block(dbObj, size)
+            firstID = self._next
+            self._next += count
+        return firstID
+
+    def reset(self) -> None:
+        """Forgets the reserved block, next allocate() reserves a new one."""
+        with self._lock:
+            self._next, self._end = 0, 0
+
+    def _reserve_block(self, dbObj: DatabaseManager, size: int) -> Tuple[int, int]:
+        # Reserved in its own transaction, so that it is never rolled back together
+        # with a failed insertion while the block is still handed out from memory
+        with dbObj.transaction(immediate=True):
+            dbObj.add_del_update_db_record(
+                dbformat.sql_query_message_sequence_create_table()
+            )
+            row = dbObj.select_from_db_record(dbformat.sql_query_get_message_sequence())
+            if row:
+                start = row[0][0]
+            else:
+                start = _db_get_message_number(dbObj)
+                logger.info(f"Seeding message_id sequence from database at {start}")
+                dbObj.add_del_update_db_record(
+                    dbformat.sql_query_insert_message_sequence(), (start,)
+                )
+            dbObj.add_del_update_db_record(
+                dbformat.sql_query_reserve_message_ids(), (size,)
+            )
+        logger.info(f"Reserved message_ids {start} to {start + size - 1}")
+        return (start, start + size)
+
+
+_msgIdAllocator = MessageIdAllocator()
+
+# Shard routers of sharded databases, {database name: router}
+_shardRouters: Dict[str, shards.ShardRouter] = {}
+_shardRoutersLock = threading.Lock()
+# Positioning looks for gps fixes of TBRs in the shards of the last week
+_positioningLookback = 7 * 24 * 3600
+
+
+def get_shard_router(name: str) -> Optional[shards.ShardRouter]:
+    """Shard router of database 'name', or None if shard_months is not set."""
+    months = int(_storageProfile["shard_months"])
+    if months <= 0:
+        return None
+    with _shardRoutersLock:
+        if name not in _shardRouters:
+            journalMode = str(_storageProfile["journal_mode"])
+            _shardRouters[name] = shards.ShardRouter(name, months, journalMode)
+        return _shardRouters[name]
+
+
+def attach_shards(
+    dbObj: DatabaseManager,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    write: Iterable[int] = (),
+    read: bool = True,
+) -> None:
     """
-    table = packet.table
-    columns, valuesString = (packet.sql_columns, packet.sql_values)
-    sql_query = dbformat.sql_query_insert_packet(table, columns, valuesString)
-    try:
-        dbObj.add_del_update_db_record(sql_query, packet.values)
-    except sqlite3.OperationalError as e:
-        raise sqlite3.OperationalError(f"{e} | query: {sql_query} | packet {packet}")
+    If the database is sharded, attaches the shards overlapping [start, end] and the
+    shards of write timestamps to dbObj, see shards.ShardRouter.attach. Must be called
+    outside of a transaction.
+    """
+    router = get_shard_router(dbObj.name)
+    if router is not None:
+        router.attach(dbObj.con, dbObj.attachedShards, start, end, write, read)
+
+
+def _shard_groups(
+    dbObj: DatabaseManager, timestamps: Sequence[Set[int]]
+) -> Iterator[List[int]]:
+    """
+    Yields groups of the indexes of items to insert, where timestamps[i] are the
+    timestamps of item i, with the shards of the group attached to dbObj for writing.
+    A batch can only write to as many shards as sqlite can attach at once. Items of a
+    group that can't be attached are logged and left out. Yields all items at once if
+    the database is not sharded.
+    """
+    router = get_shard_router(dbObj.name)
+    if router is None:
+        yield list(range(len(timestamps)))
+        return
+    for items in router.group_writes(timestamps):
+        write = set().union(*(timestamps[i] for i in items))
+        try:
+            router.attach(dbObj.con, dbObj.attachedShards, write=write, read=False)
+        except ValueError as e:
+            logger.error(f"{e} | Not inserting {len(items)} items of this batch")
+            continue
+        yield items
+
+
+# Databases without rollup or station_fixes tables, see _db_update_derived_tables
+_noRollups: Set[str] = set()
+_noStationFixes: Set[str] = set()
+_insertedFilter = "message_id IN temp.inserted_message"
+
+
+def _message_timestamps(msgs: List[Message]) -> Set[int]:
+    return {packet.timestamp for msg in msgs for packet in msg.payload}
+
+
+def _insert_messages(
+    dbObj: DatabaseManager, msgs: List[Message], msgIDs: Sequence[int]
+) -> Set[int]:
+    # One transaction for every group of messages writing to attachable shards
+    inserted: Set[int] = set()
+    timestamps = [_message_timestamps([msg]) for msg in msgs]
+    for items in _shard_groups(dbObj, timestamps):
+        groupMsgs = [msgs[i] for i in items]
+        groupIDs = [msgIDs[i] for i in items]
+        groupInserted = dbObj.run_in_transaction(
+            _db_insert_messages, dbObj, groupMsgs, groupIDs
+        )
+        inserted.update(items[i] for i in groupInserted)
+    return inserted
+
+
+def _position_row(position: pos.Position) -> Tuple:
+    # Values of position in columns of 'positions', with date and hour in local time
+    date = dt.datetime.fromtimestamp(position.timestamp)
+    timestamp, *values = astuple(position)
+    return (timestamp, date.strftime("%Y-%m-%d %H:%M:%S"), date.hour, *values)
 
 
 def _db_insert_position_in_table(
     dbObj: DatabaseManager, position: pos.Position
 ) -> None:
-    # INSERT INTO 'positions' 'columns' VALUES '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
-    sql_query = dbformat.sql_query_insert_position()
+    # INSERT INTO 'positions' 'columns' VALUES '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+    # | into shard of position if database is sharded, attached by attach_shards
+    router = get_shard_router(dbObj.name)
+    if router is None:
+        sql_query = dbformat.sql_query_insert_position()
+    else:
+        schema = router.schema_of(position.timestamp)
+        sql_query = dbformat.sql_query_insert_position(schema)
     try:
-        dbObj.add_del_update_db_record(sql_query, astuple(position))
+        dbObj.add_del_update_db_record(sql_query, _position_row(position))
     except sqlite3.OperationalError as e:
         raise sqlite3.OperationalError(
             f"{e} | query: {sql_query} | position {position}"
@@ -129,91 +546,285 @@ def _db_insert_position_in_table(
     except sqlite3.IntegrityError as e:
         raise sqlite3.IntegrityError(f"{e} | query: {sql_query} | position {position}")
     else:
-        logger.info(f"|--- Inserted position of tag {position.tag_id} in database")
-        print(f"|--- Inserted position of tag {position.tag_id} in database")
+        logger.debug(f"|--- Inserted position of tag {position.tag_id} in database")
 
 
-def insert_message_in_db(msg: Message) -> Optional[int]:
-    atLeastOneInserted = False
-    logger.info("Inserting message to database")  # For nice printing
-    dbObj = DatabaseManager(_dbPath)
-    msgID = _db_get_message_number(dbObj)
-    dbMSG: MessageDB = msgconversion.convert_msg_to_database_format(msg, msgID)
-
-    # Insert each packet to respective database tables
-    for i, packet in enumerate(dbMSG):
-        logger.info(f"| packet {i} ({packet.table})")  # For nice printing
+def _db_insert_packet_rows(
+    dbObj: DatabaseManager, sql_query: str, rows: List[Tuple[int, Tuple]]
+) -> List[int]:
+    """
+    Inserts rows sharing the same sql_query with a single executemany.
+    Rows are (message index, values). If the executemany fails, the rows are inserted
+    one by one instead, so that one bad packet does not reject the rest of the batch.
+    Returns the message index of every row that was inserted.
+    """
+    try:
+        with dbObj.transaction():
+            dbObj.executemany_db_records(sql_query, [values for _, values in rows])
+    except sqlite3.Error as e:
+        logger.warning(f"{e} | Batch insertion failed, inserting packets one by one")
+    else:
+        return [i for i, _ in rows]
+    inserted = []
+    for i, values in rows:
         try:
-            _db_insert_packet_in_table(dbObj, packet)
-        except sqlite3.OperationalError as err:
-            logger.error(err)
+            dbObj.add_del_update_db_record(sql_query, values)
+        except sqlite3.Error as e:
+            logger.error(f"{e} | query: {sql_query} | values {values}")
         else:
-            atLeastOneInserted = True
-    if atLeastOneInserted:
-        logger.info("Successfully inserted message to database")
-    else:
-        raise ValueError("Failed database insertion!")
+            inserted.append(i)
+    return inserted
+
+
+def _db_insert_messages(
+    dbObj: DatabaseManager, msgs: List[Message], msgIDs: Sequence[int]
+) -> Set[int]:
+    """
+    Inserts all packets of msgs with message_id msgIDs[i], must be called inside a
+    transaction. Returns index of every inserted message.
+    """
+
+    # Group packet values of all messages by insertion query
+    # | Packet records carry the query of their table, datafields a packet does not
+    # | have are inserted as NULL. Sharded, the query inserts in shard of the packet.
+    router = get_shard_router(dbObj.name)
+    groups: Dict[str, List[Tuple[int, Tuple]]] = {}
+    for i, (msg, msgID) in enumerate(zip(msgs, msgIDs)):
+        for packet in msg.payload:
+            if router is None:
+                sql_query = packet.sql_insert
+            else:
+                columns = ("message_id", *packet.columns)
+                sql_query = router.insert_query(packet.table, columns, packet.timestamp)
+            groups.setdefault(sql_query, []).append((i, packet.values(msgID)))
+
+    inserted: Set[int] = set()
+    for sql_query, rows in groups.items():
+        inserted.update(_db_insert_packet_rows(dbObj, sql_query, rows))
+    _db_update_derived_tables(dbObj, [msgIDs[i] for i in inserted])
+    return inserted
+
+
+def _db_insert_decoded_batch(
+    dbObj: DatabaseManager, batch: batchdecode.DecodedBatch, msgIDs: Sequence[int]
+) -> Set[int]:
+    """
+    Inserts all packets of a decoded batch with message_id msgIDs[i] for message i,
+    must be called inside a transaction. Returns index of every inserted message.
+    """
+    inserted: Set[int] = set()
+    router = get_shard_router(dbObj.name)
+    rows = msgconversion.convert_batch_to_database_format(batch, msgIDs)
+    for (table, columns), tableRows in rows.items():
+        if router is None:
+            _, _, sql_query = dbformat.sql_insert_strings(table, columns)
+            inserted.update(_db_insert_packet_rows(dbObj, sql_query, tableRows))
+            continue
+        # Sharded, rows are grouped by shard of their timestamp
+        tsIndex = columns.index("timestamp")
+        groups: Dict[str, List[Tuple[int, Tuple]]] = {}
+        for row in tableRows:
+            sql_query = router.insert_query(table, columns, row[1][tsIndex])
+            groups.setdefault(sql_query, []).append(row)
+        for sql_query, shardRows in groups.items():
+            inserted.update(_db_insert_packet_rows(dbObj, sql_query, shardRows))
+    _db_update_derived_tables(dbObj, [msgIDs[i] for i in inserted])
+    return inserted
+
+
+def _db_update_derived_tables(dbObj: DatabaseManager, msgIDs: List[int]) -> None:
+    """
+    Adds the rows of messages msgIDs to the rollup tables and to station_fixes, in the
+    transaction that inserted them. If this fails, the rows stay inserted, and the
+    tables can be rebuilt with python -m src.backend.rollups and
+    python -m src.backend.migrate respectively.
+    """
+    if not msgIDs or (dbObj.name in _noRollups and dbObj.name in _noStationFixes):
+        return
+    dbObj.add_del_update_db_record(dbformat.sql_query_inserted_messages_create_table())
+    dbObj.add_del_update_db_record("DELETE FROM temp.inserted_message;")
+    dbObj.executemany_db_records(
+        "INSERT INTO temp.inserted_message VALUES (?);", [(msgID,) for msgID in msgIDs]
+    )
+    if dbObj.name not in _noRollups:
+        queries = [
+            dbformat.sql_query_rollup_upsert(table, granularity, _insertedFilter)
+            for table in dbformat.rollups
+            for granularity in dbformat.rollupGranularities
+        ]
+        _db_update_derived_table(dbObj, "rollup tables", queries, _noRollups, "rollups")
+    if dbObj.name not in _noStationFixes:
+        queries = [dbformat.sql_query_station_fixes_upsert(_insertedFilter)]
+        _db_update_derived_table(
+            dbObj, "station_fixes table", queries, _noStationFixes, "migrate"
+        )
+
+
+def _db_update_derived_table(
+    dbObj: DatabaseManager,
+    name: str,
+    queries: List[str],
+    missing: Set[str],
+    module: str,
+) -> None:
+    # Own savepoint, so that a failing update does not roll back the inserted rows
+    try:
+        with dbObj.transaction():
+            for sql_query in queries:
+                dbObj.add_del_update_db_record(sql_query)
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            logger.error(f"{e} | Could not update {name}")
+            return
+        logger.warning(
+            f"{e} | No {name} in {dbObj.name}, "
+            f"create with python -m src.backend.{module}"
+        )
+        missing.add(dbObj.name)
+
+
+def insert_messages_in_db(msgs: List[Message]) -> List[Optional[int]]:
+    """
+    Inserts a batch of messages to database in one transaction, or sharded in one
+    per group of messages of _shard_groups. Every message gets its own message_id.
+    Packets with the same table and columns are grouped, so each group is inserted
+    with one executemany.
+    Returns message_id of each message, or None if none of its packets were inserted.
+    """
+    logger.info(f"Inserting {len(msgs)} messages to database")
+    dbObj = get_database_manager(_dbPath)
+    firstID = _msgIdAllocator.allocate(dbObj, len(msgs))
+    msgIDs = range(firstID, firstID + len(msgs))
+    inserted = _insert_messages(dbObj, msgs, msgIDs)
+
+    insertedIDs: List[Optional[int]] = []
+    for i in range(len(msgs)):
+        if i in inserted:
+            insertedIDs.append(msgIDs[i])
+        else:
+            logger.error(f"Failed database insertion! | header: {msgs[i].header}")
+            insertedIDs.append(None)
+    logger.info(f"Successfully inserted {len(inserted)} messages to database")
+    return insertedIDs
+
+
+def bulk_insert_messages(
+    dbObj: DatabaseManager, msgs: List[Message], msgIDs: Sequence[int]
+) -> Set[int]:
+    """
+    Inserts msgs with the given message_ids in one transaction (see
+    insert_messages_in_db), for rebuilding a database (the message_sequence table is
+    not used or updated).
+    Returns index of every inserted message.
+    """
+    return _insert_messages(dbObj, msgs, msgIDs)
+
 
-    # Deleting dbObj commits and saves all insertions, and closes connection to database
-    del dbObj
+def bulk_insert_decoded_batch(
+    dbObj: DatabaseManager, batch: batchdecode.DecodedBatch, msgIDs: Sequence[int]
+) -> Set[int]:
+    """
+    Inserts a batch decoded by msghandler.batchdecode with the given message_ids in
+    one transaction, like bulk_insert_messages. Returns index of every inserted message.
+    """
+    packets = (batch.tag, batch.tbr, batch.gps)
+    timestamps: List[Set[int]] = [set() for _ in msgIDs]
+    for p in packets:
+        for i, timestamp in zip(p["message"].tolist(), p["timestamp"].tolist()):
+            timestamps[i].add(timestamp)
+    inserted: Set[int] = set()
+    for items in _shard_groups(dbObj, timestamps):
+        groupBatch = batch
+        if len(items) < len(msgIDs):
+            groupBatch = _select_batch_messages(batch, items)
+        inserted.update(
+            dbObj.run_in_transaction(
+                _db_insert_decoded_batch, dbObj, groupBatch, msgIDs
+            )
+        )
+    return inserted
+
+
+def _select_batch_messages(
+    batch: batchdecode.DecodedBatch, items: List[int]
+) -> batchdecode.DecodedBatch:
+    # Packets of messages items, with the message indexes of the whole batch
+    arrays = {type: getattr(batch, type) for type in ("tag", "tbr", "gps")}
+    selected = {
+        type: array[np.isin(array["message"], items)] for type, array in arrays.items()
+    }
+    return batch._replace(**selected)
+
+
+def _db_insert_positions(
+    dbObj: DatabaseManager, positions: List[pos.Position]
+) -> int:
+    router = get_shard_router(dbObj.name)
+    groups: Dict[str, List[Tuple]] = {}
+    for position in positions:
+        schema = "main"
+        if router is not None:
+            schema = router.schema_of(position.timestamp)
+        sql_query = dbformat.sql_query_insert_position(schema, ignore=True)
+        groups.setdefault(sql_query, []).append(_position_row(position))
+    changes = dbObj.con.total_changes
+    for sql_query, rows in groups.items():
+        dbObj.executemany_db_records(sql_query, rows)
+    return dbObj.con.total_changes - changes
+
+
+def bulk_insert_positions(dbObj: DatabaseManager, positions: List[pos.Position]) -> int:
+    """
+    Inserts positions in one transaction (sharded, one per group of _shard_groups),
+    skipping positions that are already in the 'positions' table. Returns number of
+    inserted positions.
+    """
+    inserted = 0
+    timestamps = [{position.timestamp} for position in positions]
+    for items in _shard_groups(dbObj, timestamps):
+        groupPositions = [positions[i] for i in items]
+        inserted += dbObj.run_in_transaction(
+            _db_insert_positions, dbObj, groupPositions
+        )
+    return inserted
+
+
+def insert_message_in_db(msg: Message) -> Optional[int]:
+    msgID = insert_messages_in_db([msg])[0]
+    if msgID is None:
+        raise ValueError("Failed database insertion!")
     return msgID
 
 
-def position_and_insert_positions_from_msg(msg: Message):
+def position_and_insert_positions_from_msg(
+    msg: Message, window: Optional[pos.DetectionWindow] = None
+):
     atLeastOneInserted = False
-    print()
-    logger.info("Looking for new positions from msg")
-    dbObj = DatabaseManager(_dbPath)
-    positions = pos.position_new_msg(msg, dbObj)
+    logger.debug("Looking for new positions from msg")
+    dbObj = get_database_manager(_dbPath)
+    # Corrupt timestamps would attach every shard since their time
+    timestamps = {t for t in _message_timestamps([msg]) if shards.is_plausible(t)}
+    if not timestamps:
+        logger.debug(f"No packets to position in this message")
+        return
+    # Triplets are near the message, latest TBR positions may be older
+    start = min(timestamps) - _positioningLookback
+    attach_shards(dbObj, start)
+    positions = pos.position_new_msg(msg, dbObj, window)
     if positions:
-        for position in positions:
-            try:
-                _db_insert_position_in_table(dbObj, position)
-            except sqlite3.OperationalError as e:
-                logger.error(e)
-            except sqlite3.IntegrityError as e:
-                logger.error(e)
-            else:
-                atLeastOneInserted = True
+        timestamps = [position.timestamp for position in positions]
+        attach_shards(dbObj, start, write=timestamps)
+        with dbObj.transaction():
+            for position in positions:
+                try:
+                    _db_insert_position_in_table(dbObj, position)
+                except sqlite3.OperationalError as e:
+                    logger.error(e)
+                except sqlite3.IntegrityError as e:
+                    logger.error(e)
+                else:
+                    atLeastOneInserted = True
         if atLeastOneInserted:
-            logger.info("Successfully positioned this message")
+            logger.debug("Successfully positioned this message")
     else:
-        logger.info(f"No positions found from this message")
-    print()  # for nice printing
-    del dbObj
-
-
-def go_through_database_for_positions() -> None:
-    # Adapters needed to store np-values. Without them, values stored as binary blob
-    sqlite3.register_adapter(np.uint64, lambda val: int(val))
-    sqlite3.register_adapter(np.uint32, lambda val: int(val))
-    sqlite3.register_adapter(np.uint16, lambda val: int(val))
-    sqlite3.register_adapter(np.uint8, lambda val: int(val))
-    pos.init_metadata(old=False)
-    # dbObj = DatabaseManager("src/backend/dbmanager/databases/Aquatraz.db")
-    dbObj = DatabaseManager("src/backend/dbmanager/databases/iof.db")
-    # dbObj = DatabaseManager("databases/iof_bench.db")
-    # dbObj2 = DatabaseManager("databases/benchmark.db")
-    # dbObj = DatabaseManager("databases/iof.db")
-    # dbObj2 = DatabaseManager("databases/iof2.db")
-    positions = pos.position_database(dbObj)
-    for position in positions:
-        try:
-            _db_insert_position_in_table(dbObj, position)
-        except sqlite3.OperationalError as e:
-            # logger.error(e)
-            print(e)
-        except sqlite3.IntegrityError as e:
-            # logger.error(e)
-            print(e)
-        except Exception as e:
-            print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-            print(e)
-            print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
-    print("Completed positioning of database")
-    del dbObj
-
-
-# TODO(perkjelsvik) - Improve path handling for positioning complete database
-if __name__ == "__main__":
-    go_through_database_for_positions()
+        logger.debug(f"No positions found from this message")
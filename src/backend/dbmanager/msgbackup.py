@@ -1,11 +1,22 @@
 # Python built-in modules and packages
+import base64
+import binascii
+import json
 import logging
-import sqlite3  # only needed for error handling
-from typing import Mapping, Optional, Union
+import math
+import sqlite3
+import struct
+import zlib
+from typing import Iterator, List, Mapping, Optional, Tuple, Union
 
 # Third-party modules and packages
 import toml
 
+try:
+    import zstandard
+except ImportError:  # optional, backup blocks are compressed with zlib without it
+    zstandard = None
+
 # Local modules and packages
 from src.backend.dbmanager import dbmanager
 from src.backend.dbmanager import dbformat
@@ -20,8 +31,14 @@ db = ""
 
 # --- Useful type hints ---
 BytesData = str  # base64 format
+RawData = bytes
 SNR = float
 JSONDict = Mapping[str, Union[BytesData, SNR]]
+MQTTPayload = bytes
+BackupRow = Tuple[int, Optional[int], RawData, SNR]  # (row, message_id, data, snr)
+BlockMessage = Tuple[Optional[int], RawData, SNR]  # (message_id, data, snr)
+# (first_message_id, last_message_id, count, compression, data)
+BlockRow = Tuple[Optional[int], Optional[int], int, str, bytes]
 
 
 def init_msgbackup():
@@ -34,34 +51,241 @@ def init_msgbackup():
         logger.exception(f"{e} | db_names toml file wrongly formatted")
     else:
         db = dbPath + dbDict["backup_database"]
+        # Backup databases of older versions only have the base64 'backup' table
+        dbObj = dbmanager.DatabaseManager(db)
+        create_backup_tables(dbObj)
+        dbObj.close()
         logger.info("message backup database path successfully initalized")
 
 
+def create_backup_tables(dbObj: dbmanager.DatabaseManager) -> None:
+    """Creates 'backup_block' table of backup database."""
+    dbObj.add_del_update_db_record(dbformat.sql_query_backup_block_create_table())
+    dbObj.add_del_update_db_record(dbformat.sql_query_backup_block_create_index())
+
+
+def _compression() -> str:
+    compression = dbmanager._storageProfile["backup_compression"]
+    if compression == "zstd" and zstandard is None:
+        logger.warning("zstd backup compression requires zstandard, using zlib")
+        compression = dbmanager._storageProfile["backup_compression"] = "zlib"
+    return compression
+
+
+def pack_block(messages: List[BlockMessage]) -> bytes:
+    """
+    Packs messages to the uncompressed data of a backup block: number of messages,
+    then message_id (-1 if None), snr and data length of each message, then their
+    data. Ids, snrs and lengths are kept in columns, so that they compress well.
+    """
+    count = len(messages)
+    msgIDs = [-1 if msgID is None else msgID for msgID, _, _ in messages]
+    header = struct.pack(
+        f"<I{count}q{count}d{count}I",
+        count,
+        *msgIDs,
+        *(snr for _, _, snr in messages),
+        *(len(data) for _, data, _ in messages),
+    )
+    return header + b"".join(data for _, data, _ in messages)
+
+
+def unpack_block(block: bytes) -> List[BlockMessage]:
+    """Messages of the uncompressed data of a backup block, see pack_block."""
+    (count,) = struct.unpack_from("<I", block)
+    columns = struct.unpack_from(f"<{count}q{count}d{count}I", block, 4)
+    msgIDs, snrs, lengths = columns[:count], columns[count:-count], columns[-count:]
+    messages: List[BlockMessage] = []
+    start = 4 + 20 * count
+    for msgID, snr, length in zip(msgIDs, snrs, lengths):
+        data = block[start : start + length]
+        messages.append((None if msgID == -1 else msgID, data, snr))
+        start += length
+    return messages
+
+
+def compress_block(data: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data)
+    if compression == "zstd":
+        return zstandard.ZstdCompressor().compress(data)
+    return data
+
+
+def decompress_block(data: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "zstd":
+        if zstandard is None:
+            raise ValueError("Backup block is compressed with zstd, needs zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return bytes(data)
+
+
+def mqtt_payload(data: RawData, snr: SNR) -> MQTTPayload:
+    """MQTT payload of a backed up message, as stored by the MQTT client."""
+    return json.dumps({"data": base64.b64encode(data).decode(), "snr": snr}).encode()
+
+
 def store_message_to_backup_db(msg: JSONDict, msgID: Optional[int] = None) -> None:
-    """Stores raw bytearray message as hex in backup database"""
-    data, snr = msg["data"], msg["snr"]
-    if data == b"":
+    """Stores raw bytearray message in backup database"""
+    if msg["data"] == b"":
         raise ValueError("MQTT Message Data is empty!")
+    store_messages_to_backup_db([(msg, msgID)])
+
 
-    # Create database connection and insert backup
-    dbObj = dbmanager.DatabaseManager(db)
-    query_insert = dbformat.sql_query_insert_backup(msgID)
-    if msgID:
-        values = (msgID, data, snr)
+def store_messages_to_backup_db(msgs: List[Tuple[JSONDict, Optional[int]]]) -> None:
+    """
+    Stores a batch of raw messages in backup database with a single transaction.
+    Each element is (msg, msgID), where msgID is None if message handling failed.
+    Message data is stored as raw bytes, in blocks of at most backup_block_size
+    messages compressed with backup_compression of the storage profile. A message
+    without a valid snr is stored with snr NaN.
+    """
+    values = []  # (msgID, raw data, snr)
+    for msg, msgID in msgs:
+        data = msg["data"]
+        if data == b"":
+            logger.error(f"MQTT Message Data is empty! Not storing {msg} in backup")
+            continue
+        try:
+            raw = base64.b64decode(data)
+        except (binascii.Error, TypeError) as e:
+            logger.error(f"{e} | Not storing {msg} in backup, data is not base64")
+            continue
+        try:
+            snr = float(msg["snr"])
+        except (KeyError, TypeError, ValueError):
+            logger.warning(f"No valid snr in {msg}, storing it in backup with snr NaN")
+            snr = math.nan
+        if msgID is None:
+            # Something wrong with this message or the handling of it
+            logger.warning(f"Inserting raw failed message {msg} in backup")
+        values.append((msgID, raw, snr))
+    if not values:
+        return
+
+    dbObj = dbmanager.get_database_manager(db)
+    try:
+        stored = dbObj.run_in_transaction(_insert_blocks, dbObj, values)
+    except sqlite3.Error as e:
+        logger.error(f"{e} | Error while storing {len(values)} msgs into backup!")
     else:
-        values = (data, snr)
+        logger.info(f"Successfully stored {stored} MQTT msgs in backup database")
+
+
+def _insert_blocks(
+    dbObj: dbmanager.DatabaseManager, values: List[BlockMessage]
+) -> int:
+    """Inserts values in blocks, returns number of messages stored."""
+    compression = _compression()
+    blockSize = max(1, int(dbmanager._storageProfile["backup_block_size"]))
+    query_insert = dbformat.sql_query_insert_backup_block()
+    rows: List[BlockRow] = []
+    for i in range(0, len(values), blockSize):
+        block = values[i : i + blockSize]
+        try:
+            rows.append(_block_row(block, compression))
+        except (struct.error, TypeError, ValueError) as e:
+            # Each message in a block of its own, so a bad message only loses itself
+            logger.warning(f"{e} | Failed packing block, packing its msgs one by one")
+            for message in block:
+                try:
+                    rows.append(_block_row([message], compression))
+                except (struct.error, TypeError, ValueError) as e:
+                    msgID = message[0]
+                    logger.error(f"{e} | Not storing msg {msgID} in backup, bad data")
+    dbObj.executemany_db_records(query_insert, rows)
+    return sum(count for _, _, count, _, _ in rows)
+
+
+def _block_row(block: List[BlockMessage], compression: str) -> BlockRow:
+    msgIDs = [msgID for msgID, _, _ in block if msgID is not None]
+    data = compress_block(pack_block(block), compression)
+    firstID, lastID = (min(msgIDs), max(msgIDs)) if msgIDs else (None, None)
+    return (firstID, lastID, len(block), compression, data)
+
+
+def _has_table(con: sqlite3.Connection, table: str) -> bool:
+    query = "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name = ?"
+    return con.execute(query, (table,)).fetchone()[0] > 0
+
+
+def count_backup_messages(con: sqlite3.Connection) -> Tuple[int, Optional[int]]:
+    """Number of messages and largest message_id of backup database."""
+    queries = (
+        ("backup", "SELECT count(*), max(message_id) FROM backup"),
+        ("backup_block", "SELECT sum(count), max(last_message_id) FROM backup_block"),
+    )
+    total, lastID = 0, None
+    for table, query in queries:
+        if not _has_table(con, table):
+            continue
+        count, maxID = con.execute(query).fetchone()
+        total += count or 0
+        if maxID is not None and (lastID is None or maxID > lastID):
+            lastID = maxID
+    return (total, lastID)
+
+
+def stream_backup_rows(backupPath: str, chunkSize: int) -> Iterator[List[BackupRow]]:
+    """
+    Yields messages of backup database in chunks of chunkSize, in order of insertion,
+    as (row, message_id, raw data, snr), where row counts messages from 0. Messages
+    of the base64 'backup' table of older versions come first.
+    """
+    con = sqlite3.connect(f"file:{backupPath}?mode=ro", uri=True)
     try:
-        dbObj.add_del_update_db_record(query_insert, values)
-    except sqlite3.OperationalError as e:
-        logger.error(f"{e} | Error while storing msg {msg} into backup!")
+        chunk: List[BackupRow] = []
+        for row, (msgID, data, snr) in enumerate(_backup_messages(con, chunkSize)):
+            chunk.append((row, msgID, data, snr))
+            if len(chunk) == chunkSize:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        con.close()
 
-    if msgID is not None:
-        logger.info("Successfully stored MQTT msg in backup database")
-    else:
-        # Something wrong with this message or the handling of it
-        # | Message stored in backup without message_id
-        table = "backup"
-        query_rowID = dbformat.sql_query_get_ROWID(table)
-        rowID = dbObj.select_from_db_record(query_rowID)[0][0]  # [(rowid, )]
-        logger.warning(f"Inserted raw failed message {msg} in backup, rowID = {rowID}")
-    del dbObj  # commit and store changes to database
+
+def _backup_messages(con: sqlite3.Connection, limit: int) -> Iterator[BlockMessage]:
+    # Tables are read limit rows (or blocks) at a time
+    if _has_table(con, "backup"):
+        lastRowID = -1
+        while True:
+            rows = con.execute(
+                dbformat.sql_query_get_backup_rows(), (lastRowID, limit)
+            ).fetchall()
+            if not rows:
+                break
+            lastRowID = rows[-1][0]
+            for _, msgID, data, snr in rows:
+                yield (msgID, base64.b64decode(data), snr)
+    if _has_table(con, "backup_block"):
+        lastBlockID = -1
+        while True:
+            rows = con.execute(
+                dbformat.sql_query_get_backup_blocks(), (lastBlockID, limit)
+            ).fetchall()
+            if not rows:
+                break
+            lastBlockID = rows[-1][0]
+            for _, compression, data in rows:
+                yield from unpack_block(decompress_block(data, compression))
+
+
+def load_backup_message(
+    con: sqlite3.Connection, msgID: int
+) -> Optional[Tuple[RawData, SNR]]:
+    """Raw data and snr of message msgID in backup database, None if not found."""
+    query = dbformat.sql_query_get_backup_blocks_of_message_id()
+    for compression, data in con.execute(query, (msgID, msgID)).fetchall():
+        for blockMsgID, raw, snr in unpack_block(decompress_block(data, compression)):
+            if blockMsgID == msgID:
+                return (raw, snr)
+    if _has_table(con, "backup"):
+        query = "SELECT data, SNR FROM backup WHERE message_id = ?"
+        row = con.execute(query, (msgID,)).fetchone()
+        if row is not None:
+            return (base64.b64decode(row[0]), row[1])
+    return None
@@ -1,6 +1,13 @@
 # Python built-in modules and packages
 from dataclasses import dataclass
-from typing import Dict, List, Union, Tuple
+from typing import Dict, List, Sequence, Union, Tuple
+
+# Third-party modules and packages
+import numpy as np
+
+# Local modules and packages
+from src.backend.dbmanager import dbformat
+from src.backend.msghandler import batchdecode
 
 
 # --- Useful type hints ---
@@ -12,6 +19,8 @@ Packet = Dict[DatafieldName, PacketData]
 Message = Dict[str, List[Packet]]
 RowDB = List[Tuple[DatafieldName, PacketData]]
 DbFormat = Dict[str, List[DatafieldName]]
+# (table, columns): [(message index, values), ...]
+DatabaseRows = Dict[Tuple[TableName, Tuple[str, ...]], List[Tuple[int, Tuple]]]
 
 # Database table formats
 dbFormats: DbFormat = {
@@ -50,8 +59,6 @@ dbFormats: DbFormat = {
         "tag_id",
         "tag_data",
         "tag_data_raw",
-        "tag_data_2",  # DS256
-        "tag_data_raw_2",  # DS256
         "snr",
         "millisecond",
         "comment",
@@ -62,46 +69,31 @@ dbFormats: DbFormat = {
 @dataclass
 class DatabasePacket:
     table: TableName
-    columns: Tuple[str]
+    columns: Tuple[str, ...]
     values: Tuple[PacketData]
     numOfValues: int = 0
     sql_columns: str = ""
     sql_values: str = ""
+    sql_query: str = ""
 
     def __post_init__(self):
-        self.numOfValues = len(self.values)
-        self._handle_sql_columns()
-        self._handle_sql_values()
-
-    def _handle_sql_columns(self):
-        """
-        Uses columns=('col_name_1', 'col_name_2', ..., 'col_name_n')
-        to set self.sql_columns='(col_name_1, col_name_2, ..., col_name_3)'
         """
-        iterable = iter(self.columns)
-        column_names = f"({next(iterable)}"
-        while True:
-            try:
-                column_names += f", {next(iterable)}"
-            except StopIteration:
-                column_names += ")"
-                break
-        self.sql_columns = column_names
-
-    def _handle_sql_values(self):
-        """
-        Uses numOfValues to set self.sql_values='(?, ?, ..., ?)' for safer sql insertion
+        Sets sql_columns='(col_name_1, ..., col_name_n)', sql_values='(?, ..., ?)' for
+        safer sql insertion, and the insert query. The strings are built once per
+        table and columns, and shared by all packets of the same shape.
         """
-        self.sql_values = f"({'?, '*(self.numOfValues - 1)}?)"
+        self.numOfValues = len(self.values)
+        strings = dbformat.sql_insert_strings(self.table, self.columns)
+        self.sql_columns, self.sql_values, self.sql_query = strings
 
 
 def convert_msg_to_database_format(msg: Message, msgID: int) -> List[DatabasePacket]:
     dbmsg: List[DatabasePacket] = []
     for i, packet in enumerate(msg.payload):
         type: TableName = packet["packetType"]
-        dbformat: List[DatafieldName] = dbFormats[type]
+        tableFormat: List[DatafieldName] = dbFormats[type]
         columns, values = [], []  # type: List[str], List[PacketData]
-        for datafield in dbformat:
+        for datafield in tableFormat:
             if datafield in packet:
                 columns.append(datafield)
                 values.append(packet[datafield])
@@ -111,3 +103,36 @@ def convert_msg_to_database_format(msg: Message, msgID: int) -> List[DatabasePac
         dbPacket = DatabasePacket(type, tuple(columns), tuple(values))
         dbmsg.append(dbPacket)
     return dbmsg
+
+
+def convert_batch_to_database_format(
+    batch: batchdecode.DecodedBatch, msgIDs: Sequence[int]
+) -> DatabaseRows:
+    """
+    Database rows of a decoded batch with message_id msgIDs[i] for message i, grouped
+    by table and columns. Gives the same columns and values as
+    convert_msg_to_database_format, without creating a dict per packet.
+    """
+    ids = np.asarray(msgIDs)
+    rows: DatabaseRows = {}
+    for type in ("tag", "tbr", "gps"):
+        array = getattr(batch, type)
+        # Packets of the same comm protocol have the same datafields
+        if type == "tag":
+            keys = array["comm_protocol"]
+        elif type == "tbr":
+            keys = array["commCode"]
+        else:
+            keys = np.zeros(len(array), np.int64)
+        groups = np.unique(keys, return_inverse=True)[1]
+        for group in np.unique(groups):
+            selected = array[groups == group]
+            code = int(selected["commCode"][0]) if type != "gps" else 0
+            datafields = batchdecode.packet_datafields(type, code)
+            columns = [d for d in dbFormats[type] if d in datafields]
+            values = [ids[selected["message"]].tolist()]
+            values += [selected[column].tolist() for column in columns]
+            rows.setdefault((type, ("message_id", *columns)), []).extend(
+                zip(selected["message"].tolist(), zip(*values))
+            )
+    return rows
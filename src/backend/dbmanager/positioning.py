@@ -1,10 +1,17 @@
 # Python built-in modules and packages
 from __future__ import annotations
+import collections
 import logging
+import os
+import sqlite3
+import threading
+import time
 from dataclasses import dataclass
-from typing import List, Tuple, Optional, Any, Dict, Union
+from typing import List, Tuple, Optional, Any, Deque, Dict, FrozenSet, NamedTuple
+from typing import Union
 
 # Third-party modules and packages
+import numpy as np
 import pandas as pd
 import toml
 
@@ -20,6 +27,9 @@ msghandler = Any  # Any type to avoid uneccesary import
 CageMetaDict = Dict[str, List[ListTBR]]
 TagsMetaDict = Dict[str, Union[int, str]]
 MetaDict = Dict[str, Dict[str, Union[CageMetaDict, TagsMetaDict]]]
+TripletArrays = Tuple[np.ndarray, np.ndarray, np.ndarray]  # (depths, sec, msec)
+BatchXYZ = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]  # (x, y, z, valid)
+WindowKey = Tuple[int, int, Tuple[int, ...]]  # (tag_id, frequency, TBRs)
 
 # TODO(perkjelsvik) - Improve path handling when positioning complete database
 
@@ -77,8 +87,78 @@ class Position:
     longitude: float
 
 
+class MetadataIndex(NamedTuple):
+    """Positioning metadata, with the depth tags and TBRs hashed for lookups."""
+
+    cages: Dict[str, CageMeta]
+    depthTags: List[TagsMeta]
+    depthTagKeys: FrozenSet[Tuple[int, int]]  # {(tag_id, frequency)}
+    tbrCages: Dict[int, Tuple[CageMeta, ListTBR]]  # {tbr_serial_id: (cage, TBRs)}
+
+
+_metaFile = "src/backend/.config/metadata_positioning.toml"
+_reloadInterval = 1.0  # seconds between checks of modification time of _metaFile
+_index: Optional[MetadataIndex] = None
+_metaMtime: Optional[int] = None
+_metaChecked: Optional[float] = None  # not watched until init_metadata is called
+_metaLock = threading.Lock()
+# Same as cages and depthTags of _index, for code positioning a whole database
 _cages, _depth_tags = None, None
 
+# Station geometry of each set of TBRs, rebuilt when the position of a TBR changes
+# | {(TBR_A, TBR_B, TBR_C, depth): StationData}, and circle through the stations of
+# | each StationData, {(TBR_A, TBR_B, TBR_C): (StationData, CageCircle)}
+_stations: Dict[Tuple[int, int, int, float], tdoa.StationData] = {}
+_stationCircles: Dict[Tuple[int, int, int], Tuple[tdoa.StationData, CageCircle]] = {}
+
+
+def _load_metadata_index(path: str) -> MetadataIndex:
+    metaDict: MetaDict = toml.load(path)
+    cages, depth_tags = {}, []
+    cage3D = metaDict["3D"]
+    for cage_key in cage3D["active_cages"]:
+        cageGeo = None
+        cageName = cage3D["cages"][cage_key]["name"]
+        tbrList = cage3D["cages"][cage_key]["tbr"]["tbrs"]
+        depth = cage3D["cages"][cage_key]["tbr"]["depth"]
+        if "geometry" in cage3D["cages"][cage_key]:
+            geo = cage3D["cages"][cage_key]["geometry"]
+            latlong = cage3D["cages"][cage_key]["latlong"]
+            center = Point(geo["centerX"], geo["centerY"])
+            circle = CageCircle(center, geo["radius"])
+            cageGeo = CageGeometry(
+                circle=circle,
+                lat_A=latlong["lat_A"],
+                lat_B=latlong["lat_B"],
+                lat_C=latlong["lat_C"],
+                lon_A=latlong["lon_A"],
+                lon_B=latlong["lon_B"],
+                lon_C=latlong["lon_C"],
+            )
+        cages.update({cageName: CageMeta(cageName, tbrList, depth, cageGeo)})
+    for tag_key in metaDict["tags"]:
+        tag_id = metaDict["tags"][tag_key]["tag_id"]
+        frequency = metaDict["tags"][tag_key]["frequency"]
+        cageName = metaDict["tags"][tag_key]["cage_name"]
+        depth_tags.append(TagsMeta(tag_id, frequency, cageName))
+
+    # A TBR listed in several cages belongs to the first of them
+    tbrCages: Dict[int, Tuple[CageMeta, ListTBR]] = {}
+    for cage in cages.values():
+        for listOfTBRs in cage.tbr:
+            for tbr_serial_id in listOfTBRs:
+                tbrCages.setdefault(tbr_serial_id, (cage, listOfTBRs))
+    depthTagKeys = frozenset((tag.tag_id, tag.frequency) for tag in depth_tags)
+    return MetadataIndex(cages, depth_tags, depthTagKeys, tbrCages)
+
+
+def _set_metadata_index(index: Optional[MetadataIndex], mtime: Optional[int]) -> None:
+    global _index, _metaMtime, _cages, _depth_tags
+    # Readers take _index once, so they never see parts of two different files
+    _index, _metaMtime = index, mtime
+    _cages = None if index is None else index.cages
+    _depth_tags = None if index is None else index.depthTags
+
 
 def init_metadata(old=False) -> Optional[Tuple[CageMetaDict, List[TagsMeta]]]:
     """Loads positoning metadata from .toml file if it exists.
@@ -86,7 +166,9 @@ def init_metadata(old=False) -> Optional[Tuple[CageMetaDict, List[TagsMeta]]]:
     Loads metadata from toml-file into dictonary, and if successful, iterates through
     said metadata. For cages metadata, it creates an instance of CageMeta for each
     cage, and for tags metdata, it creates an instance of TagsMeta for each depth tag.
-    These instances are added to lists 'cages' and 'depth_tags'.
+    These instances are added to lists 'cages' and 'depth_tags', and indexed by
+    (tag_id, frequency) of depth tags and by tbr_serial_id in a MetadataIndex.
+    From then on, get_metadata_index reloads the file when it changes.
 
     Returns:
         Returns a tuple of two lists, where the first list contains multiple instances
@@ -98,61 +180,133 @@ def init_metadata(old=False) -> Optional[Tuple[CageMetaDict, List[TagsMeta]]]:
             Can't do positioning.
         Exception: Caught an error while loading metadata positioning
     """
-    global _cages
-    global _depth_tags
-    try:
-        metaDict: MetaDict = toml.load("src/backend/.config/metadata_positioning.toml")
-    except FileNotFoundError:
-        logger.error(
-            "NB! No metadata position config file found. Can't do positioning."
-        )
-        return None
-    except Exception:
-        logger.exception("Caught an error while loading metadata positioning")
-        return None
-    else:
-        cages, depth_tags = {}, []
-        cage3D = metaDict["3D"]
-        for cage_key in cage3D["active_cages"]:
-            cageGeo = None
-            cageName = cage3D["cages"][cage_key]["name"]
-            tbrList = cage3D["cages"][cage_key]["tbr"]["tbrs"]
-            depth = cage3D["cages"][cage_key]["tbr"]["depth"]
-            if "geometry" in cage3D["cages"][cage_key]:
-                geo = cage3D["cages"][cage_key]["geometry"]
-                latlong = cage3D["cages"][cage_key]["latlong"]
-                center = Point(geo["centerX"], geo["centerY"])
-                circle = CageCircle(center, geo["radius"])
-                cageGeo = CageGeometry(
-                    circle=circle,
-                    lat_A=latlong["lat_A"],
-                    lat_B=latlong["lat_B"],
-                    lat_C=latlong["lat_C"],
-                    lon_A=latlong["lon_A"],
-                    lon_B=latlong["lon_B"],
-                    lon_C=latlong["lon_C"],
-                )
-            cages.update({cageName: CageMeta(cageName, tbrList, depth, cageGeo)})
-        for tag_key in metaDict["tags"]:
-            tag_id = metaDict["tags"][tag_key]["tag_id"]
-            frequency = metaDict["tags"][tag_key]["frequency"]
-            cageName = metaDict["tags"][tag_key]["cage_name"]
-            depth_tags.append(TagsMeta(tag_id, frequency, cageName))
-        _cages, _depth_tags = cages, depth_tags
+    global _metaChecked
+    with _metaLock:
+        _metaChecked = time.monotonic()
+        try:
+            mtime = os.stat(_metaFile).st_mtime_ns
+            index = _load_metadata_index(_metaFile)
+        except FileNotFoundError:
+            logger.error(
+                "NB! No metadata position config file found. Can't do positioning."
+            )
+            return None
+        except Exception:
+            logger.exception("Caught an error while loading metadata positioning")
+            return None
+        else:
+            _set_metadata_index(index, mtime)
     return None
 
 
+def get_metadata_index() -> Optional[MetadataIndex]:
+    """
+    Returns positioning metadata loaded by init_metadata, None if there is none. The
+    metadata is reloaded when the modification time of metadata_positioning.toml
+    changes, checked at most once per _reloadInterval. An index is never modified, a
+    reload replaces it. A file that fails to load keeps the current metadata.
+    """
+    global _metaChecked
+    if _metaChecked is None or time.monotonic() - _metaChecked < _reloadInterval:
+        return _index
+    with _metaLock:
+        now = time.monotonic()
+        if now - _metaChecked < _reloadInterval:
+            return _index  # checked by another thread meanwhile
+        _metaChecked = now
+        try:
+            mtime: Optional[int] = os.stat(_metaFile).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == _metaMtime:
+            return _index
+        if mtime is None:
+            logger.error("NB! metadata position config file removed, not positioning")
+            _set_metadata_index(None, None)
+            return _index
+        try:
+            index = _load_metadata_index(_metaFile)
+        except Exception:
+            # Possibly a partly written file, keep current metadata and retry next check
+            logger.exception("Caught an error while loading metadata positioning")
+        else:
+            logger.info(
+                f"Reloaded {len(index.cages)} cages and {len(index.depthTags)} depth "
+                f"tags of {_metaFile}"
+            )
+            _set_metadata_index(index, mtime)
+        return _index
+
+
 # *------------------------------------------------*
 # | "private" helper-functions used by this module |
 # *------------------------------------------------*
 
 
+def _label_triplets(
+    timestamp: np.ndarray, millisecond: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Sorts detections by timestamp, labels their triplets and adjusts drifted times.
+
+    A triplet ends at every detection whose timestamp is at most 2 s after the one of
+    the detection two places before it. Detections of overlapping triplets belong to
+    the last of them. Timestamps of the 1st and 3rd detection of a triplet are set to
+    the timestamp of the 2nd if the time between them and the 2nd is at least 0.667 s.
+
+    Args:
+        timestamp: Array of timestamps of detections.
+        millisecond: Array of milliseconds of detections.
+
+    Returns:
+        Tuple (order, labels, timestamps) where order is the indices that sort the
+        detections by timestamp and millisecond, and labels and timestamps are arrays
+        of the sorted detections. labels numbers triplets from 0 in order of time, -1
+        for detections that aren't in a triplet, and timestamps are the adjusted
+        timestamps.
+    """
+    ts_drift_threshold = 2
+    ms_1km = 0.667
+
+    # Sort by timestamps in case some timestamps are in the wrong order
+    # | and by milliseconds, so that triplets don't depend on the order of the rows
+    order = np.lexsort((millisecond, timestamp))
+    ts = np.asarray(timestamp, dtype=np.int64)[order]
+    labels = np.full(ts.size, -1, dtype=np.int64)
+
+    # Find last detection of every triplet, and label detections of triplets
+    # | a detection in several triplets gets the label of the last of them
+    last_indices = np.flatnonzero(ts[2:] - ts[:-2] <= ts_drift_threshold) + 2
+    if not last_indices.size:
+        return (order, labels, ts)
+    all_indices = np.sort(
+        np.concatenate([last_indices, last_indices - 1, last_indices - 2])
+    )
+    lastOccurrence = np.append(all_indices[1:] != all_indices[:-1], True)
+    labels[all_indices[lastOccurrence]] = np.flatnonzero(lastOccurrence) // 3
+
+    # Adjust timestamps that have drifted
+    # | if 2nd timestamp in triplet is much larger than the 1st, add 2nd index to list
+    # | if 3rd timestamp in triplet is much larger than the 2nd, add 2nd index to list
+    drift = ts + np.asarray(millisecond)[order] / 1000
+    drift_3rd = np.abs(drift[last_indices] - drift[last_indices - 1]) >= ms_1km
+    drift_1st = np.abs(drift[last_indices - 1] - drift[last_indices - 2]) >= ms_1km
+    drift_indices = np.concatenate(
+        [last_indices[drift_3rd] - 1, last_indices[drift_1st] - 1]
+    )
+
+    # Set timestamp 1 and 3 of each triplet with drift equal to 2nd timestamp
+    adjusted = ts.copy()
+    adjusted[drift_indices - 1] = ts[drift_indices]
+    adjusted[drift_indices + 1] = ts[drift_indices]
+    return (order, labels, adjusted)
+
+
 def _adjust_tstamp_drift_of_triplet(df: pd.Dataframe) -> List[pd.DataFrame]:
     """Return list of pandas DataFrames where timestamp offsets has been adjusted.
 
     Sorts dataframe based on timestamp, finds triplets where timestamp is equal +-2, and
     adjusts any timestamps +-2 from 2nd timestamp to be equal to 2nd timestamp. Returns
-    a list of all valid triplets.
+    a list of all valid triplets. See _label_triplets.
 
     Args:
         df: pd.DataFrame where columns "timestamp" and "millisecond" are used to adjust.
@@ -173,45 +327,15 @@ def _adjust_tstamp_drift_of_triplet(df: pd.Dataframe) -> List[pd.DataFrame]:
         | 1556555370 |     005     |     69    |   12  |   3.5   |
         | 1556555370 |     010     |     69    |   12  |   3.5   |
     """
-    ts_drift_threshold = 2
-    ms_1km = 0.667
-
-    # Sort dataframe by timestamps in case some timestamps are in the wrong order
-    df = df.sort_values("timestamp")
-    df = df.reset_index(drop=True)
-
-    # Extract timestamps and find all triplets within dataframe
-    ts = df["timestamp"]
-    last_indices = ts.index[ts.diff(periods=2) <= ts_drift_threshold]
-    all_indices = last_indices.append(
-        [last_indices - 1, last_indices - 2]
-    ).sort_values()
-
-    # Mask out all detections that aren't triplets
-    mask_values = [i for i in range(len(last_indices)) for _ in range(3)]
-    df.loc[all_indices, "mask"] = mask_values
-    df = df[df["mask"].notnull()]
-    if df.empty:
-        return []
-
-    # Adjust timestamps that have drifted
-    # | if 2nd timestamp in triplet is much larger than the 1st, add 2nd index to list
-    # | if 3rd timestamp in triplet is much larger than the 2nd, add 2nd index to list
-    df["drift"] = df.apply(lambda x: x["timestamp"] + x["millisecond"] / 1000, axis=1)
-    drift = df["drift"].diff()
-    drift_3rd = drift[last_indices].where(abs(drift[last_indices]) >= ms_1km)
-    drift_1st = drift[last_indices - 1].where(abs(drift[last_indices - 1]) >= ms_1km)
-    drift_indices = drift_3rd.dropna().index - 1  # -1 to get index of 2nd timestamp
-    drift_indices = drift_indices.append(drift_1st.dropna().index)
-
-    # Set timestamp 1 and 3 of each triplet with drift has equal to 2nd timestamp
-    df.loc[drift_indices - 1, "timestamp"] = ts[drift_indices].values
-    df.loc[drift_indices + 1, "timestamp"] = ts[drift_indices].values
+    order, labels, timestamps = _label_triplets(
+        df["timestamp"].to_numpy(), df["millisecond"].to_numpy()
+    )
+    df = df.iloc[order].reset_index(drop=True)
+    df["timestamp"] = timestamps.astype(df["timestamp"].dtype)
 
     # get and return triplets as list of dataframes
-    triplets = [v.drop(["mask", "drift"], axis=1) for _, v in df.groupby("mask")]
-    # triplets = [v.drop(["mask"], axis=1) for _, v in df.groupby("mask")]
-    return triplets
+    inTriplet = labels >= 0
+    return [v for _, v in df[inTriplet].groupby(labels[inTriplet])]
 
 
 def circleFromThreePoints(P0: Point, P1: Point, P2: Point) -> CageCircle:
@@ -245,24 +369,45 @@ def circleFromThreePoints(P0: Point, P1: Point, P2: Point) -> CageCircle:
     return CageCircle(Point(x, y), r)
 
 
-def _is_depth_tag(tag_id: int, frequency: int) -> bool:
+def _is_depth_tag(
+    tag_id: int, frequency: int, index: Optional[MetadataIndex] = None
+) -> bool:
     """Checks if tag_id and frequency combination is a depth tag.
 
-    Iterates through list of dataclass instances of MetaTag, and checks if the provided
-    tag_id and frequency combination is a depth tag. If so, it retusn True.
+    Looks up the tag_id and frequency combination in the set of depth tags of the
+    metadata index. If it is a depth tag, it returns True.
 
     Args:
         tag_id: Integer ID number representing tag.
         frequency: Integer representing which frequency the tag is detected.
+        index: MetadataIndex to look in, default is the one loaded by init_metadata.
 
     Returns:
         If a match is found in metadata, the function returns True.
         Else it returns False
     """
-    for tagMeta in _depth_tags:
-        if (tag_id == tagMeta.tag_id) & (frequency == tagMeta.frequency):
-            return True
-    return False
+    index = _index if index is None else index
+    return index is not None and (tag_id, frequency) in index.depthTagKeys
+
+
+def get_depth_tag_packets(payload: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Returns the tag packets of payload that are detections of a depth tag.
+
+    Args:
+        payload: List of packets, as in msghandler.Message payload.
+
+    Returns:
+        List of depth tag packets. Empty if there is no metadata for positioning.
+    """
+    index = get_metadata_index()
+    if index is None:
+        return []
+    return [
+        packet
+        for packet in payload
+        if packet["packetType"] == "tag"
+        and (packet["tag_id"], packet["frequency"]) in index.depthTagKeys
+    ]
 
 
 def _get_tag_df(
@@ -307,18 +452,64 @@ def _get_tag_df(
     df = pd.read_sql(query_tag, dbObj.con, params=TBRs)
     if len(df.index) == 3 and df.tbr_serial_id.unique().size > 2:
         triplet = True
-        # Make dataframe more memory efficient
-        df.tbr_serial_id = df.tbr_serial_id.astype("uint16")
-        df.timestamp = df.timestamp.astype("uint32")
-        df.millisecond = df.millisecond.astype("uint16")
-        df.frequency = df.frequency.astype("uint8")
-        # tag_data is already float type, tag_id uint16 in case of 'S64K'
-        df.tag_id = df.tag_id.astype("uint16")
+        df = _optimize_tag_df(df)
         # sort by timestamp and adjust timestamps that has drifted
         df = _adjust_tstamp_drift_of_triplet(df)[0]  # [df]
     return (triplet, df)
 
 
+def _optimize_tag_df(df: pd.DataFrame) -> pd.DataFrame:
+    # Make dataframe more memory efficient
+    df.tbr_serial_id = df.tbr_serial_id.astype("uint16")
+    df.timestamp = df.timestamp.astype("uint32")
+    df.millisecond = df.millisecond.astype("uint16")
+    df.frequency = df.frequency.astype("uint8")
+    # tag_data is already float type, tag_id uint16 in case of 'S64K'
+    df.tag_id = df.tag_id.astype("uint16")
+    return df
+
+
+def _get_station_positions(
+    TBRs: List[int], dbObj: DatabaseManager
+) -> List[tdoa.LatLong]:
+    """Latest positions of TBRs, see _get_station_data. Missing TBRs are left out.
+
+    Reads the 'station_fixes' table, which holds the newest '3D-fix' position of each
+    TBR per pdop class, and is updated whenever gps packets are inserted. Databases
+    created before it are searched in the 'gps' table instead.
+    """
+    try:
+        rows = dbObj.select_from_db_record(
+            dbformat.sql_query_get_station_fixes(len(TBRs)), tuple(TBRs)
+        )
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        return _get_latest_gps_positions(TBRs, dbObj)
+    fixes: Dict[int, tdoa.LatLong] = {}
+    for tbr_id, lat, lon in rows:  # lowest pdop class of each TBR first
+        fixes.setdefault(tbr_id, tdoa.LatLong(lat, lon))
+    return [fixes[tbr_id] for tbr_id in TBRs if tbr_id in fixes]
+
+
+def _get_latest_gps_positions(
+    TBRs: List[int], dbObj: DatabaseManager
+) -> List[tdoa.LatLong]:
+    # Looks for most recent '3D-fix' quality position
+    # | And accepts the newest found position with pdop lower than 1, or 2, ..., or 6
+    tbr_pos = []
+    pdopValues = range(1, dbformat.stationFixMaxPdop + 1)
+    for tbr_id in TBRs:
+        for pdop in pdopValues:
+            sql_query = dbformat.sql_query_get_latest_TBR_pos(tbr_id, pdop)
+            latlon = dbObj.select_from_db_record(sql_query)  # [(lat, lon)]
+            if latlon:
+                lat, lon = latlon[0]
+                tbr_pos.append(tdoa.LatLong(lat, lon))
+                break
+    return tbr_pos
+
+
 def _get_station_data(
     TBRs: List[int], depth: float, dbObj: DatabaseManager
 ) -> tdoa.StationData:
@@ -328,6 +519,7 @@ def _get_station_data(
     position and packs it into a dataclass StationData instance. Only accepts a position
     where fix='3D-fix', and pdop in range(1, 7) (choosing the lowest available one).
     Does not work if there isn't at least one valid position for each TBR.
+    The StationData of TBRs is reused until the position of one of them changes.
 
     Args:
         TBRs: A list of TBR IDs for this cage.
@@ -341,29 +533,32 @@ def _get_station_data(
     Raises:
         ValueError: Did not find a position for each TBR!
     """
-    # Get newest latitude/longitude positions for TBRs
-    # | Looks for most recent '3D-fix' quality position
-    # | And accepts the newest found position with pdop lower than 1, or 2, ..., or 6
-    tbr_pos = []
     # Combak(perkjelsvik) - Should I also add timestamp filter, f. ex. last 24 hours?
-    pdopValues = range(1, 7)
-    for tbr_id in TBRs:
-        for pdop in pdopValues:
-            sql_query = dbformat.sql_query_get_latest_TBR_pos(tbr_id, pdop)
-            latlon = dbObj.select_from_db_record(sql_query)  # [(lat, lon)]
-            if latlon:
-                lat, lon = latlon[0]
-                tbr_pos.append(tdoa.LatLong(lat, lon))
-                break
+    tbr_pos = _get_station_positions(TBRs, dbObj)
     if len(tbr_pos) < 3:
         raise ValueError(
             f"Did not find position for all TBRs ({TBRs}) in database! "
             f"Found {tbr_pos}"
         )
+    key = (*TBRs, depth)
+    cached = _stations.get(key)
+    if cached is not None and [cached.pos_A, cached.pos_B, cached.pos_C] == tbr_pos:
+        return cached
     station_data = tdoa.StationData(*TBRs, *tbr_pos, depth)
+    _stations[key] = station_data
     return station_data
 
 
+def _get_station_circle(stations: tdoa.StationData) -> CageCircle:
+    """Circle through the stations, computed once for each StationData."""
+    key = (stations.TBR_A, stations.TBR_B, stations.TBR_C)
+    cached = _stationCircles.get(key)
+    if cached is None or cached[0] is not stations:
+        circle = circleFromThreePoints(stations.xyz_A, stations.xyz_B, stations.xyz_C)
+        cached = _stationCircles[key] = (stations, circle)
+    return cached[1]
+
+
 def _get_tag_depth_and_timestamps(
     station_data: tdoa.StationData, df: pd.DataFrame
 ) -> Tuple[float, tdoa.Timestamps]:
@@ -393,15 +588,47 @@ def _get_tag_depth_and_timestamps(
     return (depth, tstamps)
 
 
-def _get_cage_and_TBR_data(tbr_serial_id: int) -> Optional[CageMeta]:
+def _get_triplet_arrays(
+    station_data: tdoa.StationData,
+    df: pd.DataFrame,
+    rows: np.ndarray,
+    timestamps: np.ndarray,
+) -> TripletArrays:
+    """Batch version of _get_tag_depth_and_timestamps, for triplets of find_triplets.
+
+    Args:
+        station_data: Dataclass tdoa.StationData instance of the TBRs of detections.
+        df: A pandas.DataFrame of tag detections.
+        rows: (N, 3) array of row positions in df of each triplet.
+        timestamps: Array of drift adjusted timestamps of rows of df.
+
+    Returns:
+        Tuple of (N,) array of depth of each triplet, and (N, 3) arrays of timestamp
+        and millisecond of each triplet in station A, B and C.
+    """
+    stationIndex = {station_data.TBR_A: 0, station_data.TBR_B: 1, station_data.TBR_C: 2}
+    columns = df["tbr_serial_id"].map(stationIndex).to_numpy()[rows]
+    depths = df["tag_data"].to_numpy()[rows].mean(axis=1)
+    triplets = np.arange(len(rows))[:, np.newaxis]
+    sec = np.zeros((len(rows), 3), dtype=np.int64)
+    msec = np.zeros((len(rows), 3), dtype=np.int64)
+    sec[triplets, columns] = timestamps[rows]
+    msec[triplets, columns] = df["millisecond"].to_numpy()[rows]
+    return (depths, sec, msec)
+
+
+def _get_cage_and_TBR_data(
+    tbr_serial_id: int, index: Optional[MetadataIndex] = None
+) -> Tuple[Optional[CageMeta], Optional[ListTBR]]:
     """Retrives list of TBR IDs and shared depth of TBRs.
 
-    Iterates through list of loaded cage metadata containing lists of TBR serial IDs,
-    and returns cage information as an instance of dataclass 'CageMeta' if a match is
-    found between input tbr_id and list of TBRs.
+    Looks up the TBR serial ID in the metadata index, and returns cage information as
+    an instance of dataclass 'CageMeta' and the list of TBRs of the cage the TBR is
+    part of, if the TBR is in a cage.
 
     Args:
         tbr_serial_id: Integer representing serial ID number of TBR.
+        index: MetadataIndex to look in, default is the one loaded by init_metadata.
 
     Returns:
         If a match is found, the functions returns the relevant CageMeta instance of
@@ -412,44 +639,155 @@ def _get_cage_and_TBR_data(tbr_serial_id: int) -> Optional[CageMeta]:
             tbr: List[List[int]]=[[32, 33, 34], [128, 129, 130]],
             depth: float=3
 
-        If no match is found, the function returns None.
+        If no match is found, the function returns (None, None).
     """
-    for cage in _cages:
-        for listOfTBRs in _cages[cage].tbr:
-            if tbr_serial_id in listOfTBRs:
-                return (_cages[cage], listOfTBRs)
-    logger.warning(f"No matching set of TBRs were found for {tbr_serial_id}")
-    return None
+    index = _index if index is None else index
+    cageAndTBRs = None if index is None else index.tbrCages.get(tbr_serial_id)
+    if cageAndTBRs is None:
+        logger.warning(f"No matching set of TBRs were found for {tbr_serial_id}")
+        return (None, None)
+    return cageAndTBRs
 
 
-def _get_list_of_triplets_from_db(
-    tag_id: int, frequency: int, TBRs: List[int], dbObj: DatabaseManager
-) -> List[pd.DataFrame]:
-    """Return list of pandas DataFrames of tag triplets for complete database.
+def _get_tag_detections_from_db(
+    tag_id: int,
+    frequency: int,
+    TBRs: List[int],
+    dbObj: DatabaseManager,
+    timeRange: Optional[Tuple[int, int]] = None,
+) -> pd.DataFrame:
+    """Return pandas DataFrame of all detections of a tag by TBRs in database.
 
     Extracts all messages of (tag_id, frequency) combination from main database into a
-    pandas DataFrame. Then calls on '_adjust_tstamp_drift_of_triplet' to find triplets.
+    pandas DataFrame, which 'find_triplets' searches for triplets.
 
     Args:
         tag_id: Integer ID for tag_id wanted.
         frequency: Integer ID for frequency wanted.
         TBRs: A list of TBR IDs, used to filter from database.
         dbObj: dbmanager.DatabaseManager instance, with connection to main database.
+        timeRange: Optional (start, end) of timestamps, both included. By default all
+            detections are read.
 
     Returns:
-        Returns list of pd.DataFrame where wach dataframe represents a tag triplet.
+        Returns pd.DataFrame with columns timestamp, tbr_serial_id, tag_data and
+        millisecond.
     """
-    sql_query = dbformat.sql_query_get_db_all_tag_freq_detections(tag_id, frequency)
+    sql_query = dbformat.sql_query_get_db_all_tag_freq_detections(
+        tag_id, frequency, timeRange is not None
+    )
+    params = list(TBRs) + list(timeRange or ())
 
     # Read from main database into pandas dataframe, and optimize df memory usage
-    df = pd.read_sql(sql_query, dbObj.con, params=TBRs)
+    df = pd.read_sql(sql_query, dbObj.con, params=params)
     df.timestamp = df.timestamp.astype("uint32")
     df.tbr_serial_id = df.tbr_serial_id.astype("uint16")
     df.millisecond = df.millisecond.astype("uint16")
     # tag_data is already float type, tag_id uint16 in case of 'S64K'
+    return df
+
+
+def _get_cage_stations(
+    cage: CageMeta, TBRs: List[int], dbObj: DatabaseManager
+) -> tdoa.StationData:
+    """StationData of TBRs, at positions of cage geometry if metadata gives them."""
+    if cage.geometry is None:
+        return _get_station_data(TBRs, cage.depth, dbObj)
+    A_pos = tdoa.LatLong(cage.geometry.lat_A, cage.geometry.lon_A)
+    B_pos = tdoa.LatLong(cage.geometry.lat_B, cage.geometry.lon_B)
+    C_pos = tdoa.LatLong(cage.geometry.lat_C, cage.geometry.lon_C)
+    return tdoa.StationData(*TBRs, A_pos, B_pos, C_pos, cage.depth)
+
 
-    triplets = _adjust_tstamp_drift_of_triplet(df)
-    return triplets
+# *-----------------------------------------------*
+# | Window of recent detections of new messages |
+# *-----------------------------------------------*
+
+
+class Detection(NamedTuple):
+    added: float  # time.monotonic() when added to window
+    timestamp: int
+    millisecond: int
+    frequency: int
+    tag_id: int
+    tag_data: float
+    tbr_serial_id: int
+
+
+class DetectionWindow:
+    """Recent depth tag detections, to find triplets of new messages in memory.
+
+    Keeps the detections added in the last maxAge seconds in one buffer per depth tag
+    and set of TBRs of its cage, at most maxSize per buffer (the oldest are dropped
+    first). A triplet is found the moment its last detection is added, without reading
+    the detections back from the database. Only added detections are seen, so a
+    triplet is missed if some of its detections were handled before a restart or by
+    another client worker (use 'tbr' partitioning, see workers).
+
+    Attributes:
+        maxAge: Seconds a detection is kept after it is added.
+        maxSize: Maximum number of detections of each buffer.
+    """
+
+    interval = 5  # seconds around a detection searched for a triplet, as _get_tag_df
+
+    def __init__(self, maxAge: float = 600.0, maxSize: int = 1000) -> None:
+        self.maxAge = maxAge
+        self.maxSize = maxSize
+        self._buffers: Dict[WindowKey, Deque[Detection]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(buffer) for buffer in self._buffers.values())
+
+    def add(self, packet: Dict[str, Any], TBRs: ListTBR) -> Optional[pd.DataFrame]:
+        """Adds a depth tag detection, and returns the triplet it completes.
+
+        Like _get_tag_df, a triplet is exactly three detections by different TBRs
+        within interval seconds of the added detection. Its timestamps are adjusted
+        for drift as by _adjust_tstamp_drift_of_triplet.
+
+        Args:
+            packet: Tag packet of msghandler.Message payload of a depth tag.
+            TBRs: List of TBR IDs of the cage of the packet.
+
+        Returns:
+            pandas.DataFrame of the triplet with the same columns as the one of
+            _get_tag_df, or None if the detection does not complete a triplet.
+        """
+        key = (packet["tag_id"], packet["frequency"], tuple(TBRs))
+        buffer = self._buffers.get(key)
+        if buffer is None:
+            buffer = self._buffers[key] = collections.deque(maxlen=self.maxSize)
+        # Evict detections by age, they are in order of when they were added
+        now = time.monotonic()
+        while buffer and buffer[0].added < now - self.maxAge:
+            buffer.popleft()
+        detection = Detection(
+            now,
+            packet["timestamp"],
+            packet["millisecond"],
+            packet["frequency"],
+            packet["tag_id"],
+            packet["tag_data"],
+            packet["tbr_serial_id"],
+        )
+        buffer.append(detection)
+
+        timestamp = detection.timestamp
+        near = [d for d in buffer if abs(d.timestamp - timestamp) <= self.interval]
+        if len(near) != 3 or len({d.tbr_serial_id for d in near}) < 3:
+            return None
+        df = _optimize_tag_df(pd.DataFrame(near).drop(columns="added"))
+        rows, timestamps = find_triplets(
+            df.timestamp.to_numpy(),
+            df.millisecond.to_numpy(),
+            df.tbr_serial_id.to_numpy(),
+        )
+        if not len(rows):
+            return None  # detections more than 2 s apart
+        df = df.iloc[rows[0]].reset_index(drop=True)
+        df.timestamp = timestamps[rows[0]].astype("uint32")
+        return df
 
 
 # *------------------------------------------------------*
@@ -457,6 +795,41 @@ def _get_list_of_triplets_from_db(
 # *------------------------------------------------------*
 
 
+def find_triplets(
+    timestamp: np.ndarray, millisecond: np.ndarray, tbr_serial_id: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Finds triplets of detections of a tag that can be positioned.
+
+    Groups detections into triplets like _adjust_tstamp_drift_of_triplet, and keeps
+    the triplets of exactly three detections by three different TBRs. Groups with
+    duplicate TBR IDs or more than three detections of the same message are skipped.
+
+    Args:
+        timestamp: Array of timestamps of detections, in any order.
+        millisecond: Array of milliseconds of detections.
+        tbr_serial_id: Array of TBR IDs of detections.
+
+    Returns:
+        Tuple (rows, timestamps), where rows is a (N, 3) array of the indices of the
+        detections of each triplet, in order of time, and timestamps is an array of
+        the drift adjusted timestamps of all detections.
+    """
+    order, labels, adjusted = _label_triplets(timestamp, millisecond)
+    timestamps = np.empty_like(adjusted)
+    timestamps[order] = adjusted
+
+    # Labels of sorted detections increase, so detections of a triplet are adjacent
+    inTriplet = np.flatnonzero(labels >= 0)
+    _, first, size = np.unique(
+        labels[inTriplet], return_index=True, return_counts=True
+    )
+    first = first[size == 3]
+    rows = order[inTriplet[first[:, np.newaxis] + np.arange(3)]]
+    tbr = np.asarray(tbr_serial_id)[rows]
+    different = tbr != np.roll(tbr, 1, axis=1)  # every pair of TBRs
+    return (rows[different.all(axis=1)], timestamps)
+
+
 def position_tag(
     cage: CageMeta,
     stations: tdoa.StationData,
@@ -489,8 +862,7 @@ def position_tag(
     """
     # Cage geoemtry used to filter out valid positions (i.e. not outside cage)
     if cage.geometry is None:
-        P_A, P_B, P_C = stations.xyz_A, stations.xyz_B, stations.xyz_C
-        cageCircle = circleFromThreePoints(P_A, P_B, P_C)
+        cageCircle = _get_station_circle(stations)
     else:
         cageCircle = cage.geometry.circle
 
@@ -512,8 +884,55 @@ def position_tag(
     return None
 
 
+def position_tags(
+    cage: CageMeta,
+    stations: tdoa.StationData,
+    tag_depths: np.ndarray,
+    sec: np.ndarray,
+    msec: np.ndarray,
+    cageVerify: bool = True,
+) -> BatchXYZ:
+    """Batch version of position_tag, for N triplets detected by the same stations.
+
+    Runs tdoa.tdoa_hyperbola_algorithm_batch, and resolves and validates candidates
+    array-wide, giving the same positions as position_tag for each triplet.
+
+    Args:
+        cage: Instance of CageMeta, used to filter based on cage center.
+        stations: Instance of StationData of the stations of all triplets.
+        tag_depths: (N,) array of depth of tags.
+        sec: (N, 3) array of second of arrival in station A, B and C.
+        msec: (N, 3) array of millisecond of arrival in station A, B and C.
+        cageVerify: Boolean argument to enable validation based on distance from cage
+            center. By default True.
+
+    Returns:
+        Tuple (x, y, z, valid) of (N,) arrays, where valid is True for the triplets
+        position_tag finds a position for. x and y of other triplets are undefined.
+    """
+    if cage.geometry is None:
+        cageCircle = _get_station_circle(stations)
+    else:
+        cageCircle = cage.geometry.circle
+
+    x, y, count = tdoa.tdoa_hyperbola_algorithm_batch(tag_depths, sec, msec, stations)
+    choice = tdoa.resolve_position_based_on_order_of_arrival_batch(
+        sec, msec, stations, x, y, count
+    )
+    if cageVerify:
+        choice = tdoa.verify_position_within_sea_cage_batch(
+            x, y, count, choice, cageCircle
+        )
+    valid = choice >= 0
+    rows, columns = np.arange(choice.size), np.maximum(choice, 0)
+    z = np.asarray(tag_depths, dtype=float)
+    return (x[rows, columns], y[rows, columns], z, valid)
+
+
 def position_new_msg(
-    msg: msghandler.Message, dbObj: DatabaseManager
+    msg: msghandler.Message,
+    dbObj: DatabaseManager,
+    window: Optional[DetectionWindow] = None,
 ) -> Optional[List[tdoa.CoordXYZ]]:
     """Return list of xyz-position of new msg if triplets of tag detections exists.
 
@@ -525,13 +944,16 @@ def position_new_msg(
         msg: Dictionary following msghandler.Message format, where a string is used for
             each key, with corresponding values being of type Union[int, str, float].
         dbObj: dbmanager.DatabaseManager instance, with open connection to database.
+        window: Optional DetectionWindow the depth tag detections of msg are added to.
+            Triplets are then found in the window instead of the database.
 
     Returns:
         If any positions has been found for tags in message, returns a list of the
         positions. If no positions has been found, returns None.
     """
     # If metadata for positioning doesn't exist, don't run positoning
-    if _cages is None or _depth_tags is None:
+    index = get_metadata_index()  # same metadata for every packet of msg
+    if index is None:
         logger.warning(
             """
             No metadata information of cage/fjord TBR setup,
@@ -541,7 +963,7 @@ def position_new_msg(
         )
         return None
     tag_positions = []
-    logger.info("|--- Looking through message packets for depth tag triplets")
+    logger.debug("|--- Looking through message packets for depth tag triplets")
     for packet in msg.payload:
         cage = None
 
@@ -552,13 +974,13 @@ def position_new_msg(
         # Skip packet if data type is not depth
         tag_id = packet["tag_id"]
         freq = packet["frequency"]
-        depthTag = _is_depth_tag(tag_id, freq)
+        depthTag = _is_depth_tag(tag_id, freq, index)
         if not depthTag:
             continue
 
         # Determine which cage the packet belongs to
         tbr_serial_id = packet["tbr_serial_id"]
-        cage, TBRs = _get_cage_and_TBR_data(tbr_serial_id)
+        cage, TBRs = _get_cage_and_TBR_data(tbr_serial_id, index)
 
         # In case the cage is invalid somehow
         if cage is None:
@@ -566,12 +988,18 @@ def position_new_msg(
             continue
 
         # Check if a triplet of tag detections with this cage exists and load tag_data
-        ref_timestamp = packet["timestamp"]
-        tripletExists, df_tag = _get_tag_df(ref_timestamp, tag_id, freq, TBRs, dbObj)
+        if window is None:
+            ref_timestamp = packet["timestamp"]
+            tripletExists, df_tag = _get_tag_df(
+                ref_timestamp, tag_id, freq, TBRs, dbObj
+            )
+        else:
+            df_tag = window.add(packet, TBRs)
+            tripletExists = df_tag is not None
 
         # if triplet exists, attempt to do positioning
         if tripletExists:
-            logger.info(f"|--- Triplet of tag_id {tag_id} exists")
+            logger.debug(f"|--- Triplet of tag_id {tag_id} exists")
             try:
                 stations = _get_station_data(TBRs, cage.depth, dbObj)
             except ValueError as e:
@@ -584,7 +1012,7 @@ def position_new_msg(
             xyzTag = position_tag(cage, stations, tag_depth, tstamps)
 
             if xyzTag is None:
-                logger.info("|------ Could not find valid position")
+                logger.debug("|------ Could not find valid position")
                 continue  # Reject position if it could not be resolved
             # Convert position to latitude-longitude and pack into dataclass
             latlonTag = tdoa.convert_tag_xyz_to_latlong(xyzTag, stations)
@@ -602,17 +1030,82 @@ def position_new_msg(
             )
             tag_positions.append(position)
             x, y, z = round(position.x, 2), round(position.y, 2), round(position.z, 2)
-            logger.info(f"|------ Found position: (x, y, z) = ({x}, {y}, {z})")
+            logger.debug(f"|------ Found position: (x, y, z) = ({x}, {y}, {z})")
     if tag_positions:
         return tag_positions
 
 
+def position_tag_detections(
+    cage: CageMeta,
+    stations: tdoa.StationData,
+    tag_id: int,
+    frequency: int,
+    df: pd.DataFrame,
+    timeRange: Optional[Tuple[int, int]] = None,
+) -> List[Position]:
+    """Positions all triplets of detections of a tag by the stations at once.
+
+    Finds triplets with find_triplets and positions them with position_tags.
+
+    Args:
+        cage: Instance of CageMeta of the stations.
+        stations: Instance of StationData of the TBRs of detections.
+        tag_id: Integer ID of tag of detections.
+        frequency: Integer frequency of tag of detections.
+        df: A pandas.DataFrame of detections, see _get_tag_detections_from_db.
+        timeRange: Optional [start, end) of timestamps. Only triplets whose first
+            detection is in the range are positioned, the other detections of df only
+            complete triplets at the ends of the range.
+
+    Returns:
+        List of found positions, as instances of dataclass 'Position'.
+    """
+    timestamp = df.timestamp.to_numpy()
+    rows, timestamps = find_triplets(
+        timestamp, df.millisecond.to_numpy(), df.tbr_serial_id.to_numpy()
+    )
+    if timeRange is not None:
+        first = timestamp[rows[:, 0]]
+        rows = rows[(first >= timeRange[0]) & (first < timeRange[1])]
+    if not len(rows):
+        return []
+
+    # Perform TDOA hyperbola based positioning of all triplets at once
+    # | Uses order of arrival to resolve position ambiguity
+    # | In addition, validates candidates whether they are inside/outside cage
+    tag_depths, sec, msec = _get_triplet_arrays(stations, df, rows, timestamps)
+    x, y, z, valid = position_tags(cage, stations, tag_depths, sec, msec)
+    found = np.flatnonzero(valid)
+    if not found.size:
+        return []
+    # Convert positions to latitude-longitude and pack into dataclass
+    lat, lon = tdoa.convert_tag_xyz_to_latlong_batch(x[found], y[found], stations)
+    positions = []
+    for i, lat_i, lon_i in zip(found, lat, lon):
+        first = rows[i, 0]
+        position = Position(
+            timestamp=timestamps[first].item(),
+            tag_id=tag_id,
+            frequency=frequency,
+            cage_name=cage.cageName,
+            millisecond=df.millisecond.iloc[first].item(),
+            x=x[i].item(),
+            y=y[i].item(),
+            z=z[i].item(),
+            latitude=lat_i.item(),
+            longitude=lon_i.item(),
+        )
+        positions.append(position)
+    return positions
+
+
 def position_database(dbObj: DatabaseManager):
     """Searches through complete database and returns all found positions as a list.
 
     Goes through all valid tag_id/frequency combinations for a given project and find
     triplets of them in the database, and uses this as well as station data to position
     all tag messages from all messages. Returns a list of found positions.
+    python -m src.backend.reposition does the same in parallel processes.
 
     args:
         dbObj: dbmanager.DatabaseManager instance, with connection to main database.
@@ -633,49 +1126,15 @@ def position_database(dbObj: DatabaseManager):
             print("\n\n-------------------------------------------")
             print(f"STARTING CAGE {tag.cageName} TBRs {TBRs}")
             print("-------------------------------------------")
-            A_pos = tdoa.LatLong(cage.geometry.lat_A, cage.geometry.lon_A)
-            B_pos = tdoa.LatLong(cage.geometry.lat_B, cage.geometry.lon_B)
-            C_pos = tdoa.LatLong(cage.geometry.lat_C, cage.geometry.lon_C)
-            tbr_pos = [A_pos, B_pos, C_pos]
-            stations = tdoa.StationData(*TBRs, *tbr_pos, cage.depth)
-            # print(stations)
+            stations = _get_cage_stations(cage, TBRs, dbObj)
 
             # do positioning for all database messages
-            triplets = _get_list_of_triplets_from_db(tag_id, frequency, TBRs, dbObj)
-            for df_tag in triplets:
-                # print(df_tag)
-                if len(df_tag.tbr_serial_id.unique()) < 3:
-                    print("Duplicate TBR ID, skipping detection")
-                    continue
-                elif len(df_tag.index) > 3:
-                    print("More than 3 detections of same message, skipping")
-                    continue
-
-                tag_depth, tstamps = _get_tag_depth_and_timestamps(stations, df_tag)
-
-                # Perform TDOA hyperbola based positioning
-                # | Uses order of arrival to resolve position ambiguity
-                # | In addition, validates candidates whether they are inside/outside cage
-                xyzTag = position_tag(cage, stations, tag_depth, tstamps)
-                if xyzTag:
-                    x, y, z = round(xyzTag.x, 2), round(xyzTag.y, 2), round(xyzTag.z, 2)
-                    print(f"\t(x, y, z) = ({x},\t\t{y},\t\t{z})")
-                    # Convert position to latitude-longitude and pack into dataclass
-                    latlonTag = tdoa.convert_tag_xyz_to_latlong(xyzTag, stations)
-                    position = Position(
-                        timestamp=df_tag.timestamp.iloc[0].item(),
-                        tag_id=tag_id,
-                        frequency=frequency,
-                        cage_name=cage.cageName,
-                        millisecond=df_tag.millisecond.iloc[0].item(),
-                        x=xyzTag.x,
-                        y=xyzTag.y,
-                        z=xyzTag.z,
-                        latitude=latlonTag.lat,
-                        longitude=latlonTag.lon,
-                    )
-                    # print(position)
-                    tag_positions.append(position)
+            df_tag = _get_tag_detections_from_db(tag_id, frequency, TBRs, dbObj)
+            positions = position_tag_detections(
+                cage, stations, tag_id, frequency, df_tag
+            )
+            print(f"Found {len(positions)} positions")
+            tag_positions.extend(positions)
     print("XXXXXXXXXXXXXXXXXXX")
     print("XXXXXXXXXXXXXXXXXXX")
     return tag_positions
@@ -0,0 +1,245 @@
+# Python built-in modules and packages
+import calendar
+import logging
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+# Local modules and packages
+from src.backend.dbmanager import dbformat
+
+
+# --- Useful type hints ---
+Timestamp = int
+Columns = Tuple[str, ...]
+
+logger = logging.getLogger("mqtt_client.shards")
+
+# Data tables stored in shards, the other tables stay in the main database
+shardTables = ("tag", "tbr", "gps", "positions")
+# sqlite can attach at most 10 databases to a connection (SQLITE_MAX_ATTACHED)
+maxAttached = 10
+_timeMin, _timeMax = -(2 ** 63), 2 ** 63 - 1
+# Timestamps before 2000 or more than a day ahead are corrupt. Their rows are written
+# to the main database, instead of creating a shard of their own.
+plausibleStart = calendar.timegm((2000, 1, 1, 0, 0, 0))
+plausibleAhead = 24 * 3600
+
+
+class Shard(NamedTuple):
+    """Shard database holding the rows of data tables with start <= timestamp < end."""
+
+    name: str  # file name, in directory of main database
+    start: Timestamp
+    end: Timestamp
+
+    @property
+    def schema(self) -> str:
+        # 'iof_2019-04.db' is attached as 'shard_2019_04'
+        return "shard_" + self.name.rsplit("_", 1)[-1].split(".")[0].replace("-", "_")
+
+
+def _month_index(timestamp: Timestamp) -> int:
+    date = datetime.utcfromtimestamp(timestamp)
+    return date.year * 12 + date.month - 1
+
+
+def _month_start(index: int) -> Timestamp:
+    return calendar.timegm((index // 12, index % 12 + 1, 1, 0, 0, 0))
+
+
+def is_plausible(timestamp: Timestamp) -> bool:
+    """True if timestamp may be the time of a detection, see plausibleStart."""
+    return plausibleStart <= timestamp < time.time() + plausibleAhead
+
+
+class ShardRouter:
+    """Routes rows of the data tables of a main database to time-partitioned shards.
+
+    Every shard is a database next to the main database, holding months months of
+    'tag', 'tbr', 'gps' and 'positions' rows (UTC), such as 'iof_2019-04.db' for
+    'iof.db'. Shards are created when the first row of their time range is written,
+    and registered in the 'shards' catalog table of the main database. Rows written
+    before sharding was enabled stay in the main database.
+
+    A connection reads shards by attaching them with attach(). Temporary views named
+    like the data tables then union the main database and the attached shards, so
+    queries written for a single database read all attached shards. Queries that
+    filter on timestamp only search the shards they overlap (each branch of the view
+    uses the indexes of its shard). Writes go to the shard tables directly, with the
+    queries of insert_query().
+
+    Attributes:
+        mainPath: Path of the main database.
+        months: Number of months of each shard.
+    """
+
+    def __init__(self, mainPath: str, months: int = 1, journalMode: str = "wal"):
+        self.mainPath = mainPath
+        self.months = months
+        self.journalMode = journalMode
+        stem, self._suffix = os.path.splitext(os.path.basename(mainPath))
+        self._stem = stem
+        self._directory = os.path.dirname(mainPath)
+        self._last = Shard("", 0, 0)  # shard of the last routed timestamp
+
+    def shard_of(self, timestamp: Timestamp) -> Shard:
+        """Shard of the time range timestamp is in, the shard may not exist yet."""
+        last = self._last
+        if last.start <= timestamp < last.end:
+            return last
+        index = _month_index(timestamp)
+        index -= index % self.months
+        start = _month_start(index)
+        name = f"{self._stem}_{index // 12:04d}-{index % 12 + 1:02d}{self._suffix}"
+        self._last = Shard(name, start, _month_start(index + self.months))
+        return self._last
+
+    def schema_of(self, timestamp: Timestamp) -> str:
+        """Schema rows of timestamp are written to, 'main' if it is not plausible."""
+        if not is_plausible(timestamp):
+            return "main"
+        return self.shard_of(timestamp).schema
+
+    def path(self, shard: Shard) -> str:
+        return os.path.join(self._directory, shard.name)
+
+    def group_writes(
+        self, timestamps: Sequence[Iterable[Timestamp]]
+    ) -> List[List[int]]:
+        """
+        Groups items, where timestamps[i] are the write timestamps of item i, so that
+        the items of each group write to at most maxAttached shards, and the shards of
+        a group can be attached at once. Returns indexes of the items of every group,
+        in order. An item writing to more shards on its own is in a group of its own.
+        """
+        groups: List[Tuple[Set[str], List[int]]] = []  # (schemas, items)
+        for i, itemTimestamps in enumerate(timestamps):
+            itemSchemas = {self.schema_of(timestamp) for timestamp in itemTimestamps}
+            itemSchemas.discard("main")
+            for schemas, items in groups:
+                if len(schemas | itemSchemas) <= maxAttached:
+                    break
+            else:
+                schemas, items = set(), []
+                groups.append((schemas, items))
+            schemas |= itemSchemas
+            items.append(i)
+        return [items for _, items in groups]
+
+    def shards_between(
+        self,
+        con: sqlite3.Connection,
+        start: Optional[Timestamp] = None,
+        end: Optional[Timestamp] = None,
+    ) -> List[Shard]:
+        """Shards of catalog overlapping time range [start, end], oldest first."""
+        sql_query = dbformat.sql_query_get_shards_between()
+        start = _timeMin if start is None else start
+        end = _timeMax if end is None else end
+        try:
+            rows = con.execute(sql_query, (start, end)).fetchall()
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+            return []  # no shard written yet
+        return [Shard(*row) for row in rows]
+
+    def attach(
+        self,
+        con: sqlite3.Connection,
+        attached: Dict[str, bool],
+        start: Optional[Timestamp] = None,
+        end: Optional[Timestamp] = None,
+        write: Iterable[Timestamp] = (),
+        read: bool = True,
+    ) -> List[Shard]:
+        """
+        Attaches the shards overlapping [start, end] (if read), and the shards of the
+        write timestamps to con, detaching all other shards. attached holds the shards
+        attached to con, {schema: readOnly}, and is updated. Shards of write timestamps
+        are created if missing, write timestamps that are not plausible get no shard.
+        Shards that ended before the current one are attached read-only, unless written
+        to. Must be called outside of a transaction of con. Returns the attached shards.
+
+        Raises:
+            ValueError: More shards overlap than sqlite can attach, see group_writes.
+        """
+        shards: Dict[str, Tuple[Shard, bool]] = {}  # {schema: (shard, readOnly)}
+        if read:
+            current = self.shard_of(int(time.time())).start
+            for shard in self.shards_between(con, start, end):
+                shards[shard.schema] = (shard, shard.end <= current)
+        implausible = 0
+        for timestamp in set(write):
+            if not is_plausible(timestamp):
+                implausible += 1
+                continue
+            shard = self.shard_of(timestamp)
+            shards[shard.schema] = (shard, False)
+        if implausible:
+            logger.warning(
+                f"{implausible} timestamps are not plausible, writing their rows to "
+                f"{self.mainPath} instead of a shard"
+            )
+        if len(shards) > maxAttached:
+            raise ValueError(
+                f"{len(shards)} shards overlap time range, at most {maxAttached} can "
+                "be read at once. Use a shorter range or more shard months."
+            )
+
+        changed = False
+        for schema in list(attached):
+            if schema not in shards or attached[schema] != shards[schema][1]:
+                con.execute(f"DETACH DATABASE {schema}")
+                del attached[schema]
+                changed = True
+        for schema, (shard, readOnly) in sorted(shards.items()):
+            if schema in attached:
+                continue
+            path = Path(self.path(shard)).resolve()
+            if readOnly:
+                uri = f"{path.as_uri()}?mode=ro"
+            else:
+                uri = path.as_uri()
+            con.execute(f"ATTACH DATABASE ? AS {schema}", (uri,))
+            attached[schema] = readOnly
+            changed = True
+            if not readOnly:
+                self._create_shard(con, shard)
+        if changed:
+            self._create_views(con, sorted(attached))
+        return [shard for shard, _ in shards.values()]
+
+    def insert_query(self, table: str, columns: Columns, timestamp: Timestamp) -> str:
+        """Insert query of columns into table of the shard of timestamp."""
+        schema = self.schema_of(timestamp)
+        return dbformat.sql_insert_strings(f"{schema}.{table}", columns)[2]
+
+    def _create_shard(self, con: sqlite3.Connection, shard: Shard) -> None:
+        schema = shard.schema
+        con.execute(f"pragma {schema}.journal_mode = {self.journalMode}")
+        # Same tables and indexes as the main database, without dummy rows
+        con.execute(dbformat.sql_query_gps_create_table_dummy(schema)[0])
+        con.execute(dbformat.sql_query_tag_create_table_dummy(schema)[0])
+        con.execute(dbformat.sql_query_tbr_create_table_dummy(schema)[0])
+        con.execute(dbformat.sql_query_positions_create_table(schema))
+        for sql_query in dbformat.sql_query_create_indexes(schema):
+            con.execute(sql_query)
+        con.execute(dbformat.sql_query_shards_create_table())
+        con.execute(
+            dbformat.sql_query_insert_shard(), (shard.name, shard.start, shard.end)
+        )
+
+    def _create_views(self, con: sqlite3.Connection, schemas: List[str]) -> None:
+        for table in shardTables:
+            con.execute(f"DROP VIEW IF EXISTS temp.{table}")
+            if schemas:
+                union = " UNION ALL ".join(
+                    f"SELECT * FROM {schema}.{table}" for schema in ["main", *schemas]
+                )
+                con.execute(f"CREATE TEMP VIEW {table} AS {union};")
+        logger.debug(f"Reading shards {schemas} of {self.mainPath}")
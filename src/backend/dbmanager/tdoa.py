@@ -501,3 +501,216 @@ def tdoa_hyperbola_algorithm(
     else:
         positions = None
     return positions
+
+
+# *---------------------------------------------------------*
+# | Batch functions, for many triplets of the same stations |
+# *---------------------------------------------------------*
+
+# Arrays of N triplets detected by the stations of one StationData:
+# | sec and msec are (N, 3) arrays of time of arrival in station A, B and C,
+# | depths is an (N,) array of tag depths, and x and y are (N, 2) arrays of the
+# | position candidates of each triplet, where unused candidates are NaN.
+
+
+def _quadratic_roots(
+    a_2: np.ndarray, a_1: np.ndarray, a_0: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Solves a_2*t² + a_1*t + a_0 = 0 in closed form for arrays of coefficients.
+
+    Gives the roots np.roots gives for each polynomial: two roots if a_2 is not zero,
+    one root if only a_2 is zero, and no roots if a_2 and a_1 are zero.
+
+    Returns:
+        Tuple of real part of the first and second root, number of roots, and whether
+        the roots are real. The second root equals the first if there is one root.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        disc = a_1 ** 2 - 4 * a_2 * a_0
+        real = disc >= 0
+        sqrt = np.sqrt(np.where(real, disc, 0))
+        # q has the sign of a_1, so that no roots are lost to cancellation
+        q = -0.5 * (a_1 + np.where(a_1 < 0, -sqrt, sqrt))
+        root_0 = np.where(real, q / a_2, -a_1 / (2 * a_2))
+        root_1 = np.where(real & (q != 0), a_0 / q, root_0)
+        linear = a_2 == 0
+        root_0 = np.where(linear, -a_0 / a_1, root_0)
+        root_1 = np.where(linear, root_0, root_1)
+    count = np.where(linear, np.where(a_1 == 0, 0, 1), 2)
+    return (root_0, root_1, count, real | linear)
+
+
+def tdoa_hyperbola_algorithm_batch(
+    depths: np.ndarray, sec: np.ndarray, msec: np.ndarray, station_data: StationData
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Batch version of tdoa_hyperbola_algorithm, for N triplets at once.
+
+    Uses the same equations, and solves the quadratic equations in closed form for all
+    triplets instead of with np.roots for one triplet at a time.
+
+    Args:
+        depths: (N,) array of depth of signal [m units].
+        sec: (N, 3) array of second of arrival of signal in station A, B and C.
+        msec: (N, 3) array of millisecond of arrival of signal in station A, B and C.
+        station_data: Dataclass 'StationData' of the stations of all triplets.
+
+    Returns:
+        Tuple (x, y, count), where x and y are (N, 2) arrays of position candidates in
+        the coordinate system of station_data, and count is the number of candidates
+        of each triplet. Triplets where tdoa_hyperbola_algorithm returns None have 0.
+    """
+    depths = np.asarray(depths, dtype=float)
+    num = depths.size
+
+    # Coordinates of stations
+    b = station_data.xyz_B.x
+    cx = station_data.xyz_C.x
+    cy = station_data.xyz_C.y
+    c = np.sqrt(cx ** 2 + cy ** 2)
+    z = depths - station_data.depth
+
+    # Sound speed, and R_ab and R_ac of eq. (1) and (2)
+    v = 1500
+    T = np.asarray(sec) + (np.asarray(msec) / 1000)
+    R_ab = v * (T[:, 0] - T[:, 1])
+    R_ac = v * (T[:, 0] - T[:, 2])
+
+    x = np.full((num, 2), np.nan)
+    y = np.full((num, 2), np.nan)
+    count = np.zeros(num, dtype=int)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # R_ab not zero, x from eq. (8) and y from eq. (5), complex x are rejected
+        m = R_ab != 0
+        b_Rab = b / R_ab[m]
+        b_Rab_1 = 1 - (b_Rab ** 2)
+        g = (R_ac[m] * b_Rab - cx) / cy  # eq. (6)
+        h = ((c ** 2) - (R_ac[m] ** 2) + (R_ac[m] * R_ab[m] * b_Rab_1)) / (2 * cy)
+        d = -(b_Rab_1 + (g ** 2))  # eq. (10)
+        e = b * b_Rab_1 - 2 * g * h  # eq. (11)
+        f = ((R_ab[m] ** 2) / 4) * (b_Rab_1 ** 2) - (h ** 2)  # eq. (12)
+        x_0, x_1, roots, real = _quadratic_roots(d, e, f - (z[m] ** 2))
+        x[m, 0], x[m, 1] = x_0, x_1
+        y[m, 0], y[m, 1] = g * x_0 + h, g * x_1 + h
+        count[m] = np.where(real, roots, 0)
+
+        # R_ab and R_ac zero, position at equal distance to all stations
+        m = (R_ab == 0) & (R_ac == 0)
+        x[m, 0] = b / 2
+        y[m, 0] = ((c ** 2) - 2 * cx * (b / 2)) / (2 * cy)
+        count[m] = 1
+
+        # R_ab zero, x = b/2 and y from eq. (4), real part of complex y is kept
+        m = (R_ab == 0) & (R_ac != 0)
+        quad_term = (R_ac[m] ** 2) - (c ** 2) + (2 * cx * (b / 2))
+        a_2 = 4 * ((cy ** 2) - (R_ac[m] ** 2))
+        a_1 = 2 * (2 * cy) * quad_term
+        a_0 = (quad_term ** 2) - (4 * (R_ac[m] ** 2) * (((b / 2) ** 2) + (z[m] ** 2)))
+        y_0, y_1, roots, _ = _quadratic_roots(a_2, a_1, a_0)
+        x[m] = b / 2
+        y[m, 0], y[m, 1] = y_0, y_1
+        count[m] = roots
+
+    x[count < 2, 1] = y[count < 2, 1] = np.nan
+    x[count < 1, 0] = y[count < 1, 0] = np.nan
+    return (x, y, count)
+
+
+def resolve_position_based_on_order_of_arrival_batch(
+    sec: np.ndarray,
+    msec: np.ndarray,
+    station_data: StationData,
+    x: np.ndarray,
+    y: np.ndarray,
+    count: np.ndarray,
+) -> np.ndarray:
+    """Batch version of resolve_position_based_on_order_of_arrival.
+
+    Returns:
+        (N,) array with index of the chosen candidate of each triplet, 0 or 1, or -1
+        if no candidate can be chosen. Triplets with one candidate choose it.
+    """
+    T = np.asarray(sec) + (np.asarray(msec) / 1000)
+    P = np.array(
+        [
+            [station_data.xyz_A.x, station_data.xyz_A.y],
+            [station_data.xyz_B.x, station_data.xyz_B.y],
+            [station_data.xyz_C.x, station_data.xyz_C.y],
+        ]
+    )
+
+    # Station of first, second and third arrival
+    # | Like the mapping of time of arrival to station of the scalar function, the last
+    # | of the stations with equal time of arrival is used for each of them
+    T_sorted = np.sort(T, axis=1)
+    order = np.empty(T.shape, dtype=int)
+    for k in range(3):
+        same = T == T_sorted[:, k, None]
+        order[:, k] = 2 - np.argmax(same[:, ::-1], axis=1)
+    P_order = P[order]  # (N, 3, 2)
+
+    # Distance between position candidates and stations in order of arrival (N, 2, 3)
+    dist = np.sqrt(
+        ((P_order[:, None, :, 0] - x[:, :, None]) ** 2)
+        + ((P_order[:, None, :, 1] - y[:, :, None]) ** 2)
+    )
+    d_P0, d_P1 = dist[:, 0], dist[:, 1]
+
+    # Resolve position ambiguity based on order of receiving the message
+    conditions = [
+        (d_P0[:, 0] < d_P0[:, 1]) & (d_P1[:, 1] < d_P1[:, 0]),
+        (d_P1[:, 0] < d_P1[:, 1]) & (d_P0[:, 1] < d_P0[:, 0]),
+        (d_P0[:, 1] < d_P0[:, 2]) & (d_P1[:, 2] < d_P1[:, 1]),
+        (d_P1[:, 1] < d_P1[:, 2]) & (d_P0[:, 2] < d_P0[:, 1]),
+    ]
+    choice = np.select(conditions, [0, 1, 0, 1], default=-1)
+    choice[count == 1] = 0
+    choice[count == 0] = -1
+    return choice
+
+
+def verify_position_within_sea_cage_batch(
+    x: np.ndarray,
+    y: np.ndarray,
+    count: np.ndarray,
+    choice: np.ndarray,
+    cageCircle: Circle,
+    rThresh: float = 1.1,
+) -> np.ndarray:
+    """Batch version of verify_position_within_sea_cage.
+
+    Args:
+        x, y, count: Position candidates of tdoa_hyperbola_algorithm_batch.
+        choice: Chosen candidates of resolve_position_based_on_order_of_arrival_batch.
+        cageCircle: Instance of dataclass Circle. Has attributes 'radius' and 'center'.
+        rThresh: How much more than the cage radius are we accepting (default=1.1)
+
+    Returns:
+        (N,) array with index of the valid candidate of each triplet, or -1 if none.
+    """
+    rmax = rThresh * cageCircle.radius
+    center = cageCircle.center
+    d_center = np.sqrt(((center.x - x) ** 2) + ((center.y - y) ** 2))
+    d_P0, d_P1 = d_center[:, 0], d_center[:, 1]
+
+    # Solutions must be within cage, else the candidate closest to the center is used
+    d_chosen = d_center[np.arange(choice.size), np.maximum(choice, 0)]
+    closest = np.where(d_P0 < d_P1, 0, 1)
+    unresolved = np.where((d_P0 < rmax) | (d_P1 < rmax), closest, -1)
+    resolved = np.where(d_chosen < rmax, choice, -1)
+    valid = np.where(choice >= 0, resolved, unresolved)
+    valid[count == 0] = -1
+    return valid
+
+
+def convert_tag_xyz_to_latlong_batch(
+    x: np.ndarray, y: np.ndarray, station_data: StationData
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Batch version of convert_tag_xyz_to_latlong, returns arrays of lat and lon."""
+    A = station_data.utm_A
+    easting, northing = _convert_xyz_to_utm(
+        station_data.theta, x, y, A.easting, A.northing
+    )
+    lat, lon = utm.to_latlon(
+        easting, northing, station_data.utm_zone_num, station_data.utm_zone_let
+    )
+    return (np.asarray(lat), np.asarray(lon))
@@ -0,0 +1,404 @@
+# Python built-in modules and packages
+import base64
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# Third-party modules and packages
+import toml
+
+# Local modules and packages
+from src.backend.msghandler import msghandler
+from src.backend.dbmanager import dbmanager
+from src.backend.dbmanager import msgbackup
+from src.backend.dbmanager import positioning as pos
+
+
+# --- Useful type hints ---
+MQTTPayload = bytes
+DecodedMQTTMessage = Dict[str, Any]
+IngestConfig = Dict[str, Any]
+PositioningStats = Dict[str, float]
+
+logger = logging.getLogger("mqtt_client.ingest")
+
+clientConfig = "src/backend/.config/client.toml"
+
+# Defaults used for any value not set in 'src/backend/.config/client.toml'
+_defaults: IngestConfig = {
+    "max_queue_size": 10000,
+    "batch_size": 500,
+    "flush_interval": 0.5,
+}
+_positioningDefaults: IngestConfig = {
+    "max_queue_size": 10000,
+    "stats_interval": 60.0,
+    "window_max_age": 600.0,
+    "window_size": 1000,
+}
+
+# Put in queue to tell the writer thread to flush and stop
+_STOP = object()
+
+
+class ReceivedMessage(NamedTuple):
+    received: float  # time.time() when message was received
+    topic: str
+    payload: MQTTPayload
+
+
+def load_client_config(section: str, defaults: IngestConfig) -> IngestConfig:
+    """
+    Loads a section of 'src/backend/.config/client.toml'.
+    Missing file or missing values fall back to defaults.
+    """
+    config = dict(defaults)
+    try:
+        config.update(toml.load(clientConfig).get(section, {}))
+    except FileNotFoundError:
+        logger.info(f"No {clientConfig} found, using default {section} configuration")
+    except toml.decoder.TomlDecodeError as e:
+        logger.error(f"{e} | {clientConfig} wrongly formatted, using defaults")
+    return config
+
+
+def load_ingest_config() -> IngestConfig:
+    """Loads [ingest] section of 'src/backend/.config/client.toml'."""
+    return load_client_config("ingest", _defaults)
+
+
+def decode_mqtt_payload(
+    payload: MQTTPayload
+) -> Tuple[Optional[DecodedMQTTMessage], Optional[msghandler.Message]]:
+    """
+    Unpacks json of MQTT payload, and unpacks, organizes and converts message data.
+    Returns (decode, message). decode is None if the payload can not be stored in
+    backup, message is None if the message data could not be handled.
+    """
+    # Unpack data from json, and get data content of message
+    try:
+        decode = json.loads(payload)
+        data = base64.b64decode(decode["data"])
+    except json.JSONDecodeError:
+        logger.error(f"Failed json unpacking of MQTT payload: {payload}")
+        return (None, None)
+    except KeyError:
+        logger.error(f"MQTT message formatted wrongly from sender: {decode}")
+        return (None, None)
+    # Used for debugging
+    except Exception:
+        logger.exception(f"Unexpected error occured! {payload}")
+        return (None, None)
+
+    # Unpack, organize, and convert message data
+    try:
+        message = msghandler.handle_message(data)
+    except ValueError as e:
+        logger.error(f"{e} | MQTT Message {payload}")
+        return (decode, None)
+    # Used for debugging
+    except Exception:
+        logger.exception(f"Unexpected error! {payload} | Data {data}")
+        return (decode, None)
+    return (decode, message)
+
+
+class PositioningWorker:
+    """Thread that positions depth tag detections after they are stored in database.
+
+    The ingest writer queues the depth tag packets of each inserted message with
+    submit(), so that the cost of positioning (tag and gps queries, TDOA) is not paid
+    before the next batch of messages can be written. If positioning falls behind
+    until the queue is full, new detections are dropped (and counted) rather than
+    blocking ingest.
+
+    Triplets are found in a positioning.DetectionWindow of the depth tag detections
+    submitted in the last windowMaxAge seconds (at most windowSize per depth tag and
+    set of TBRs), or in the database if windowSize is 0.
+
+    Queue depth, lag (from message received by the MQTT client until it is positioned)
+    and time spent positioning each message are available from stats(), and logged
+    every statsInterval seconds.
+
+    Attributes:
+        statsInterval: Seconds between each log of positioning statistics.
+        window: Window of recent detections, None if triplets are read from database.
+    """
+
+    def __init__(
+        self,
+        maxQueueSize: int = _positioningDefaults["max_queue_size"],
+        statsInterval: float = _positioningDefaults["stats_interval"],
+        windowMaxAge: float = _positioningDefaults["window_max_age"],
+        windowSize: int = _positioningDefaults["window_size"],
+    ) -> None:
+        self.statsInterval = statsInterval
+        self.window = None
+        if windowSize > 0:
+            self.window = pos.DetectionWindow(windowMaxAge, windowSize)
+        self._queue: queue.Queue = queue.Queue(maxsize=maxQueueSize)
+        self._thread = threading.Thread(
+            target=self._run, name="positioning-worker", daemon=True
+        )
+        self._lock = threading.Lock()
+        self._reset_stats()
+
+    @classmethod
+    def from_config(cls) -> "PositioningWorker":
+        config = load_client_config("positioning", _positioningDefaults)
+        return cls(
+            maxQueueSize=config["max_queue_size"],
+            statsInterval=config["stats_interval"],
+            windowMaxAge=config["window_max_age"],
+            windowSize=config["window_size"],
+        )
+
+    def start(self) -> None:
+        self._thread.start()
+        logger.info("Started positioning worker")
+
+    def submit(self, received: float, message: msghandler.Message) -> None:
+        """Queues depth tag packets of an inserted message, if it has any."""
+        packets = pos.get_depth_tag_packets(message.payload)
+        if not packets:
+            return
+        try:
+            item = (received, msghandler.Message(message.header, packets))
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self._dropped += 1
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Positions all queued detections and stops the worker thread."""
+        if not self._thread.is_alive():
+            return
+        logger.info(f"Stopping positioning worker, {self._queue.qsize()} messages left")
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self) -> PositioningStats:
+        """Returns queue depth, and lag and positioning time since last reset."""
+        with self._lock:
+            n = self._processed
+            return {
+                "queue_depth": self._queue.qsize(),
+                "processed": n,
+                "dropped": self._dropped,
+                "lag_mean": self._lagSum / n if n else 0.0,
+                "lag_max": self._lagMax,
+                "time_mean": self._timeSum / n if n else 0.0,
+                "time_max": self._timeMax,
+            }
+
+    def _reset_stats(self) -> None:
+        with self._lock:
+            self._processed = self._dropped = 0
+            self._lagSum = self._lagMax = self._timeSum = self._timeMax = 0.0
+
+    def _log_stats(self) -> None:
+        stats = self.stats()
+        self._reset_stats()
+        if not (stats["processed"] or stats["dropped"] or stats["queue_depth"]):
+            return  # nothing to report
+        logger.info(
+            f"Positioning: queue depth {stats['queue_depth']}, "
+            f"{stats['processed']} positioned, {stats['dropped']} dropped | "
+            f"lag mean {stats['lag_mean']:.3f} s, max {stats['lag_max']:.3f} s | "
+            f"time mean {stats['time_mean']:.3f} s, max {stats['time_max']:.3f} s"
+        )
+        if stats["dropped"]:
+            logger.warning(
+                f"Positioning queue full, dropped {stats['dropped']} messages"
+            )
+
+    def _run(self) -> None:
+        nextReport = time.monotonic() + self.statsInterval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0.0, nextReport - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _STOP:
+                self._log_stats()
+                dbmanager.close_database_managers()
+                return
+            if item is not None:
+                self._position(*item)
+            if time.monotonic() >= nextReport:
+                self._log_stats()
+                nextReport = time.monotonic() + self.statsInterval
+
+    def _position(self, received: float, message: msghandler.Message) -> None:
+        t0 = time.perf_counter()
+        try:
+            dbmanager.position_and_insert_positions_from_msg(message, self.window)
+        # used for debugging
+        except Exception as e:
+            logger.exception(f"{e}")
+            logger.error(f"| header: {message.header}")
+            logger.error(f"| payload: {message.payload}")
+        elapsed = time.perf_counter() - t0
+        lag = time.time() - received
+        with self._lock:
+            self._processed += 1
+            self._timeSum += elapsed
+            self._timeMax = max(self._timeMax, elapsed)
+            self._lagSum += lag
+            self._lagMax = max(self._lagMax, lag)
+
+
+class IngestPipeline:
+    """Bounded queue of received MQTT messages, written to database in batches.
+
+    The MQTT network thread only puts received messages in the queue with submit().
+    A single writer thread decodes queued messages, and writes them to main and backup
+    database with one transaction per batch. A batch is written when it reaches
+    batch_size messages, or when its oldest message has waited flush_interval seconds.
+    When the queue is full, submit() blocks, which in turn stops the MQTT client from
+    reading (and acknowledging) more messages from the broker until there is room.
+
+    Inserted messages with depth tag detections are handed over to a PositioningWorker
+    if positioning is enabled.
+
+    Attributes:
+        positioning: Worker that positions inserted messages, None if not positioning.
+        batchSize: Maximum number of messages written in one transaction.
+        flushInterval: Maximum seconds a message waits in a batch before it is written.
+        onWritten: Optional function called by the writer thread with every batch,
+            once it is stored in main and backup database (used by load tests).
+    """
+
+    def __init__(
+        self,
+        positionTags: bool,
+        maxQueueSize: int = _defaults["max_queue_size"],
+        batchSize: int = _defaults["batch_size"],
+        flushInterval: float = _defaults["flush_interval"],
+        onWritten: Optional[Callable[[List[ReceivedMessage]], None]] = None,
+    ) -> None:
+        self.positioning = PositioningWorker.from_config() if positionTags else None
+        self.batchSize = batchSize
+        self.flushInterval = flushInterval
+        self.onWritten = onWritten
+        self._queue: queue.Queue = queue.Queue(maxsize=maxQueueSize)
+        self._writer = threading.Thread(
+            target=self._run, name="ingest-writer", daemon=True
+        )
+
+    @classmethod
+    def from_config(cls, positionTags: bool) -> "IngestPipeline":
+        config = load_ingest_config()
+        return cls(
+            positionTags,
+            maxQueueSize=config["max_queue_size"],
+            batchSize=config["batch_size"],
+            flushInterval=config["flush_interval"],
+        )
+
+    def start(self) -> None:
+        if self.positioning is not None:
+            self.positioning.start()
+        self._writer.start()
+        logger.info(
+            f"Started ingest writer (batch size {self.batchSize}, "
+            f"flush interval {self.flushInterval} s)"
+        )
+
+    def submit(self, topic: str, payload: MQTTPayload) -> None:
+        """Queues a received message. Blocks while the queue is full."""
+        item = ReceivedMessage(time.time(), topic, payload)
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            logger.warning(
+                f"Ingest queue full ({self._queue.maxsize} messages), "
+                "waiting for database writer to catch up"
+            )
+            self._queue.put(item)
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Writes all queued messages to database and stops the writer thread."""
+        if self._writer.is_alive():
+            logger.info(
+                f"Stopping ingest writer, flushing {self._queue.qsize()} messages"
+            )
+            self._queue.put(_STOP)
+            self._writer.join(timeout)
+        if self.positioning is not None:
+            self.positioning.stop(timeout)
+
+    def _run(self) -> None:
+        batch: List[ReceivedMessage] = []
+        deadline = 0.0
+        while True:
+            timeout = max(0.0, deadline - time.monotonic()) if batch else None
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None  # oldest message in batch has waited long enough
+            if item is _STOP:
+                self._flush(batch)
+                dbmanager.close_database_managers()
+                return
+            if item is not None:
+                if not batch:
+                    deadline = time.monotonic() + self.flushInterval
+                batch.append(item)
+            if len(batch) >= self.batchSize or (
+                batch and time.monotonic() >= deadline
+            ):
+                self._flush(batch)
+                batch = []
+
+    def _flush(self, batch: List[ReceivedMessage]) -> None:
+        if not batch:
+            return
+        try:
+            self._write_batch(batch)
+        # Writer thread must keep running, or the MQTT client would block forever
+        except Exception:
+            logger.exception(f"Unexpected error while writing {len(batch)} messages!")
+
+    def _write_batch(self, batch: List[ReceivedMessage]) -> None:
+        backups: List[Tuple[DecodedMQTTMessage, Optional[int]]] = []
+        messages: List[msghandler.Message] = []
+        receivedTimes: List[float] = []
+        decodedIndex: List[int] = []  # index in backups of each decoded message
+        for item in batch:
+            decode, message = decode_mqtt_payload(item.payload)
+            if decode is None:
+                continue
+            if message is not None:
+                decodedIndex.append(len(backups))
+                messages.append(message)
+                receivedTimes.append(item.received)
+            backups.append((decode, None))
+
+        # Insert message data in database
+        msgIDs: List[Optional[int]] = []
+        if messages:
+            try:
+                msgIDs = dbmanager.insert_messages_in_db(messages)
+            # Raw messages are still stored in backup so that they can be replayed
+            except Exception:
+                logger.exception(f"Failed inserting {len(messages)} messages!")
+                msgIDs = [None] * len(messages)
+        for i, msgID in zip(decodedIndex, msgIDs):
+            backups[i] = (backups[i][0], msgID)
+
+        # Let positioning worker look for positions with the latest messages
+        # | Only look if 'include' set to True in metadata file
+        if self.positioning is not None:
+            for message, msgID, received in zip(messages, msgIDs, receivedTimes):
+                if msgID is not None:
+                    self.positioning.submit(received, message)
+
+        # Insert messages in backup database
+        msgbackup.store_messages_to_backup_db(backups)
+        logger.info(f"Done writing batch of {len(batch)} messages")
+        if self.onWritten is not None:
+            self.onWritten(batch)
@@ -0,0 +1,304 @@
+# Python built-in modules and packages
+import base64
+import itertools
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Sequence
+
+# Local modules and packages
+from src.backend.msghandler import protocol as C
+
+
+# --- Useful type hints ---
+DatafieldName = str
+PacketValues = Dict[DatafieldName, int]
+MQTTPayload = bytes
+OnMessage = Callable[[object, object, "BrokerMessage"], None]
+
+logger = logging.getLogger("mqtt_client.loadgen")
+
+# Codes of every comm protocol, for all frequencies: {comm_protocol: [code, ...]}
+_protocolCodes: Dict[str, List[int]] = {}
+for _code, (_comm, _) in C.codetypes.items():
+    _protocolCodes.setdefault(_comm, []).append(_code)
+
+
+def encode_packet(format: C.PacketFormat, values: PacketValues) -> bytes:
+    """
+    Packs values of datafields to bytes with format defined in msghandler.protocol,
+    the reverse of packet.unpack_packet. Datafields sharing the bytes of a slice
+    without bit information (such as tag_data and tag_data_raw) get the first value.
+    """
+    data = b""
+    for segment in format:
+        bits, sliceBits, placed = 0, segment.numBytes * 8, set()
+        for datafield in segment.datafields:
+            value = values.get(datafield.name, 0)
+            if datafield.MSB is None:
+                if placed:
+                    continue  # same bytes as the previous datafield
+                bits |= value << (sliceBits - datafield.length * 8)
+            elif datafield.MSB:
+                bits |= value << (sliceBits - datafield.bits)
+            else:
+                bits |= value & ((1 << datafield.bits) - 1)
+            placed.add(datafield.name)
+        data += bits.to_bytes(segment.numBytes, C.ENDIAN)
+    return data
+
+
+def tag_format(code: int) -> C.PacketFormat:
+    """Tag packet format of code, with datafields of its comm protocol."""
+    comm, _ = C.codetypes[code]
+    # 'S64K' is spelled 'S64k' in protocol.comm_protocols
+    commFormat = C.comm_protocols.get(comm) or C.comm_protocols[comm.capitalize()]
+    return C.tag[: C.COMM_ID_INDEX] + commFormat + C.tag[C.COMM_ID_INDEX :]
+
+
+class MessageGenerator:
+    """Generates synthetic SLIM/TBR messages, as MQTT payloads sent by the gateway.
+
+    Each message holds a header (with a gps fix for gpsRatio of messages), followed by
+    tag detections of the chosen comm protocols and, for tbrRatio of messages, a TBR
+    sensor packet. Values are random but valid for their datafield widths.
+
+    Attributes:
+        tbrs: Serial ids of the simulated TBRs, messages cycle through them.
+        protocols: Comm protocols of the tag detections.
+        packets: Number of tag detections per message.
+    """
+
+    def __init__(
+        self,
+        tbrs: Sequence[int] = (1, 2, 3),
+        protocols: Sequence[str] = tuple(C.COMM_PROTOCOL_LIST),
+        packets: int = 4,
+        gpsRatio: float = 0.1,
+        tbrRatio: float = 0.1,
+        seed: Optional[int] = None,
+    ) -> None:
+        self.tbrs = list(tbrs)
+        self.protocols = list(protocols)
+        self.packets = packets
+        self.gpsRatio = gpsRatio
+        self.tbrRatio = tbrRatio
+        self._random = random.Random(seed)
+        self._tbrCycle = itertools.cycle(self.tbrs)
+
+    def message(self, timestamp: int, tbr_serial_id: Optional[int] = None) -> bytes:
+        """Returns raw bytes of a message, as sent by a TBR at timestamp."""
+        rand = self._random
+        if tbr_serial_id is None:
+            tbr_serial_id = next(self._tbrCycle)
+        gps = rand.random() < self.gpsRatio
+        header = {
+            "tbr_serial_id": tbr_serial_id,
+            "headerType": C.HEADER_TYPE_GPS if gps else 0,
+            "ref_timestamp": timestamp,
+        }
+        data = encode_packet(C.header, header)
+        if gps:
+            gpsValues = {
+                "SLIM_status": rand.randrange(1 << 14),
+                "longitude": rand.randrange(1 << 26),
+                "pdop": rand.randrange(1, 100),
+                "latitude": rand.randrange(1 << 25),
+                "FIX": rand.randrange(6),
+                "num_sat_tracked": rand.randrange(1 << 5),
+            }
+            data += encode_packet(C.gps, gpsValues)
+        for offset in sorted(rand.randrange(200) for _ in range(self.packets)):
+            code = rand.choice(_protocolCodes[rand.choice(self.protocols)])
+            tagValues = {
+                "timestamp": offset,
+                "commCode": code,
+                "tag_id": rand.randrange(1, 256),
+                "tag_data": rand.randrange(256),
+                "tag_data_2": rand.randrange(256),
+                "snr": rand.randrange(1 << 6),
+                "millisecond": rand.randrange(1000),
+            }
+            data += encode_packet(tag_format(code), tagValues)
+        if rand.random() < self.tbrRatio:
+            tbrValues = {
+                "timestamp": rand.randrange(200),
+                "commCode": C.CODE_TBR,
+                "temperature": rand.randrange(50, 255),
+                "noise_avg": rand.randrange(256),
+                "noise_peak": rand.randrange(256),
+                "frequency": rand.randrange(63, 78),
+            }
+            data += encode_packet(C.tbr, tbrValues)
+        return data
+
+    def payload(self, timestamp: int, tbr_serial_id: Optional[int] = None) -> bytes:
+        """Returns message as json MQTT payload, as published by the gateway."""
+        data = base64.b64encode(self.message(timestamp, tbr_serial_id)).decode()
+        snr = round(self._random.uniform(0, 40), 1)
+        return json.dumps({"data": data, "snr": snr}).encode()
+
+
+class BrokerMessage(NamedTuple):
+    """The attributes of paho MQTTMessage used by mqttclient.on_message."""
+
+    topic: str
+    payload: MQTTPayload
+    qos: int = 1
+
+
+class LocalBroker:
+    """In-process stand-in for an MQTT broker and the network loop of its clients.
+
+    Every subscriber has its own delivery thread, which calls its on_message callback
+    with one message at a time like the paho network thread. Messages wait in an
+    unbounded queue until delivered, like QoS 1 messages kept by the broker while the
+    client is slow. Subscriptions to '$share/<group>/<topic>' are shared, each message
+    is delivered to one subscriber of the group (round robin).
+
+    Only exact topics, '#' and '$share' subscriptions are supported.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._subscribers: List["_Subscriber"] = []
+        self._groups: Dict[str, Iterator["_Subscriber"]] = {}
+
+    def subscribe(self, topic: str, onMessage: OnMessage) -> "_Subscriber":
+        group = None
+        if topic.startswith("$share/"):
+            _, group, topic = topic.split("/", 2)
+        subscriber = _Subscriber(topic, group, onMessage)
+        with self._lock:
+            self._subscribers.append(subscriber)
+            self._groups.clear()  # rebuilt with the new subscriber on next publish
+        return subscriber
+
+    def publish(self, topic: str, payload: MQTTPayload, qos: int = 1) -> None:
+        msg = BrokerMessage(topic, payload, qos)
+        with self._lock:
+            shared = set()
+            for subscriber in self._subscribers:
+                if subscriber.topic not in (topic, "#"):
+                    continue
+                if subscriber.group is None:
+                    subscriber.deliver(msg)
+                elif subscriber.group not in shared:
+                    shared.add(subscriber.group)
+                    next(self._group_cycle(subscriber.group)).deliver(msg)
+
+    def backlog(self) -> int:
+        """Number of published messages not yet delivered to subscribers."""
+        with self._lock:
+            return sum(s.queue.qsize() for s in self._subscribers)
+
+    def stop(self) -> None:
+        """Delivers all waiting messages and stops the delivery threads."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.stop()
+
+    def _group_cycle(self, group: str) -> Iterator["_Subscriber"]:
+        if group not in self._groups:
+            members = [s for s in self._subscribers if s.group == group]
+            self._groups[group] = itertools.cycle(members)
+        return self._groups[group]
+
+
+class _Subscriber:
+    _STOP = object()
+
+    def __init__(self, topic: str, group: Optional[str], onMessage: OnMessage) -> None:
+        self.topic = topic
+        self.group = group
+        self.queue: queue.Queue = queue.Queue()
+        self._onMessage = onMessage
+        self._thread = threading.Thread(
+            target=self._run, name=f"broker-delivery-{topic}", daemon=True
+        )
+        self._thread.start()
+
+    def deliver(self, msg: BrokerMessage) -> None:
+        self.queue.put(msg)
+
+    def stop(self) -> None:
+        self.queue.put(self._STOP)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            msg = self.queue.get()
+            if msg is self._STOP:
+                return
+            try:
+                self._onMessage(None, None, msg)
+            # paho logs and drops exceptions of on_message, keep delivering
+            except Exception:
+                logger.exception(f"Error in on_message of {msg.topic}")
+
+
+def publish_load(
+    broker: LocalBroker,
+    generator: MessageGenerator,
+    topic: str,
+    rate: float,
+    duration: float,
+    burstSize: int = 0,
+    burstEvery: float = 0.0,
+    onPublish: Optional[Callable[[MQTTPayload, int], None]] = None,
+    startTimestamp: int = 1556555369,
+) -> int:
+    """
+    Publishes rate messages per second for duration seconds. If burstSize is set,
+    burstSize extra messages are published at once every burstEvery seconds, like a
+    gateway flushing its backlog of older messages after reconnecting. Each burst is
+    generated before it is due. onPublish(payload, burst) is called right before each
+    message is published, burst is the number of the burst the message belongs to
+    (counting from 1), or 0. Returns number of messages.
+    """
+    tick = 0.01  # publish in small steps to follow rate closely
+    published = steady = bursts = 0
+    # Burst is generated in advance, so that it is published as fast as possible
+    burstTimestamp = startTimestamp - burstSize
+    nextBurstPayloads = [
+        generator.payload(burstTimestamp + i) for i in range(burstSize)
+    ]
+    start = time.monotonic()
+    nextBurst = start + burstEvery if burstSize else float("inf")
+    while True:
+        now = time.monotonic()
+        if now - start >= duration:
+            return published
+        due = int(rate * (now - start)) - steady
+        steady += due
+        for _ in range(due):
+            payload = generator.payload(startTimestamp + steady)
+            _publish(broker, topic, payload, 0, onPublish)
+            published += 1
+        if now >= nextBurst:
+            bursts += 1
+            for payload in nextBurstPayloads:
+                _publish(broker, topic, payload, bursts, onPublish)
+            published += burstSize
+            nextBurst += burstEvery
+            burstTimestamp -= burstSize
+            nextBurstPayloads = [
+                generator.payload(burstTimestamp + i) for i in range(burstSize)
+            ]
+        time.sleep(max(0.0, now + tick - time.monotonic()))
+
+
+def _publish(
+    broker: LocalBroker,
+    topic: str,
+    payload: MQTTPayload,
+    burst: int,
+    onPublish: Optional[Callable[[MQTTPayload, int], None]],
+) -> None:
+    if onPublish is not None:
+        onPublish(payload, burst)
+    broker.publish(topic, payload)
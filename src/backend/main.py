@@ -1,12 +1,15 @@
 # Python built-in modules and packages
 import argparse
 import logging
+import sys
+import threading
 import time
 from subprocess import Popen
-from typing import NoReturn
+from typing import List, NoReturn, Optional
 
 # Local modules and packages
 from src.backend import initbackend
+from src.backend import workers
 
 
 # create logger with 'main'
@@ -33,6 +36,65 @@ def init_logging():
     logger.addHandler(ch)
 
 
+class ClientWorker:
+    """An MQTT client subprocess, restarted whenever it terminates.
+
+    If the client terminated in less than timeLimit seconds after being started, it is
+    not restarted until timeout seconds later, in case of a consistent error.
+    """
+
+    client = "src.backend.mqttclient"
+
+    def __init__(
+        self, args: List[str], name: str, timeout: float = 20, timeLimit: float = 1
+    ) -> None:
+        self.args = args
+        self.name = name
+        self.timeout = timeout
+        self.timeLimit = timeLimit
+        self.process: Optional[Popen] = None
+        self.started = 0.0
+        self.exited: Optional[float] = None
+        self.restartAt = 0.0
+
+    def start(self) -> None:
+        logger.info(f"Starting {self.name}")
+        self.exited = None
+        self.process = Popen([sys.executable, "-m", self.client, *self.args])
+        self.started = time.time()
+        # Clients are polled every second, the thread records when the client exits
+        threading.Thread(target=self._wait, args=(self.process,), daemon=True).start()
+
+    def _wait(self, process: Popen) -> None:
+        process.wait()
+        if process is self.process:
+            self.exited = time.time()
+
+    def poll(self) -> None:
+        """Starts client if it isn't running, and it is not waiting to restart."""
+        if self.process is not None:
+            if self.exited is None:
+                return  # still running
+            self.process = None
+            if self.exited - self.started < self.timeLimit:
+                logger.warning(
+                    f"{self.name} terminated in less than {self.timeLimit} "
+                    f"seconds. Will wait {self.timeout} seconds before retrying"
+                )
+                self.restartAt = self.exited + self.timeout
+            else:
+                self.restartAt = 0.0
+            print(f"{self.name} terminated. Restarting now. Ctrl+C to cancel\n")
+            print("--------------------------------")
+        if time.time() >= self.restartAt:
+            self.start()
+
+    def stop(self) -> None:
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()  # client writes queued messages on SIGTERM
+            self.process.wait()
+
+
 def main() -> NoReturn:
     """
     A function that spawns the main MQTT client as a subprocess.
@@ -83,7 +145,27 @@ def main() -> NoReturn:
             "can't be used together with -reset flag"
         ),
     )
-    # COMBAK(perkjelsvik) - Add argument for logger level
+    parser.add_argument(
+        "--log-mode",
+        dest="logMode",
+        choices=("debug", "production"),
+        help=(
+            "logging mode of mqtt client, overrides mode in "
+            "src/backend/.config/client.toml. production drops per-message logging"
+        ),
+    )
+
+    parser.add_argument(
+        "--workers",
+        "-w",
+        dest="workers",
+        type=int,
+        help=(
+            "number of mqtt client processes to split received messages between, "
+            "overrides [workers] count in src/backend/.config/client.toml. Workers "
+            "share one database write lock, more than one is rarely faster"
+        ),
+    )
 
     args = parser.parse_args()
     # Be careful! This will delete databases in project folder
@@ -105,24 +187,24 @@ def main() -> NoReturn:
             )
         )
         exit()
-    client = "src.backend.mqttclient"
-    # define time now in case of consistent error when running mqtt client
-    timeNow = time.time()
-    # define wait time in seconds in case of consistent error with client
-    timeout, timeLimit = (20, 1)
-    while True:
-        logger.info(f"Starting {client}")
-        p = Popen(f"python -m {client}", shell=True)
-        p.wait()
-        if time.time() - timeNow < timeLimit:
-            logger.warning(
-                f"mqtt client terminated in less than {timeLimit} "
-                f"seconds. Will wait {timeout} seconds before retrying"
-            )
-            time.sleep(timeout)
-        timeNow = time.time()
-        print(f"{client} terminated. Restarting now. Ctrl+C to cancel\n")
-        print("--------------------------------")
+    # Each worker handles its part of the messages, and is supervised on its own
+    count = args.workers or workers.load_workers_config()["count"]
+    clientArgs = ["--log-mode", args.logMode] if args.logMode else []
+    clients = [
+        ClientWorker(
+            clientArgs + ["--worker", str(i), "--workers", str(count)],
+            name=f"{ClientWorker.client} (worker {i})",
+        )
+        for i in range(count)
+    ]
+    try:
+        while True:
+            for client in clients:
+                client.poll()
+            time.sleep(1)
+    finally:
+        for client in clients:
+            client.stop()
 
 
 if __name__ == "__main__":
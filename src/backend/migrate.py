@@ -0,0 +1,177 @@
+# Python built-in modules and packages
+import argparse
+import logging
+import os
+import sys
+from typing import Dict, List, Tuple
+
+# Local modules and packages
+from src.backend.dbmanager import dbformat
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+
+
+# --- Useful type hints ---
+HotQuery = Tuple[str, Tuple]  # (sql query, parameters)
+
+logger = logging.getLogger("mqtt_client.migrate")
+
+# Rows ANALYZE samples per index, and that a table needs before it is analyzed
+analysisRows = 1000
+
+
+def hot_queries() -> Dict[str, HotQuery]:
+    """
+    Queries that run for every message or dashboard refresh, with example parameters.
+    Each one must be answered from an index, or it gets slower as the database grows.
+    """
+    tbrs = (730, 734, 836)
+    timeRange = (1556555369, 1556641769)
+    return {
+        "positioning tag_df": (
+            dbformat.sql_query_tag_df(timeRange[0], len(tbrs), 13, 69, 5),
+            tbrs,
+        ),
+        "positioning all_tag_freq_detections": (
+            dbformat.sql_query_get_db_all_tag_freq_detections(13, 69),
+            tbrs,
+        ),
+        "positioning latest_TBR_pos": (
+            dbformat.sql_query_get_latest_TBR_pos(tbrs[0], 5),
+            (),
+        ),
+        "message_id of tag": (dbformat.sql_query_get_message_id("tag"), ()),
+        "message_id of tbr": (dbformat.sql_query_get_message_id("tbr"), ()),
+        "message_id of gps": (dbformat.sql_query_get_message_id("gps"), ()),
+        "frontend tag": (
+            "SELECT tag_id, date, tag_data FROM tag "
+            "WHERE tag_id IN (12, 13) AND timestamp BETWEEN ? AND ? "
+            "ORDER BY timestamp ASC;",
+            timeRange,
+        ),
+        "frontend tag live": (
+            "SELECT timestamp, tbr_serial_id, tag_id, tag_data FROM tag "
+            "WHERE timestamp > ? AND frequency = 69 AND comm_protocol = 'S256' "
+            "ORDER BY timestamp ASC;",
+            timeRange[:1],
+        ),
+        "frontend tbr": (
+            "SELECT tbr_serial_id, date, temperature FROM tbr "
+            "WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp ASC;",
+            timeRange,
+        ),
+        "frontend positions": (
+            "SELECT tag_id, date, x, y, z FROM positions "
+            "WHERE tag_id IN (12, 13) AND frequency = 69 "
+            "AND timestamp BETWEEN ? AND ? "
+            "ORDER BY timestamp ASC;",
+            timeRange,
+        ),
+    }
+
+
+def query_plan(dbObj: dbmanager.DatabaseManager, query: HotQuery) -> List[str]:
+    """Details of the query plan steps of query (EXPLAIN QUERY PLAN)."""
+    sql_query, args = query
+    rows = dbObj.select_from_db_record(f"EXPLAIN QUERY PLAN {sql_query}", args)
+    return [row[-1] for row in rows]
+
+
+def full_scans(dbObj: dbmanager.DatabaseManager) -> Dict[str, List[str]]:
+    """
+    Returns {name: query plan} of the hot queries that scan a whole table instead of
+    searching or scanning an index. Empty when every hot query uses an index.
+    """
+    scans = {}
+    for name, query in hot_queries().items():
+        plan = query_plan(dbObj, query)
+        if any(step.startswith("SCAN") and "USING" not in step for step in plan):
+            scans[name] = plan
+    return scans
+
+
+def _has_rows(dbObj: dbmanager.DatabaseManager, table: str, rows: int) -> bool:
+    sql_query = f"SELECT count(*) FROM (SELECT 1 FROM {table} LIMIT ?);"
+    return dbObj.select_from_db_record(sql_query, (rows,))[0][0] == rows
+
+
+def migrate_database(path: str, busyTimeout: int = 60000) -> List[str]:
+    """
+    Adds the missing indexes of dbformat.indexes to the main database at path, and
+    refreshes the statistics the query planner uses to choose between them for tables
+    of at least analysisRows rows. Adds the 'station_fixes' table of positioning as
+    well, filled from the 'gps' rows.
+    Returns names of the created indexes.
+
+    Runs while the MQTT client is writing: readers are not blocked in WAL mode, and
+    every index is created in its own statement, waiting up to busyTimeout ms for the
+    write lock. The client waits for each index build up to its own busy_timeout;
+    batches that still fail are logged and kept in the backup database.
+    """
+    dbObj = dbmanager.DatabaseManager(path)
+    try:
+        dbObj.add_del_update_db_record(f"pragma busy_timeout = {int(busyTimeout)}")
+        created = dbinit.create_database_indexes(dbObj)
+        # Sample at most analysisRows per index, so ANALYZE stays short on large tables
+        dbObj.add_del_update_db_record(f"pragma analysis_limit = {analysisRows}")
+        # Smaller tables get no statistics: SQLite would record them as near empty, and
+        # the planner would keep scanning them long after they have grown
+        for table in sorted({table for table, _ in dbformat.indexes.values()}):
+            if _has_rows(dbObj, table, analysisRows):
+                dbObj.add_del_update_db_record(f"ANALYZE {table};")
+        # Latest positions may be in any shard
+        dbmanager.attach_shards(dbObj)
+        if dbinit.create_station_fixes_table(dbObj):
+            logger.info("Created station_fixes from the gps rows")
+    finally:
+        dbObj.close()
+    return created
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Adds missing indexes and the station_fixes table to an existing main "
+            "database, while the MQTT client may be running. Exits with 1 if a hot "
+            "query still scans a whole table."
+        )
+    )
+    parser.add_argument(
+        "database",
+        nargs="?",
+        default=dbinit.dbPath + dbinit.dbDict.get("main_database", ""),
+        help="path of main database, default is main database of db_names.toml",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only check that hot queries use an index, do not create any",
+    )
+    parser.add_argument(
+        "--busy-timeout",
+        dest="busyTimeout",
+        type=int,
+        default=60000,
+        help="ms to wait for the write lock of the MQTT client before each index",
+    )
+    args = parser.parse_args()
+    if not os.path.isfile(args.database):
+        parser.error(f"no database at '{args.database}'")
+    logging.basicConfig(level=logging.INFO)
+
+    if not args.check:
+        created = migrate_database(args.database, args.busyTimeout)
+        print(f"Created {len(created)} indexes in {args.database}: {created}")
+
+    dbObj = dbmanager.DatabaseManager(args.database)
+    scans = full_scans(dbObj)
+    dbObj.close()
+    for name, plan in scans.items():
+        print(f"Full table scan in {name}: {' | '.join(plan)}")
+    if scans:
+        sys.exit(1)
+    print(f"All {len(hot_queries())} hot queries use an index")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,23 @@
 # Python built-in modules and packages
-import base64
+import argparse
 import json
+import queue
+import threading
 import time
 import toml
 import logging
 import logging.handlers
+import signal
 from pathlib import Path
-from typing import List, Mapping, NoReturn, Optional, Tuple, Union
+from typing import Dict, List, Mapping, NoReturn, Optional, Tuple, Union
 
 # Third-party modules and packages
 from paho.mqtt import client as mqtt
 
 # Local modules and packages
 from src.backend import initbackend
-from src.backend.msghandler import msghandler
+from src.backend import ingest
+from src.backend import workers
 from src.backend.dbmanager import dbmanager
 from src.backend.dbmanager import msgbackup
 
@@ -24,15 +28,34 @@ MQTTPayload = bytes
 Base64BytesStr = str
 DecodedMQTTMessage = Mapping[str, Union[Base64BytesStr, float]]
 InternetOfFishMessage = bytes
+LoggingConfig = Dict[str, Union[str, float, int]]
 
 # create logger with 'mqtt_client'
 logger = logging.getLogger("mqtt_client")
 logger.setLevel(logging.DEBUG)
 
+# Logging modes, set in [logging] of client.toml or with --log-mode
+# | debug: every message is logged (and pretty printed), handlers write directly
+# | production: per-message lines dropped, handlers write from a listener thread,
+# |   and repeated warnings/errors from the same line of code are rate limited
+_logModes = ("debug", "production")
+_loggingDefaults: LoggingConfig = {
+    "mode": "debug",
+    "rate_limit_interval": 60.0,
+    "rate_limit_burst": 5,
+}
+_logListener: Optional[logging.handlers.QueueListener] = None
+
 # Load boolean value to decide whether to position tag messages or not
 metaFileName: str = "src/backend/.config/metadata.toml"
 positionTags: bool = toml.load(metaFileName)["3D"]["include"]
 
+# Queue and writer thread that handles and stores received messages
+_pipeline = ingest.IngestPipeline.from_config(positionTags)
+
+# Which part of received messages this client handles, set with --worker/--workers
+_partition = workers.WorkerPartition()
+
 
 class CustomFormatter(logging.Formatter):
     """ Logging Formatter to have custom format for the different logging levels. """
@@ -48,10 +71,62 @@ class CustomFormatter(logging.Formatter):
         return formatter.format(record)
 
 
-def init_logging() -> None:
+class RateLimitFilter(logging.Filter):
+    """Lets through at most burst warnings/errors per interval from each line of code.
+
+    Suppressed records are counted, and the count is added to the first record let
+    through from the same line in the next interval. Records below WARNING pass.
+    """
+
+    def __init__(self, interval: float, burst: int) -> None:
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self._lock = threading.Lock()
+        # (pathname, lineno): [start of interval, records let through, suppressed]
+        self._sites: Dict[Tuple[str, int], List] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno < logging.WARNING or self.interval <= 0:
+            return True
+        site = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._sites.get(site)
+            if window is None or now - window[0] >= self.interval:
+                self._sites[site] = [now, 1, 0]
+                if window is not None and window[2]:
+                    record.msg = (
+                        f"{record.msg} (suppressed {window[2]} similar lines "
+                        f"in the last {self.interval:g} seconds)"
+                    )
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+def load_logging_config(mode: Optional[str] = None) -> LoggingConfig:
+    """Loads [logging] of client.toml. mode (from command line) overrides the file."""
+    config = ingest.load_client_config("logging", _loggingDefaults)
+    if mode is not None:
+        config["mode"] = mode
+    if config["mode"] not in _logModes:
+        logger.error(f"Unknown logging mode {config['mode']}, using debug")
+        config["mode"] = "debug"
+    return config
+
+
+def init_logging(mode: Optional[str] = None) -> None:
+    global _logListener
+    config = load_logging_config(mode)
     # create file handler which logs with level WARNING (by default)
+    # | One log file per worker, so that workers don't rotate each others files
+    logName = "client" if _partition.index == 0 else f"client_{_partition.index}"
     fh = logging.handlers.TimedRotatingFileHandler(
-        "src/backend/logs/client.log", when="midnight"
+        f"src/backend/logs/{logName}.log", when="midnight"
     )
     fh.setLevel(logging.WARNING)
     # create console handler which logs with level DEBUG
@@ -60,9 +135,29 @@ def init_logging() -> None:
     # create formatter and add it to the handlers
     fh.setFormatter(CustomFormatter())
     ch.setFormatter(CustomFormatter())
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    logger.addHandler(ch)
+    if config["mode"] == "debug":
+        # add the handlers to the logger
+        logger.addHandler(fh)
+        logger.addHandler(ch)
+        return
+
+    # Production: threads only put records in a queue, a listener thread writes them
+    logger.setLevel(logging.INFO)
+    qh = logging.handlers.QueueHandler(queue.Queue(-1))
+    qh.addFilter(
+        RateLimitFilter(config["rate_limit_interval"], config["rate_limit_burst"])
+    )
+    logger.addHandler(qh)
+    _logListener = logging.handlers.QueueListener(
+        qh.queue, fh, ch, respect_handler_level=True
+    )
+    _logListener.start()
+
+
+def stop_logging() -> None:
+    """Writes any queued log records (production mode)."""
+    if _logListener is not None:
+        _logListener.stop()
 
 
 def mqtt_client_config() -> MQTTConfig:
@@ -110,6 +205,8 @@ def load_iof_mqtt_topics() -> List[Tuple[str, int]]:
             f"Subscribing to topics: {topDict['top']} with qos: {topDict['qos']}"
         )
         topics = list(zip(topDict["top"], topDict["qos"]))
+        # Only subscribe to the topics of this worker
+        topics = _partition.subscriptions(topics, topDict.get("worker"))
     except toml.decoder.TomlDecodeError as e:
         logger.warning("MQTT topics file not formatted correctly! Exiting program")
         logger.error(e)
@@ -122,6 +219,9 @@ def on_connect(mqttc, obj, flags, rc) -> None:
     logger.info(f"Connection returned result: {mqtt.connack_string(rc)}")
     logger.info("Reading MQTT project topic names from file")
     topics = load_iof_mqtt_topics()
+    if not topics:
+        logger.warning(f"No topics for worker {_partition.index}, subscribing to none")
+        return
     mqttc.subscribe(topics)  # topics defined as list of tuples containing name and qos
     # mqttc.subscribe("#", qos=1)  # subscribe to # topic
     # mqttc.subscribe("$SYS/#")  # Subscribe to broker $SYS messages
@@ -136,78 +236,19 @@ def on_message(mqttc, obj, msg) -> None:
     # Accepts all topics except $SYS topics for message handling
     if msg.topic.startswith("$SYS") is True:
         return
+    # With tbr partitioning, messages of other TBRs are handled by other workers
+    if not _partition.accepts(msg.payload):
+        return
 
-    msgID = None
-    now = time.strftime("%Y-%m-%d %H:%M:%S")
-    logger.info(f"[{now}] Received new message! ")
-    logger.info(f"topic: {msg.topic} | QoS: {msg.qos} ")
-    logger.info(f"| payload: {msg.payload}\n")
-
-    # iof client loop
-    while True:
-        # Unpack data from json, and get data content of message
-        try:
-            decode = json.loads(msg.payload)
-            data = base64.b64decode(decode["data"])
-        except json.JSONDecodeError:
-            logger.error(f"Failed json unpacking of MQTT payload: {msg.payload}")
-            break
-        except KeyError:
-            logger.error(f"MQTT message formatted wrongly from sender: {decode}")
-            break
-        # Used for debugging
-        except Exception:
-            logger.exception(f"Unexpected error occured! {msg.payload}")
-            break
-
-        # Unpack, organize, and convert message data
-        try:
-            message = msghandler.handle_message(data)
-        except ValueError as e:
-            logger.error(f"{e} | MQTT Message {msg.payload}")
-            break
-        # Used for debugging
-        except Exception:
-            logger.exception(f"Unexpected error! {msg.payload} | Data {data}")
-            break
-
-        # Insert message data in database
-        try:
-            msgID = dbmanager.insert_message_in_db(message)
-        except ValueError as e:
-            logger.error(f"{e}")
-            logger.error(f"| MQTT Message {msg.payload}")
-            logger.error(f"| header: {message.header}")
-            logger.error(f"| payload: {message.payload}")
-            break
-        # Used for debugging
-        except Exception as e:
-            logger.exception(f"{e}")
-            logger.error(f"| MQTT Message {msg.payload}")
-            logger.error(f"| header: {message.header}")
-            logger.error(f"| payload: {message.payload}")
-            break
-
-        # See if any positions can be found with the latest message
-        try:
-            # Only look if 'include' set to True in metadata file
-            if positionTags:
-                dbmanager.position_and_insert_positions_from_msg(message)
-        # used for debugging
-        except Exception as e:
-            logger.exception(f"{e}")
-            logger.error(f"| MQTT Message {msg.payload}")
-            logger.error(f"| header: {message.header}")
-            logger.error(f"| payload: {message.payload}")
-        finally:
-            break
-
-    # Insert message in backup database, retuns last rowID
-    msgbackup.store_message_to_backup_db(decode, msgID)
-
-    # Message handling finished
-    now = time.strftime("%Y-%m-%d %H:%M:%S")
-    logger.info(f"[{now}] waiting for new message...\n")
+    if logger.isEnabledFor(logging.DEBUG):
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        logger.debug(f"[{now}] Received new message! ")
+        logger.debug(f"topic: {msg.topic} | QoS: {msg.qos} ")
+        logger.debug(f"| payload: {msg.payload}\n")
+
+    # Message is handled and stored by the ingest writer thread
+    # | Blocks if the ingest queue is full, until the writer has caught up
+    _pipeline.submit(msg.topic, msg.payload)
 
 
 def on_publish(mqttmessage_handlerc, obj, mid) -> None:
@@ -244,12 +285,58 @@ def main() -> NoReturn:
 
     logger.info("Starting MQTT client")
 
-    # Start Client loop
-    mqttc.loop_forever()
+    # Disconnect cleanly on SIGTERM, so that loop_forever() returns
+    signal.signal(signal.SIGTERM, lambda signum, frame: mqttc.disconnect())
+
+    # Start Client loop, and write any queued messages to database when it stops
+    _pipeline.start()
+    checkpointer = None
+    if _partition.index == 0:  # one checkpointer is enough for all workers
+        checkpointer = dbmanager.start_wal_checkpointer([msgbackup.db])
+    try:
+        mqttc.loop_forever()
+    finally:
+        _pipeline.stop()
+        if checkpointer is not None:
+            checkpointer.stop()
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Start iof MQTT client")
+    parser.add_argument(
+        "--log-mode",
+        dest="logMode",
+        choices=_logModes,
+        help="overrides logging mode of 'src/backend/.config/client.toml'",
+    )
+    parser.add_argument(
+        "--worker",
+        dest="worker",
+        type=int,
+        default=0,
+        help="index of this client among the workers started by src.backend.main",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        help="number of client workers, overrides [workers] count of client.toml",
+    )
+    return parser.parse_args()
 
 
 if __name__ == "__main__":
-    init_logging()
+    args = parse_args()
+    _partition = workers.WorkerPartition.from_config(args.worker, args.workers)
+    init_logging(args.logMode)
+    if _partition.count > 1:
+        logger.info(
+            f"Client worker {_partition.index} of {_partition.count} "
+            f"({_partition.partitioning} partitioning)"
+        )
     msgbackup.init_msgbackup()
     dbmanager.init_databasemanager(positionTags)
-    main()
+    try:
+        main()
+    finally:
+        stop_logging()
@@ -0,0 +1,324 @@
+# Python built-in modules and packages
+import datetime as dt
+import logging
+from typing import Dict, List, NamedTuple, Sequence, Tuple
+
+# Third-party modules and packages
+import numpy as np
+
+# Local modules and packages
+from src.backend.msghandler import conversion
+from src.backend.msghandler import packet as pack
+from src.backend.msghandler import protocol as C
+
+
+# --- Useful type hints ---
+DatafieldName = str
+PacketType = str
+# (name, offset of slice, bytes of slice, shift, mask)
+FieldLayout = Tuple[DatafieldName, int, int, int, int]
+Fields = Dict[DatafieldName, np.ndarray]
+
+logger = logging.getLogger("mqtt_client.msghandler.batchdecode")
+
+# Datafields added to every packet when handled, message is index in the batch
+_common = [
+    ("message", np.int64),
+    ("timestamp", np.int64),
+    ("date", "U19"),
+    ("hour", np.int64),
+    ("tbr_serial_id", np.int64),
+]
+# Structured array dtype of each packet type, datafields a comm protocol does not
+# have are NaN (float) or 0 (int)
+dtypes: Dict[PacketType, np.dtype] = {
+    "tag": np.dtype(
+        _common
+        + [
+            ("commCode", np.int64),
+            ("comm_protocol", "U5"),
+            ("frequency", np.int64),
+            ("tag_id", np.int64),
+            ("tag_data", np.float64),
+            ("tag_data_raw", np.int64),
+            ("tag_data_2", np.float64),
+            ("tag_data_2_raw", np.int64),
+            ("snr", np.int64),
+            ("millisecond", np.int64),
+        ]
+    ),
+    "tbr": np.dtype(
+        _common
+        + [
+            ("commCode", np.int64),
+            ("temperature", np.float64),
+            ("temperature_data_raw", np.int64),
+            ("noise_avg", np.int64),
+            ("noise_peak", np.int64),
+            ("frequency", np.int64),
+        ]
+    ),
+    "gps": np.dtype(
+        _common
+        + [
+            ("SLIM_status", np.int64),
+            ("longitude", np.float64),
+            ("latitude", np.float64),
+            ("pdop", np.float64),
+            ("FIX", "U30"),
+            ("num_sat_tracked", np.int64),
+        ]
+    ),
+}
+_fixQuality = np.array(
+    [
+        "no fix",
+        "dead reckoning only",
+        "2D-fix",
+        "3D-fix",
+        "GNSS + dead reckoning combined",
+        "time only fix",
+    ]
+)
+
+
+class DecodedBatch(NamedTuple):
+    """
+    Packets of a batch of messages as structured arrays (dtypes) per packet type, in
+    order of messages and packets. failed holds the index of every message that could
+    not be decoded, none of its packets are in the arrays.
+    """
+
+    tag: np.ndarray
+    tbr: np.ndarray
+    gps: np.ndarray
+    failed: np.ndarray
+
+
+def _field_layout(format: C.PacketFormat) -> List[FieldLayout]:
+    """
+    Offset and length of the slice of every datafield in format, and the shift and
+    mask extracting the datafield from the slice read as an integer.
+    """
+    layout, offset = [], 0
+    for segment in format:
+        sliceBits = segment.numBytes * 8
+        for datafield in segment.datafields:
+            if datafield.MSB is None:
+                shift, bits = sliceBits - datafield.length * 8, datafield.length * 8
+            elif datafield.MSB:
+                shift, bits = sliceBits - datafield.bits, datafield.bits
+            else:
+                shift, bits = 0, datafield.bits
+            layout.append(
+                (datafield.name, offset, segment.numBytes, shift, (1 << bits) - 1)
+            )
+        offset += segment.numBytes
+    return layout
+
+
+def _extract(
+    buffer: np.ndarray, offsets: np.ndarray, layout: List[FieldLayout]
+) -> Fields:
+    """Extracts datafields of layout from packets starting at offsets of buffer."""
+    fields, slices = {}, {}  # type: Fields, Dict[Tuple[int, int], np.ndarray]
+    for name, offset, numBytes, shift, mask in layout:
+        if (offset, numBytes) not in slices:
+            data = np.zeros(len(offsets), np.int64)
+            for i in range(numBytes):
+                data = (data << 8) | buffer[offsets + offset + i]
+            slices[(offset, numBytes)] = data
+        fields.setdefault(name, (slices[(offset, numBytes)] >> shift) & mask)
+    return fields
+
+
+# Decoding tables of every code, compiled once: code -> packet length (0 if the code
+# can not be handled) and code -> group of codes sharing packet format
+_codeLengths = np.zeros(256, np.int64)
+_codeGroups = np.full(256, -1, np.int64)
+_groups: List[Tuple[PacketType, List[FieldLayout]]] = []
+for _code, _decoder in sorted(pack.decoders.items()):
+    _codeLengths[_code] = _decoder.length
+    _group = (_decoder.type, _field_layout(_decoder.format))
+    if _group not in _groups:
+        _groups.append(_group)
+    _codeGroups[_code] = _groups.index(_group)
+_commProtocols = np.array([C.codetypes.get(c, ("", 0))[0] for c in range(256)])
+_frequencies = np.array([C.codetypes.get(c, ("", 0))[1] for c in range(256)])
+_headerLayout = _field_layout(C.header)
+_gpsLayout = _field_layout(C.gps)
+_gpsLength = C.HEADER_GPS_INDEX - C.HEADER_00B_INDEX
+
+
+def packet_datafields(type: PacketType, code: int = C.CODE_TBR) -> Tuple[str, ...]:
+    """
+    Names of datafields a handled packet of type and code has, as in the packet dicts
+    of msghandler.handle_message (except packetType).
+    """
+    names = ["timestamp", "date", "hour", "tbr_serial_id"]
+    if type == "gps":
+        return tuple(names + [name for name, *_ in _gpsLayout])
+    if type == "tag":
+        names += ["comm_protocol", "frequency"]
+    layout = _groups[_codeGroups[code]][1]
+    return tuple(names + [name for name, *_ in layout if name not in names])
+
+
+def _local_dates(timestamps: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    'YYYY-MM-DD HH:MM:SS' strings and hours of UTC timestamps in local timezone, like
+    conversion._convert_timestamp_datetime. UTC offset is looked up once per hour.
+    """
+    hours, inverse = np.unique(timestamps // 3600, return_inverse=True)
+    offsets = np.empty(len(hours), np.int64)
+    for i, hour in enumerate(hours.tolist()):
+        ts = hour * 3600
+        local = dt.datetime.fromtimestamp(ts) - dt.datetime.utcfromtimestamp(ts)
+        offsets[i] = local.total_seconds()
+    local = timestamps + offsets[inverse]
+    dates = np.datetime_as_string(local.astype("datetime64[s]"))
+    return np.char.replace(dates, "T", " "), local // 3600 % 24
+
+
+def _conversion_factors(tag_id: np.ndarray, frequency: np.ndarray) -> np.ndarray:
+    """Metadata conversion factor of every tag_id and frequency, NaN if none."""
+    factors = np.full(len(tag_id), np.nan)
+    known = conversion.get_conversion_table()
+    if not known or not len(tag_id):
+        return factors
+    keys, inverse = np.unique(
+        np.stack([tag_id, frequency], axis=1), axis=0, return_inverse=True
+    )
+    unique = [known.get((t, f), np.nan) for t, f in keys.tolist()]
+    return np.asarray(unique, np.float64)[inverse]
+
+
+def _fill_common(
+    array: np.ndarray,
+    messages: np.ndarray,
+    offsets: np.ndarray,
+    header: Fields,
+) -> None:
+    """Sets message, timestamp, date, hour and tbr_serial_id of packets."""
+    array["message"] = messages
+    array["tbr_serial_id"] = header["tbr_serial_id"][messages]
+    refTimestamp = header["ref_timestamp"][messages]
+    # Timestamp overflow of rare errors in msg transfer order, as in msghandler
+    array["timestamp"] = np.where(
+        offsets > 250, refTimestamp - (255 - offsets), refTimestamp + offsets
+    )
+    array["date"], array["hour"] = _local_dates(array["timestamp"])
+
+
+def decode_messages(messages: Sequence[bytes]) -> DecodedBatch:
+    """
+    Unpacks and converts a batch of raw messages at once, giving the same packet data
+    as msghandler.handle_message per message. Datafields are extracted with shifts
+    and masks over arrays of all packets of the same format, and no packet dict is
+    created. Messages with an unsupported code, or truncated, fail as a whole.
+    """
+    lengths = np.fromiter(map(len, messages), np.int64, len(messages))
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    # Padding so reading the code byte or a truncated packet stays inside the buffer
+    buffer = np.frombuffer(b"".join(messages) + bytes(16), np.uint8).astype(np.int64)
+    valid = lengths >= C.HEADER_00B_INDEX
+    header = _extract(buffer, starts, _headerLayout)
+    hasGps = header["headerType"] == C.HEADER_TYPE_GPS
+    valid &= ~hasGps | (lengths >= C.HEADER_GPS_INDEX)
+
+    # Walk all messages in step, one packet per message and step
+    cursor = starts + C.HEADER_00B_INDEX + hasGps * _gpsLength
+    active = np.flatnonzero(valid)
+    packetOffsets, packetMessages = [], []  # type: List[np.ndarray], List[np.ndarray]
+    while active.size:
+        active = active[cursor[active] < ends[active]]
+        position = cursor[active]
+        length = _codeLengths[buffer[position + C.CODE_INDEX]]
+        bad = (length == 0) | (position + length > ends[active])
+        valid[active[bad]] = False
+        active, position, length = active[~bad], position[~bad], length[~bad]
+        packetOffsets.append(position)
+        packetMessages.append(active)
+        cursor[active] = position + length
+    offsets = np.concatenate(packetOffsets) if packetOffsets else cursor[:0]
+    owners = np.concatenate(packetMessages) if packetMessages else cursor[:0]
+    order = np.argsort(offsets, kind="stable")  # message and packet order
+    offsets, owners = offsets[order], owners[order]
+    keep = valid[owners]
+    offsets, owners = offsets[keep], owners[keep]
+    groups = _codeGroups[buffer[offsets + C.CODE_INDEX]]
+
+    failed = np.flatnonzero(~valid)
+    if failed.size:
+        logger.error(f"Failed handling of {failed.size} of {len(messages)} messages")
+    arrays = {
+        "tag": _decode_packets("tag", buffer, offsets, owners, groups, header),
+        "tbr": _decode_packets("tbr", buffer, offsets, owners, groups, header),
+        "gps": _decode_gps(buffer, starts, np.flatnonzero(valid & hasGps), header),
+    }
+    return DecodedBatch(arrays["tag"], arrays["tbr"], arrays["gps"], failed)
+
+
+def _decode_packets(
+    type: PacketType,
+    buffer: np.ndarray,
+    offsets: np.ndarray,
+    owners: np.ndarray,
+    groups: np.ndarray,
+    header: Fields,
+) -> np.ndarray:
+    """Decodes tag or tbr packets at offsets, one pass per packet format."""
+    typeGroups = [g for g, (groupType, _) in enumerate(_groups) if groupType == type]
+    selected = np.isin(groups, typeGroups)
+    offsets, owners, groups = offsets[selected], owners[selected], groups[selected]
+    array = np.zeros(len(offsets), dtypes[type])
+    for name in array.dtype.names:
+        if array.dtype[name].kind == "f":
+            array[name] = np.nan
+    for group in typeGroups:
+        rows = np.flatnonzero(groups == group)
+        if not rows.size:
+            continue
+        fields = _extract(buffer, offsets[rows], _groups[group][1])
+        for name, values in fields.items():
+            if name in array.dtype.names:
+                array[name][rows] = values
+    # timestamp holds the timestamp offset of packets until here
+    _fill_common(array, owners, array["timestamp"].copy(), header)
+    if type == "tag":
+        code = array["commCode"]
+        array["comm_protocol"] = _commProtocols[code]
+        array["frequency"] = _frequencies[code]
+        factors = _conversion_factors(array["tag_id"], array["frequency"])
+        hasFactor = ~np.isnan(factors)
+        for name in ("tag_data", "tag_data_2"):
+            convert = hasFactor & ~np.isnan(array[name])
+            array[name] = np.where(convert, array[f"{name}_raw"] * factors, array[name])
+    else:
+        array["temperature"] = (array["temperature_data_raw"] - 50) / 10
+    return array
+
+
+def _decode_gps(
+    buffer: np.ndarray, starts: np.ndarray, messages: np.ndarray, header: Fields
+) -> np.ndarray:
+    """Decodes gps of messages, timestamp is the reference timestamp of message."""
+    array = np.zeros(len(messages), dtypes["gps"])
+    fields = _extract(buffer, starts[messages] + C.HEADER_00B_INDEX, _gpsLayout)
+    _fill_common(array, messages, np.zeros(len(messages), np.int64), header)
+    array["SLIM_status"] = fields["SLIM_status"]
+    array["longitude"] = fields["longitude"] / 10e4
+    array["latitude"] = fields["latitude"] / 10e4
+    array["pdop"] = fields["pdop"] / 10
+    array["num_sat_tracked"] = fields["num_sat_tracked"]
+    fix = fields["FIX"]
+    invalid = fix >= len(_fixQuality)
+    if invalid.any():
+        logger.error(f"Invalid GPS fix key in {invalid.sum()} packets - corrupt data?")
+    array["FIX"] = np.where(
+        invalid,
+        np.char.add("Invalid fix value: ", fix.astype(str)),
+        _fixQuality[np.minimum(fix, len(_fixQuality) - 1)],
+    )
+    return array
@@ -1,13 +1,17 @@
 # Python built-in modules and packages
 import logging
 import datetime as dt
-from typing import Union, Dict, Callable, Tuple, Optional
+import os
+import threading
+import time
+from typing import Union, Dict, Callable, List, Tuple, Type, Optional
 
 # Third-party modules and packages
 import toml
 
 # Local modules and packages
 from src.backend.msghandler.protocol import codetypes, CODE_TBR
+from src.backend.msghandler.records import PacketRecord
 
 
 # --- Useful type hints ---
@@ -15,6 +19,7 @@ from src.backend.msghandler.protocol import codetypes, CODE_TBR
 PacketData = Union[str, int, float]
 Packet = Dict[str, PacketData]
 MetaDict = Dict[str, Dict[str, Union[int, float]]]
+ConversionTable = Dict[Tuple[int, int], float]  # (tag_id, frequency): factor
 ConversionFunction = Callable[[str, Packet], PacketData]
 ConversionMapping = Dict[str, ConversionFunction]
 
@@ -22,63 +27,99 @@ ConversionMapping = Dict[str, ConversionFunction]
 logger = logging.getLogger("mqtt_client.msghandler.payload_conversion")
 
 
-def _init_metadata() -> Tuple[bool, MetaDict]:
+_metaFile = "src/backend/.config/metadata_conversion.toml"
+_reloadInterval = 1.0  # seconds between checks of modification time of _metaFile
+_metaTable: ConversionTable = {}
+_metaMtime: Optional[int] = None
+_metaChecked = float("-inf")
+_metaLock = threading.Lock()
+
+
+def _load_conversion_table(path: str) -> ConversionTable:
     """
-    Loads metadata_conversion.toml if it exists.
-    The file holds tag_id and frequency combinations with a known conversion_factor.
+    Loads metadata_conversion.toml, which holds tag_id and frequency combinations with
+    a known conversion_factor. If a combination is listed twice, the first one is used.
     """
-    _metadata, _metaDict = False, {}  # type: bool, MetaDict
-    try:
-        _metaDict = toml.load("src/backend/.config/metadata_conversion.toml")
-    except FileNotFoundError:
-        logger.info("NB! no metadata config file found. Will only store raw data")
-    except Exception:
-        logger.exception("Caught an error while loading metadata conversion")
-    else:
-        _metadata = True
-    return (_metadata, _metaDict)
+    metaDict: MetaDict = toml.load(path)
+    table: ConversionTable = {}
+    for row in metaDict.values():
+        key = (row["tag_id"], row["frequency"])
+        table.setdefault(key, row["conversion_factor"])
+    return table
 
 
-_metaFlag, _metaTable = _init_metadata()  # type: bool, MetaDict
+def get_conversion_table() -> ConversionTable:
+    """
+    Returns conversion factors keyed by (tag_id, frequency). The table is reloaded
+    when the modification time of metadata_conversion.toml changes, so metadata can be
+    updated without restarting the client. The file is checked at most once per
+    _reloadInterval. A table is never modified, a reload replaces it.
+    """
+    global _metaTable, _metaMtime, _metaChecked
+    if time.monotonic() - _metaChecked < _reloadInterval:
+        return _metaTable
+    with _metaLock:
+        now = time.monotonic()
+        if now - _metaChecked < _reloadInterval:
+            return _metaTable  # checked by another thread meanwhile
+        _metaChecked = now
+        try:
+            mtime: Optional[int] = os.stat(_metaFile).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == _metaMtime:
+            return _metaTable
+        if mtime is None:
+            logger.info("NB! no metadata config file found. Will only store raw data")
+            _metaTable, _metaMtime = {}, None
+            return _metaTable
+        try:
+            table = _load_conversion_table(_metaFile)
+        except Exception:
+            # Possibly a partly written file, keep current table and retry next check
+            logger.exception("Caught an error while loading metadata conversion")
+        else:
+            if _metaMtime is not None:
+                logger.info(f"Reloaded {len(table)} conversion factors of {_metaFile}")
+            _metaTable, _metaMtime = table, mtime
+        return _metaTable
+
+
+get_conversion_table()  # loaded at import, as before the first message arrives
 
 
 def _get_metadata_conversion_factor(packet: Packet) -> Optional[float]:
     """
-    Only used if there is metadata for the current project.
-    Checks if there is a match between packet tag_id and frequency and metadata with
-    this tag_id and frequency combination with a known conversion factor.
-    Returns the conversion factor if it exists.
+    Returns the conversion factor of packet tag_id and frequency, if metadata of the
+    current project has one.
     """
-    # Will not work if packet["commCode"] haven't been handled
-    if "frequency" not in packet:
-        # _convert_comm_protocol adds comm_protocol and frequency to packet
-        _ = _convert_comm_protocol_frequency("commCode", packet)
-    tag_id, frequency = packet["tag_id"], packet["frequency"]
-    for row in _metaTable:
-        id, freq = _metaTable[row]["tag_id"], _metaTable[row]["frequency"]
-        if (id, freq) == (tag_id, frequency):
-            return _metaTable[row]["conversion_factor"]
-    return None
+    table = get_conversion_table()
+    if not table:
+        return None
+    frequency = packet.get("frequency")
+    if frequency is None:
+        # commCode not handled yet, _convert_comm_protocol_frequency adds frequency
+        _, frequency = codetypes[packet["commCode"]]
+    return table.get((packet["tag_id"], frequency))
 
 
-def _convert_tag_data(metadata: bool) -> Callable[[str, Packet], Union[int, float]]:
+def _convert_tag_data() -> Callable[[str, Packet], Union[int, float]]:
     """
-    Closure function that checks if there is metadata for the project.
-    | If there is not, the same raw integer data is returned back without checking.
+    Closure function converting tag data with metadata of the project.
+    | If there is no metadata, the same raw integer data is returned back.
     | If there is metadata, the function returns converted data if conversion factor
         exists for this specific tag_id and frequency.
     """
 
     def _local_conversion_func(key: str, packet: Packet) -> Union[int, float]:
+        # Check if conversion factor exists for tag_id & frequency combination
+        conversionFactor = _get_metadata_conversion_factor(packet)
+        if conversionFactor is not None:
+            # If conversion factor exists, adds converted tag_data to packet
+            logger.debug(f"|{'---'*3} Conversion factor exists")
+            tag_data: float = packet[key] * conversionFactor
+            return tag_data
         # Always returns tag_data_raw if there is no metadata
-        if metadata:
-            # Check if conversion factor exists for tag_id & frequency combination
-            conversionFactor = _get_metadata_conversion_factor(packet)
-            if conversionFactor is not None:
-                # If conversion factor exists, adds converted tag_data to packet
-                logger.info(f"|{'---'*3} Conversion factor exists")
-                tag_data: float = packet[key] * conversionFactor
-                return tag_data
         return packet[key]
 
     return _local_conversion_func
@@ -135,8 +176,7 @@ def _convert_comm_protocol_frequency(key: str, packet: Packet) -> int:
     code = packet[key]
     if code == CODE_TBR:
         return code
-    comm_protocol, frequency = codetypes[code]  # type: str, int
-    packet.update({"comm_protocol": comm_protocol, "frequency": frequency})
+    packet["comm_protocol"], packet["frequency"] = codetypes[code]
     return code
 
 
@@ -157,9 +197,9 @@ def _convert_timestamp_datetime(key: str, packet: Packet) -> int:
     """
     date_format = "%Y-%m-%d %H:%M:%S"
     ts = packet[key]  # extract packet UTC timestamp
-    date = dt.datetime.fromtimestamp(ts).strftime(date_format)  # converts to local TZ
-    hour = int(dt.datetime.fromtimestamp(ts).strftime("%H"))  # extract hour too
-    packet.update({"date": date, "hour": hour})  # add date and hour to packet payload
+    date = dt.datetime.fromtimestamp(ts)  # converts to local TZ
+    # add date and hour to packet payload
+    packet["date"], packet["hour"] = date.strftime(date_format), date.hour
     return ts  # return ts to keep original value in packet
 
 
@@ -173,8 +213,8 @@ _conversion_functions: ConversionMapping = {
     "pdop": _convert_pdop,
     "timestamp": _convert_timestamp_datetime,
     "commCode": _convert_comm_protocol_frequency,
-    "tag_data": _convert_tag_data(_metaFlag),
-    "tag_data_2": _convert_tag_data(_metaFlag),  # DS256 case
+    "tag_data": _convert_tag_data(),
+    "tag_data_2": _convert_tag_data(),  # DS256 case
     "temperature": _convert_temperature,
 }
 
@@ -195,8 +235,33 @@ def convert_packet_payload(packet: Packet) -> Packet:
     Returns:
         The same packet with modified datafields
     """
-    logger.info(f"|{'---'*2} Converting packet data")
+    logger.debug(f"|{'---'*2} Converting packet data")
     for datafield in dict(packet):
         if datafield in _conversion_functions:
             packet[datafield] = _conversion_functions[datafield](datafield, packet)
     return packet
+
+
+# Datafields of each record class with a conversion function, in datafield order
+_recordConversions: Dict[Type[PacketRecord], List[Tuple[str, ConversionFunction]]] = {}
+
+
+def convert_record(record: PacketRecord) -> PacketRecord:
+    """
+    Converts datafields of a packet record, like convert_packet_payload does for a
+    packet dict. The datafields with a conversion function are looked up once per
+    record class, instead of copying every packet to iterate over it.
+    """
+    logger.debug(f"|{'---'*2} Converting packet data")
+    conversions = _recordConversions.get(type(record))
+    if conversions is None:
+        conversions = [
+            (datafield, _conversion_functions[datafield])
+            for datafield in record.datafields
+            if datafield in _conversion_functions
+        ]
+        _recordConversions[type(record)] = conversions
+    for datafield, function in conversions:
+        if hasattr(record, datafield):
+            setattr(record, datafield, function(datafield, record))
+    return record
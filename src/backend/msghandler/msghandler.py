@@ -2,20 +2,22 @@
 import logging
 from dataclasses import dataclass
 from pprint import pprint
-from typing import Dict, List, Union
+from typing import List, Union
 
 # Local modules and packages
 from src.backend.msghandler import protocol as C
 from src.backend.msghandler import packet as pack
 from src.backend.msghandler import conversion
+from src.backend.msghandler import records
 
 
 # --- Useful type hints ---
 # Packet data can be int, float and str, but raw packet data is only integers
 DatafieldName = str
 PacketData = Union[int, str, float]
-Packet = Dict[DatafieldName, PacketData]
-Header = Packet
+# Packets are slotted records, with item access like a dict
+Packet = records.PacketRecord
+Header = records.HeaderRecord
 
 # create logger with 'mqtt_client' and with stream level DEBUG; file level WARNING
 logger = logging.getLogger("mqtt_client.msghandler")
@@ -23,7 +25,7 @@ logger = logging.getLogger("mqtt_client.msghandler")
 
 @dataclass
 class Message:
-    header: Packet  # currently not used except for print
+    header: Header  # currently not used except for print
     payload: List[Packet]
 
 
@@ -46,13 +48,13 @@ def handle_message(data: bytes) -> Message:
     err = None
 
     # Extract tbr_serial_id, headertype, and ref_timestamp
-    logger.info("Unpacking message")
-    header: Header = pack.unpack_packet(data[index : C.HEADER_00B_INDEX], C.header)
+    logger.debug("Unpacking message")
+    header: Header = pack.decode_header(data[index : C.HEADER_00B_INDEX])
     index = C.HEADER_00B_INDEX
-    if header["headerType"] == C.HEADER_TYPE_GPS:
-        packet = pack.unpack_packet(data[index : C.HEADER_GPS_INDEX], C.gps)
+    if header.headerType == C.HEADER_TYPE_GPS:
+        packet = pack.decode_gps(data[index : C.HEADER_GPS_INDEX])
         _add_tbr_id_type_and_timestamp(header, packet, type="gps")
-        payload.append(conversion.convert_packet_payload(packet))
+        payload.append(conversion.convert_record(packet))
         index = C.HEADER_GPS_INDEX
 
     # Unpack payload data
@@ -60,7 +62,7 @@ def handle_message(data: bytes) -> Message:
         # Unpacking format based on comm_protocol - length needed for index
         comm = data[index + C.CODE_INDEX]
         try:
-            length, type, format = pack.get_packet_length_type_and_format(comm)
+            length, type, _, decode = pack.get_packet_decoder(comm)
         except ValueError as WrongCommCode:
             logger.error(WrongCommCode)
             logger.warning("Because of variable index, can't unpack rest of message!")
@@ -68,31 +70,34 @@ def handle_message(data: bytes) -> Message:
             break
         else:
             packetNum += 1
-            logger.info(f"|{'---'*1} Unpacking packet {packetNum} ({type})")
-            packet = pack.unpack_packet(data[index : index + length], format)
+            logger.debug(f"|{'---'*1} Unpacking packet {packetNum} ({type})")
+            packet = decode(data[index : index + length])
             _add_tbr_id_type_and_timestamp(header, packet, type)
-            payload.append(conversion.convert_packet_payload(packet))
+            payload.append(conversion.convert_record(packet))
             index += length
     if err is not None:
         raise MessageHandlingError(f"Failed message handling: {err}")
     msg = Message(header, payload)
-    logger.info("Done unpacking message: \n")
-    pprint(msg.header, indent=4, width=1)
-    pprint(msg.payload, indent=4, width=1)
-    print()  # for nicer printing
+    # Pretty printing every message is costly, only done when debugging
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Done unpacking message: \n")
+        pprint(msg.header.asdict(), indent=4, width=1)
+        pprint([packet.asdict() for packet in msg.payload], indent=4, width=1)
+        print()  # for nicer printing
     return msg
 
 
-def _add_tbr_id_type_and_timestamp(header: Packet, packet: Packet, type: str) -> None:
+def _add_tbr_id_type_and_timestamp(header: Header, packet: Packet, type: str) -> None:
     # GPS packet does not send timestamp information
     # | GPS timestamp is therefore set to reference_timestamp of message
     if type == "gps":
-        packet.update({"timestamp": 0})
-    tbr_id = header["tbr_serial_id"]
-    timestamp = header["ref_timestamp"] + packet["timestamp"]
+        packet.timestamp = 0
+    timestamp = header.ref_timestamp + packet.timestamp
 
     # check if timestamp has overflowed due to rare error in tbr msg transfer order
-    timedifference = timestamp - header["ref_timestamp"]
+    timedifference = timestamp - header.ref_timestamp
     if timedifference > 250:
-        timestamp = header["ref_timestamp"] - (255 - timedifference)
-    packet.update({"tbr_serial_id": tbr_id, "timestamp": timestamp, "packetType": type})
+        timestamp = header.ref_timestamp - (255 - timedifference)
+    # packetType is a class attribute of the record, given by type
+    packet.tbr_serial_id = header.tbr_serial_id
+    packet.timestamp = timestamp
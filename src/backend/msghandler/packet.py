@@ -1,8 +1,10 @@
 # Python built-in modules and packages
-from typing import Mapping, Tuple
+from typing import Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple, Type
+from typing import Union
 
 # Local modules and packages
 from src.backend.msghandler import protocol as C
+from src.backend.msghandler import records
 
 
 # --- Useful type hints ---
@@ -10,6 +12,85 @@ from src.backend.msghandler import protocol as C
 DatafieldName = str
 Packet = Mapping[DatafieldName, int]
 PacketTypeLengthFormat = Tuple[int, str, C.PacketFormat]
+Record = Type[records.PacketRecord]
+Decode = Callable[[bytes], Union[Packet, records.PacketRecord]]
+FieldExtraction = Tuple[DatafieldName, int, int]  # (name, shift, mask)
+
+
+class PacketDecoder(NamedTuple):
+    """Precomputed length, type, format and decode function of a packet code."""
+
+    length: int
+    type: str
+    format: C.PacketFormat
+    decode: Decode
+
+
+def get_packet_decoder(code: int) -> PacketDecoder:
+    """
+    Returns the precompiled decoder of code. Codes that are not in the registry are
+    handled by get_packet_length_type_and_format, which raises the same errors.
+    """
+    decoder = decoders.get(code)
+    if decoder is None:
+        length, type, format = get_packet_length_type_and_format(code)
+        record = record_class(type, format)
+        decoder = PacketDecoder(length, type, format, compile_decoder(format, record))
+    return decoder
+
+
+def record_class(type: str, format: C.PacketFormat) -> Record:
+    """Record class of packets of type and format, see msghandler.records."""
+    if type == "gps":
+        return records.GpsRecord
+    if type == "tbr":
+        return records.TbrRecord
+    names = {datafield.name for segment in format for datafield in segment.datafields}
+    # Datafields added when the packet is handled and converted
+    names.update(("tbr_serial_id", "date", "hour", "comm_protocol", "frequency"))
+    return records.record_with_columns(records.TagRecord, names)
+
+
+def compile_decoder(format: C.PacketFormat, record: Optional[Record] = None) -> Decode:
+    """
+    Returns a function unpacking packet data of format, giving the same packet as
+    unpack_packet. Offsets, shifts and masks of every datafield are computed once, so
+    a packet is decoded from a single integer of all its bytes. Data not matching the
+    length of format (truncated message) is unpacked by unpack_packet.
+    With record, the function returns an instance of record instead of a dict.
+    """
+    length = sum(segment.numBytes for segment in format)
+    totalBits, start = length * 8, 0
+    fields: List[FieldExtraction] = []
+    for segment in format:
+        for datafield in segment.datafields:
+            if datafield.MSB is None:
+                # Complete bytes at start of segment
+                end, bits = start + datafield.length * 8, datafield.length * 8
+            elif datafield.MSB:
+                end, bits = start + datafield.bits, datafield.bits
+            else:
+                # LSB, the last bits of the segment
+                end, bits = start + segment.numBytes * 8, datafield.bits
+            fields.append((datafield.name, totalBits - end, (1 << bits) - 1))
+        start += segment.numBytes * 8
+
+    def decode(packetData: bytes) -> Packet:
+        if len(packetData) != length:
+            return unpack_packet(packetData, format)
+        data = int.from_bytes(packetData, C.ENDIAN)
+        return {name: data >> shift & mask for name, shift, mask in fields}
+
+    def decode_record(packetData: bytes) -> records.PacketRecord:
+        if len(packetData) != length:
+            return record.from_packet(unpack_packet(packetData, format))
+        data = int.from_bytes(packetData, C.ENDIAN)
+        packet = record()
+        for name, shift, mask in fields:
+            setattr(packet, name, data >> shift & mask)
+        return packet
+
+    return decode if record is None else decode_record
 
 
 def get_packet_length_type_and_format(code: int) -> PacketTypeLengthFormat:
@@ -115,3 +196,23 @@ def mask(data, lenData, bits, MSB):
         mask = (1 << bits) - 1
         maskedData = mask & data
     return maskedData
+
+
+def _compile_decoders() -> Dict[int, PacketDecoder]:
+    """Compiles decoders of every supported code, done once at import."""
+    registry = {}
+    for code in range(256):
+        try:
+            length, type, format = get_packet_length_type_and_format(code)
+        except (ValueError, KeyError):
+            # Unsupported codes, and codes of comm protocols missing a format, keep
+            # raising their error from get_packet_decoder
+            continue
+        decode = compile_decoder(format, record_class(type, format))
+        registry[code] = PacketDecoder(length, type, format, decode)
+    return registry
+
+
+decoders: Dict[int, PacketDecoder] = _compile_decoders()
+decode_header: Decode = compile_decoder(C.header, records.HeaderRecord)
+decode_gps: Decode = compile_decoder(C.gps, records.GpsRecord)
@@ -0,0 +1,216 @@
+# Python built-in modules and packages
+from operator import attrgetter
+from typing import Any, Callable, ClassVar, Collection, Dict, Mapping, Tuple, Type
+from typing import Union
+
+
+# --- Useful type hints ---
+DatafieldName = str
+PacketData = Union[int, str, float]
+Packet = Dict[DatafieldName, PacketData]
+
+
+class PacketRecord:
+    """Slotted record of one packet, replacing the packet dict of a message payload.
+
+    A datafield is an attribute, and only exists once set, like a key of the packet
+    dict. Item access (packet["tag_id"], "tag_data" in packet, packet.get, update)
+    works as for the dict, so conversion functions and positioning are unchanged.
+    Table, columns and insert statement of the packet type are class attributes,
+    computed once when the class is defined.
+
+    Attributes:
+        packetType: 'tag', 'tbr', 'gps' or 'header'.
+        datafields: Every datafield the packet type can have (slots of the class).
+        table: Database table of the packet type, empty for header.
+        columns: Table columns after message_id, datafields with the same name.
+            Only the columns of datafields every packet of the class has, see
+            record_with_columns.
+        sql_insert: Insert statement with message_id and columns as parameters.
+    """
+
+    __slots__: Tuple[str, ...] = ()
+    packetType: ClassVar[str] = ""
+    datafields: ClassVar[Tuple[str, ...]] = ()
+    table: ClassVar[str] = ""
+    columns: ClassVar[Tuple[str, ...]] = ()
+    sql_insert: ClassVar[str] = ""
+    _row: ClassVar[Callable[["PacketRecord"], Tuple[PacketData, ...]]]
+
+    def __init_subclass__(cls, **kwargs: Any) -> None:
+        super().__init_subclass__(**kwargs)  # type: ignore
+        cls.datafields = cls.datafields + cls.__dict__.get("__slots__", ())
+        if cls.table:
+            names = ", ".join(("message_id",) + cls.columns)
+            values = ", ".join("?" * (len(cls.columns) + 1))
+            cls.sql_insert = f"INSERT INTO {cls.table} ({names}) VALUES ({values});"
+            cls._row = attrgetter(*cls.columns)
+
+    @classmethod
+    def from_packet(cls, packet: Mapping[DatafieldName, PacketData]) -> "PacketRecord":
+        """Record with the datafields of a packet dict."""
+        record = cls()
+        record.update(packet)
+        return record
+
+    def values(self, msgID: int) -> Tuple[PacketData, ...]:
+        """Row of the packet in its table, None for datafields it does not have."""
+        try:
+            return (msgID,) + self._row(self)
+        except AttributeError:
+            # Truncated packet, without some datafields of its format
+            return (msgID,) + tuple(getattr(self, c, None) for c in self.columns)
+
+    def asdict(self) -> Packet:
+        """Datafields of the packet as a dict, in the order of the packet dict."""
+        packet = {n: getattr(self, n) for n in self.datafields if hasattr(self, n)}
+        if self.packetType != "header":
+            packet["packetType"] = self.packetType
+        return packet
+
+    def __getitem__(self, key: DatafieldName) -> PacketData:
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key: DatafieldName, value: PacketData) -> None:
+        setattr(self, key, value)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and hasattr(self, key)
+
+    def get(self, key: DatafieldName, default: Any = None) -> Any:
+        return getattr(self, key, default)
+
+    def update(self, datafields: Mapping[DatafieldName, PacketData]) -> None:
+        for key, value in datafields.items():
+            setattr(self, key, value)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, PacketRecord):
+            return type(self) is type(other) and self.asdict() == other.asdict()
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.asdict()})"
+
+
+class HeaderRecord(PacketRecord):
+    __slots__ = ("tbr_serial_id", "headerType", "ref_timestamp")
+    packetType = "header"
+
+
+class GpsRecord(PacketRecord):
+    # Slots in order of the packet dict, timestamp and tbr_serial_id added last
+    __slots__ = (
+        "SLIM_status",
+        "longitude",
+        "pdop",
+        "latitude",
+        "FIX",
+        "num_sat_tracked",
+        "timestamp",
+        "tbr_serial_id",
+        "date",
+        "hour",
+    )
+    packetType = "gps"
+    table = "gps"
+    columns = (
+        "timestamp",
+        "date",
+        "hour",
+        "tbr_serial_id",
+        "SLIM_status",
+        "longitude",
+        "latitude",
+        "pdop",
+        "FIX",
+        "num_sat_tracked",
+    )
+
+
+class TbrRecord(PacketRecord):
+    __slots__ = (
+        "timestamp",
+        "commCode",
+        "temperature",
+        "temperature_data_raw",
+        "noise_avg",
+        "noise_peak",
+        "frequency",
+        "tbr_serial_id",
+        "date",
+        "hour",
+    )
+    packetType = "tbr"
+    table = "tbr"
+    columns = (
+        "timestamp",
+        "date",
+        "hour",
+        "tbr_serial_id",
+        "temperature",
+        "temperature_data_raw",
+        "noise_avg",
+        "noise_peak",
+        "frequency",
+    )
+
+
+class TagRecord(PacketRecord):
+    __slots__ = (
+        "timestamp",
+        "commCode",
+        "tag_id",
+        "tag_data",
+        "tag_data_raw",
+        "tag_data_2",  # DS256, tag table has no column for it
+        "tag_data_2_raw",
+        "snr",
+        "millisecond",
+        "tbr_serial_id",
+        "comm_protocol",
+        "frequency",
+        "date",
+        "hour",
+    )
+    packetType = "tag"
+    table = "tag"
+    columns = (
+        "timestamp",
+        "date",
+        "hour",
+        "tbr_serial_id",
+        "comm_protocol",
+        "frequency",
+        "tag_id",
+        "tag_data",
+        "tag_data_raw",
+        "snr",
+        "millisecond",
+    )
+
+
+# Subclasses made by record_with_columns, by record class and columns
+_subclasses: Dict[Tuple[Type[PacketRecord], Tuple[str, ...]], Type[PacketRecord]] = {}
+
+
+def record_with_columns(
+    record: Type[PacketRecord], datafields: Collection[DatafieldName]
+) -> Type[PacketRecord]:
+    """
+    Returns the subclass of record whose columns are the ones of datafields, for
+    packets of a comm protocol without some datafields of their type. Their rows have
+    no NULL columns, and are read from the record by one attrgetter call.
+    Returns record itself if it has no other columns.
+    """
+    columns = tuple(column for column in record.columns if column in datafields)
+    if columns == record.columns:
+        return record
+    key = (record, columns)
+    if key not in _subclasses:
+        namespace = {"__slots__": (), "columns": columns}
+        _subclasses[key] = type(record.__name__, (record,), namespace)
+    return _subclasses[key]
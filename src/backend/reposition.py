@@ -0,0 +1,289 @@
+# Python built-in modules and packages
+import argparse
+import collections
+import datetime as dt
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+# Local modules and packages
+from src.backend.dbmanager import dbformat
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+from src.backend.dbmanager import positioning as pos
+from src.backend.dbmanager import shards
+
+
+# --- Useful type hints ---
+Timestamp = int
+WatermarkKey = Tuple[int, int, int, int, int]  # (tag_id, frequency, TBR A, B, C)
+Watermark = Dict[str, int]  # {source database file name: largest positioned rowid}
+
+logger = logging.getLogger("mqtt_client.reposition")
+
+# Detections this many seconds around a work unit are read to complete its triplets
+tripletMargin = 10
+maxTimestamp = 2 ** 32 - 1
+
+
+class WorkUnit(NamedTuple):
+    """Detections of a depth tag by a set of TBRs of its cage in [start, end)."""
+
+    tag: pos.TagsMeta
+    cage: pos.CageMeta
+    TBRs: Tuple[int, int, int]
+    start: Timestamp
+    end: Timestamp
+    detections: int
+
+    @property
+    def key(self) -> WatermarkKey:
+        return (self.tag.tag_id, self.tag.frequency, *self.TBRs)
+
+
+def _source_databases(path: str) -> List[str]:
+    """Main database at path and its shards, oldest first."""
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        router = shards.ShardRouter(path)
+        return [path] + [router.path(s) for s in router.shards_between(con)]
+    finally:
+        con.close()
+
+
+def _create_watermark_table(dbObj: dbmanager.DatabaseManager) -> None:
+    dbObj.add_del_update_db_record(
+        dbformat.sql_query_positioning_watermark_create_table()
+    )
+    sql_query = "PRAGMA main.table_info(positioning_watermark);"
+    if "source" not in {column[1] for column in dbObj.select_from_db_record(sql_query)}:
+        # Watermarks of message_ids, which do not grow in order of insertion
+        logger.warning("Replacing message_id watermarks, positioning all detections")
+        dbObj.add_del_update_db_record("DROP TABLE main.positioning_watermark;")
+        dbObj.add_del_update_db_record(
+            dbformat.sql_query_positioning_watermark_create_table()
+        )
+
+
+def plan_work_units(
+    dbObj: dbmanager.DatabaseManager,
+    start: Timestamp,
+    end: Timestamp,
+    chunkSize: int,
+    newOnly: bool,
+) -> Tuple[List[WorkUnit], Dict[WatermarkKey, Watermark]]:
+    """
+    Splits detections of depth tags with timestamp in [start, end], in the main
+    database of dbObj and its shards, in work units of chunkSize seconds, one per
+    depth tag, set of TBRs and chunk. With newOnly, only chunks with detections after
+    the watermark of their depth tag, TBRs and source database are kept. Returns the
+    work units and the largest rowid of detections of each key in each source.
+    """
+    units: List[WorkUnit] = []
+    lastRowIDs: Dict[WatermarkKey, Watermark] = {}
+    sources = {
+        os.path.basename(source): sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+        for source in _source_databases(dbObj.name)
+    }
+    try:
+        for tag in pos._depth_tags:
+            cage = pos._cages[tag.cageName]
+            query = dbformat.sql_query_get_tag_detection_chunks(
+                tag.tag_id, tag.frequency
+            )
+            for TBRs in cage.tbr:
+                key = (tag.tag_id, tag.frequency, *TBRs)
+                watermark: Watermark = {}
+                if newOnly:
+                    sql_query = dbformat.sql_query_get_positioning_watermark()
+                    watermark = dict(dbObj.select_from_db_record(sql_query, key))
+                # Chunks of a time range may have detections in several sources
+                chunks: Dict[Timestamp, int] = collections.Counter()
+                lastRowIDs[key] = {}
+                for name, con in sources.items():
+                    lastRowID = watermark.get(name, 0)
+                    params = (chunkSize, *TBRs, lastRowID, start, end)
+                    for chunk, count, rowID in con.execute(query, params):
+                        chunks[chunk] += count
+                        lastRowID = max(lastRowID, rowID)
+                    lastRowIDs[key][name] = lastRowID
+                for chunk in sorted(chunks):
+                    unitStart = max(chunk, start)
+                    unitEnd = min(chunk + chunkSize, end + 1)
+                    units.append(
+                        WorkUnit(
+                            tag, cage, tuple(TBRs), unitStart, unitEnd, chunks[chunk]
+                        )
+                    )
+    finally:
+        for con in sources.values():
+            con.close()
+    return (units, lastRowIDs)
+
+
+def position_work_unit(
+    path: str, unit: WorkUnit
+) -> Tuple[WorkUnit, List[pos.Position]]:
+    """
+    Positions the triplets of a work unit, reading the detections tripletMargin seconds
+    around it to complete triplets at its ends. Returns the unit and its positions.
+    Runs in worker processes of the process pool.
+    """
+    dbObj = dbmanager.get_database_manager(path)
+    timeRange = (unit.start - tripletMargin, unit.end + tripletMargin)
+    dbmanager.attach_shards(dbObj, *timeRange)
+    tag_id, frequency, TBRs = unit.tag.tag_id, unit.tag.frequency, list(unit.TBRs)
+    stations = pos._get_cage_stations(unit.cage, TBRs, dbObj)
+    df = pos._get_tag_detections_from_db(tag_id, frequency, TBRs, dbObj, timeRange)
+    positions = pos.position_tag_detections(
+        unit.cage, stations, tag_id, frequency, df, (unit.start, unit.end)
+    )
+    return (unit, positions)
+
+
+def reposition_database(
+    path: str,
+    start: Timestamp = 0,
+    end: Timestamp = maxTimestamp,
+    chunkDays: float = 1,
+    processes: Optional[int] = None,
+    newOnly: bool = True,
+    saveWatermark: bool = True,
+) -> Dict[str, int]:
+    """
+    Positions depth tag detections of main database at path with timestamp in
+    [start, end], in a process pool with one work unit per depth tag, set of TBRs and
+    chunk of chunkDays days. Positions are inserted as units complete, skipping the
+    ones already in the database, so an interrupted run can simply be run again.
+
+    With saveWatermark, the largest positioned rowid of each depth tag, set of TBRs
+    and source database (main database or shard) is saved in the positioning_watermark
+    table once all their units are done. With newOnly, only chunks with detections
+    after the watermark are positioned.
+    Returns number of work units, detections, positions found and inserted.
+    """
+    t0 = time.perf_counter()
+    dbObj = dbmanager.DatabaseManager(path)
+    _create_watermark_table(dbObj)
+    chunkSize = max(1, int(chunkDays * 24 * 3600))
+    units, lastRowIDs = plan_work_units(dbObj, start, end, chunkSize, newOnly)
+    total = sum(unit.detections for unit in units)
+    logger.info(f"Positioning {total} detections in {len(units)} work units")
+
+    # Watermark of a key is saved when the last of its units is done
+    remaining = collections.Counter(unit.key for unit in units)
+    counts = dict.fromkeys(("units", "detections", "positions", "inserted"), 0)
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(position_work_unit, path, unit) for unit in units]
+        for future in as_completed(futures):
+            unit, positions = future.result()
+            if positions:
+                counts["inserted"] += dbmanager.bulk_insert_positions(dbObj, positions)
+            counts["units"] += 1
+            counts["detections"] += unit.detections
+            counts["positions"] += len(positions)
+            remaining[unit.key] -= 1
+            if saveWatermark and not remaining[unit.key]:
+                watermarks = [
+                    (*unit.key, source, lastRowID)
+                    for source, lastRowID in lastRowIDs[unit.key].items()
+                ]
+                with dbObj.transaction():
+                    dbObj.executemany_db_records(
+                        dbformat.sql_query_positioning_watermark_upsert(), watermarks
+                    )
+            elapsed = time.perf_counter() - t0
+            logger.info(
+                f"{counts['units']}/{len(units)} work units "
+                f"({100 * counts['detections'] / max(total, 1):.1f} % of detections), "
+                f"{counts['detections'] / elapsed:.0f} detections/s, "
+                f"{counts['inserted']} new positions"
+            )
+    dbObj.close()
+    return counts
+
+
+def _timestamp(value: str) -> Timestamp:
+    # Unix timestamp, or date and time in local time like the dashboards
+    if value.isdigit():
+        return int(value)
+    try:
+        return int(dt.datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"'{value}' is not a timestamp or date")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Positions depth tag detections of a main database in parallel processes, "
+            "and inserts the new positions. By default only detections added since "
+            "the last run are positioned. Run from repo root."
+        )
+    )
+    parser.add_argument(
+        "database",
+        nargs="?",
+        default=dbinit.dbPath + dbinit.dbDict.get("main_database", ""),
+        help="path of main database, default is main database of db_names.toml",
+    )
+    parser.add_argument(
+        "--start",
+        type=_timestamp,
+        help="first timestamp or local date ('2019-04-29 16:00'), watermark is kept",
+    )
+    parser.add_argument(
+        "--end",
+        type=_timestamp,
+        help="last timestamp or local date, watermark is kept",
+    )
+    parser.add_argument(
+        "--all",
+        action="store_true",
+        help="position all detections, not only the ones since the last run",
+    )
+    parser.add_argument(
+        "--chunk-days",
+        dest="chunkDays",
+        type=float,
+        default=1,
+        help="days of detections per work unit",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        help="positioning processes, default is number of cores",
+    )
+    args = parser.parse_args()
+    if not os.path.isfile(args.database):
+        parser.error(f"no database at '{args.database}'")
+    logging.basicConfig(level=logging.INFO, format="%(name)s - %(message)s")
+    # Persistent connections of worker processes are logged at info level
+    logging.getLogger("mqtt_client.dbmanager").setLevel(logging.WARNING)
+
+    pos.init_metadata()
+    if pos._cages is None or pos._depth_tags is None:
+        parser.error("no positioning metadata, see metadata_positioning.toml")
+    # A time range repositions all its detections, and leaves the watermark as it is
+    timeRange = args.start is not None or args.end is not None
+    counts = reposition_database(
+        args.database,
+        0 if args.start is None else args.start,
+        maxTimestamp if args.end is None else args.end,
+        args.chunkDays,
+        args.processes,
+        newOnly=not (args.all or timeRange),
+        saveWatermark=not timeRange,
+    )
+    print(
+        f"Positioned {counts['detections']} detections in {counts['units']} work "
+        f"units: {counts['positions']} positions, {counts['inserted']} new"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+# Python built-in modules and packages
+import argparse
+import collections
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable, Deque, Iterator, List, Optional, Tuple, Union
+
+# Third-party modules and packages
+import toml
+
+# Local modules and packages
+from src.backend.dbmanager import dbformat
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+from src.backend.dbmanager import msgbackup
+from src.backend.dbmanager import positioning as pos
+from src.backend.msghandler import batchdecode
+from src.backend.msghandler import msghandler
+
+
+# --- Useful type hints ---
+BackupRow = msgbackup.BackupRow  # (rowid, message_id, raw data, snr)
+DecodedRow = Tuple[Optional[int], Optional[msghandler.Message]]
+DecodedChunk = Tuple[List[Optional[int]], batchdecode.DecodedBatch]  # message_ids
+
+logger = logging.getLogger("mqtt_client.reprocess")
+
+
+def decode_backup_rows(rows: List[BackupRow]) -> List[DecodedRow]:
+    """
+    Unpacks and converts raw messages of backup rows, as the MQTT client does.
+    Returns (message_id, message) per row, message is None if handling failed.
+    Runs in worker processes of the process pool.
+    """
+    decoded: List[DecodedRow] = []
+    for rowID, msgID, data, _ in rows:
+        try:
+            message = msghandler.handle_message(data)
+        except Exception as e:
+            logger.error(f"{e} | backup row {rowID} could not be handled")
+            message = None
+        decoded.append((msgID, message))
+    return decoded
+
+
+def decode_backup_chunk(rows: List[BackupRow]) -> DecodedChunk:
+    """
+    Decodes raw messages of backup rows at once with msghandler.batchdecode.
+    Returns message_id of every row and the decoded batch.
+    Runs in worker processes of the process pool.
+    """
+    messages = [data for _, _, data, _ in rows]
+    return [msgID for _, msgID, _, _ in rows], batchdecode.decode_messages(messages)
+
+
+def _decoded_chunks(
+    backupPath: str,
+    chunkSize: int,
+    processes: Optional[int],
+    decode: Callable[[List[BackupRow]], Union[List[DecodedRow], DecodedChunk]],
+) -> Iterator[Union[List[DecodedRow], DecodedChunk]]:
+    """Decodes chunks in a process pool, yields them in order of backup table."""
+    processes = processes or os.cpu_count() or 1
+    with ProcessPoolExecutor(processes) as executor:
+        # Keep a few chunks per process in flight, not the whole backup in memory
+        inFlight: Deque[Future] = collections.deque()
+        maxInFlight = 2 * processes
+        for rows in msgbackup.stream_backup_rows(backupPath, chunkSize):
+            inFlight.append(executor.submit(decode, rows))
+            if len(inFlight) >= maxInFlight:
+                yield inFlight.popleft().result()
+        while inFlight:
+            yield inFlight.popleft().result()
+
+
+def _insert_positions(dbObj: dbmanager.DatabaseManager) -> int:
+    """Positions all depth tag detections of database, returns number inserted."""
+    pos.init_metadata()
+    dbmanager.attach_shards(dbObj)
+    positions = pos.position_database(dbObj) or []
+    return dbmanager.bulk_insert_positions(dbObj, positions)
+
+
+def reprocess_backup(
+    backupPath: str,
+    mainPath: str,
+    chunkSize: int = 5000,
+    processes: Optional[int] = None,
+    position: bool = False,
+    batchDecode: bool = False,
+) -> None:
+    """
+    Rebuilds main database at mainPath (must not exist) from raw messages of backup.
+    Messages keep their message_id of the backup table. Messages that failed handling
+    when received (no message_id) get new message_ids after the largest one.
+    With batchDecode, each chunk is decoded to arrays by msghandler.batchdecode and
+    inserted without packet dicts. It is faster, but fails truncated messages.
+    """
+    t0 = time.perf_counter()
+    dbmanager.register_numpy_adapters()
+    dbinit.create_main_database(mainPath)
+    with sqlite3.connect(f"file:{backupPath}?mode=ro", uri=True) as con:
+        total, lastID = msgbackup.count_backup_messages(con)
+    nextID = 0 if lastID is None else lastID + 1
+
+    dbObj = dbmanager.DatabaseManager(mainPath)
+    # Nothing to lose if the load is interrupted, it can simply be rerun
+    # | Journal in memory still lets failed packet insertions roll back
+    dbObj.con.execute("pragma journal_mode = memory")
+    dbObj.con.execute("pragma synchronous = off")
+    done = inserted = failed = 0
+    decode = decode_backup_chunk if batchDecode else decode_backup_rows
+    for decoded in _decoded_chunks(backupPath, chunkSize, processes, decode):
+        if batchDecode:
+            backupIDs, batch = decoded
+            failedRows = set(batch.failed.tolist())
+            msgIDs = []
+            for i, msgID in enumerate(backupIDs):
+                if msgID is None and i not in failedRows:
+                    msgID, nextID = nextID, nextID + 1
+                msgIDs.append(-1 if msgID is None else msgID)
+            inserted += len(dbmanager.bulk_insert_decoded_batch(dbObj, batch, msgIDs))
+            failed += len(failedRows)
+            done += len(backupIDs)
+        else:
+            msgs, msgIDs = [], []
+            for msgID, message in decoded:
+                if message is None:
+                    failed += 1
+                    continue
+                if msgID is None:
+                    msgID, nextID = nextID, nextID + 1
+                msgs.append(message)
+                msgIDs.append(msgID)
+            if msgs:
+                inserted += len(dbmanager.bulk_insert_messages(dbObj, msgs, msgIDs))
+            done += len(decoded)
+        elapsed = time.perf_counter() - t0
+        logger.info(
+            f"{done}/{total} backup rows ({100 * done / max(total, 1):.1f} %), "
+            f"{done / elapsed:.0f} rows/s"
+        )
+
+    # Continue message_ids after the reprocessed ones when client uses database
+    dbObj.add_del_update_db_record(
+        dbformat.sql_query_insert_message_sequence(), (nextID,)
+    )
+    dbmanager.apply_storage_profile(dbObj.con)
+    logger.info(
+        f"Inserted {inserted} of {done} messages in {mainPath} "
+        f"({failed} could not be handled) in {time.perf_counter() - t0:.1f} s"
+    )
+    if position:
+        logger.info("Positioning depth tag detections of rebuilt database")
+        logger.info(f"Inserted {_insert_positions(dbObj)} positions")
+    dbObj.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Rebuild a main database from raw messages of backup database, with "
+            "current metadata and conversion factors. Run from repo root."
+        )
+    )
+    parser.add_argument("output", help="path of new main database, must not exist")
+    parser.add_argument(
+        "--backup",
+        help="path of backup database, default is backup database in db_names.toml",
+    )
+    parser.add_argument("--chunk-size", dest="chunkSize", type=int, default=5000)
+    parser.add_argument(
+        "--processes", type=int, help="decoding processes, default is number of cores"
+    )
+    parser.add_argument(
+        "--position", action="store_true", help="position depth tags after loading"
+    )
+    parser.add_argument(
+        "--batch-decode",
+        dest="batchDecode",
+        action="store_true",
+        help="decode chunks to arrays at once (faster, fails truncated messages)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(name)s - %(message)s")
+    # Per-packet handling is logged at debug level, errors are enough here
+    logging.getLogger("mqtt_client.msghandler").setLevel(logging.ERROR)
+
+    backupPath = args.backup
+    if backupPath is None:
+        dbDict = toml.load(msgbackup.dbConfig)
+        backupPath = msgbackup.dbPath + dbDict["backup_database"]
+    if os.path.exists(args.output):
+        parser.error(f"{args.output} already exists, reprocess into a new database")
+    reprocess_backup(
+        backupPath,
+        args.output,
+        args.chunkSize,
+        args.processes,
+        args.position,
+        args.batchDecode,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+# Python built-in modules and packages
+import argparse
+import logging
+import math
+import os
+import sys
+from typing import Dict, Iterator, Optional, Tuple
+
+# Local modules and packages
+from src.backend.dbmanager import dbformat
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+
+
+logger = logging.getLogger("mqtt_client.rollups")
+
+# All rows of 'tag' and 'tbr' are rolled up, except their dummy rows
+_rowFilter = "timestamp >= 0"
+
+
+def _rollup_tables() -> Iterator[Tuple[str, str, str]]:
+    for table in dbformat.rollups:
+        for granularity in dbformat.rollupGranularities:
+            yield table, granularity, dbformat.rollup_table(table, granularity)
+
+
+def rebuild_rollups(path: str, busyTimeout: int = 60000) -> Dict[str, int]:
+    """
+    Creates missing rollup tables of main database at path, and recomputes them from
+    all 'tag' and 'tbr' rows of the database and its shards. Returns number of rows of
+    every rollup table.
+
+    The rollups are replaced in one transaction, waiting up to busyTimeout ms for the
+    write lock of the MQTT client, so that rows written meanwhile are counted once.
+    """
+    dbObj = dbmanager.DatabaseManager(path)
+    counts = {}
+    try:
+        dbObj.add_del_update_db_record(f"pragma busy_timeout = {int(busyTimeout)}")
+        dbinit.create_rollup_tables(dbObj)
+        dbmanager.attach_shards(dbObj)
+        with dbObj.transaction(immediate=True):
+            for table, granularity, name in _rollup_tables():
+                dbObj.add_del_update_db_record(f"DELETE FROM {name};")
+                dbObj.add_del_update_db_record(
+                    dbformat.sql_query_rollup_upsert(table, granularity, _rowFilter)
+                )
+                count = dbObj.select_from_db_record(f"SELECT count(*) FROM {name};")
+                counts[name] = count[0][0]
+                logger.info(f"Rebuilt {name} with {counts[name]} rows")
+    finally:
+        dbObj.close()
+    return counts
+
+
+def check_rollups(path: str) -> Dict[str, int]:
+    """
+    Compares the rollup tables of main database at path with rollups computed from
+    its rows. Returns {rollup table: number of buckets that differ}.
+    """
+    dbObj = dbmanager.DatabaseManager(path)
+    mismatches = {}
+    try:
+        dbmanager.attach_shards(dbObj)
+        for table, granularity, name in _rollup_tables():
+            keys = len(dbformat.rollups[table][0]) + 1
+            columns = ", ".join(dbformat.rollup_columns(table))
+            stored = dbObj.select_from_db_record(f"SELECT {columns} FROM {name};")
+            expected = dbObj.select_from_db_record(
+                dbformat.sql_query_rollup_select(table, granularity, _rowFilter)
+            )
+            storedRows = {row[:keys]: row[keys:] for row in stored}
+            expectedRows = {row[:keys]: row[keys:] for row in expected}
+            differ = storedRows.keys() ^ expectedRows.keys()
+            for key in storedRows.keys() & expectedRows.keys():
+                # Sums are added in a different order, compare them with a tolerance
+                pairs = zip(storedRows[key], expectedRows[key])
+                if not all(_equal(a, b) for a, b in pairs):
+                    differ.add(key)
+            mismatches[name] = len(differ)
+    finally:
+        dbObj.close()
+    return mismatches
+
+
+def _equal(a: Optional[float], b: Optional[float]) -> bool:
+    return a == b or (a is not None and b is not None and math.isclose(a, b))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description=(
+            "Rebuilds the rollup tables of the dashboards from all rows of an existing "
+            "main database, while the MQTT client may be running. Run from repo root."
+        )
+    )
+    parser.add_argument(
+        "database",
+        nargs="?",
+        default=dbinit.dbPath + dbinit.dbDict.get("main_database", ""),
+        help="path of main database, default is main database of db_names.toml",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="only check that rollup tables match the rows, exit with 1 if not",
+    )
+    parser.add_argument(
+        "--busy-timeout",
+        dest="busyTimeout",
+        type=int,
+        default=60000,
+        help="ms to wait for the write lock of the MQTT client",
+    )
+    args = parser.parse_args()
+    if not os.path.isfile(args.database):
+        parser.error(f"no database at '{args.database}'")
+    logging.basicConfig(level=logging.INFO)
+
+    if not args.check:
+        counts = rebuild_rollups(args.database, args.busyTimeout)
+        for name, count in counts.items():
+            print(f"Rebuilt {name} with {count} rows")
+        return
+
+    mismatches = check_rollups(args.database)
+    for name, count in mismatches.items():
+        print(f"{name}: {count} buckets differ from rows")
+    if any(mismatches.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# Python built-in modules and packages
+import base64
+import json
+import logging
+import zlib
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# Local modules and packages
+from src.backend import ingest
+from src.backend.dbmanager import positioning as pos
+
+
+# --- Useful type hints ---
+MQTTPayload = bytes
+Topics = List[Tuple[str, int]]  # (topic, qos)
+WorkersConfig = Dict[str, Any]
+
+logger = logging.getLogger("mqtt_client.workers")
+
+# Defaults used for any value not set in [workers] of 'src/backend/.config/client.toml'
+_defaults: WorkersConfig = {
+    "count": 1,
+    "partitioning": "shared",
+    "share_group": "iof",
+}
+# How received messages are split between workers
+# | shared: broker hands each message to one worker ($share/<group>/<topic>)
+# | topic: each topic is subscribed by one worker ('worker' list in topics.toml,
+# |   else topic number modulo count)
+# | tbr: every worker subscribes to all topics, and keeps messages of its TBRs
+_partitionings = ("shared", "topic", "tbr")
+
+
+def load_workers_config() -> WorkersConfig:
+    """Loads [workers] section of 'src/backend/.config/client.toml'."""
+    config = ingest.load_client_config("workers", _defaults)
+    if config["partitioning"] not in _partitionings:
+        logger.error(f"Unknown partitioning {config['partitioning']}, using shared")
+        config["partitioning"] = "shared"
+    return config
+
+
+def partition_key(tbr_serial_id: int) -> int:
+    """
+    Returns the key used to assign messages of a TBR to a worker.
+    All TBRs of a positioning cage get the same key, so that one worker sees every
+    detection of a triplet. Other TBRs are keyed by serial id.
+    """
+    index = pos.get_metadata_index()
+    if index is not None and tbr_serial_id in index.tbrCages:
+        cage, _ = index.tbrCages[tbr_serial_id]
+        return zlib.crc32(cage.cageName.encode())  # same in every process
+    return tbr_serial_id
+
+
+def payload_tbr_serial_id(payload: MQTTPayload) -> Optional[int]:
+    """Reads tbr_serial_id from message header of MQTT payload, None if invalid."""
+    try:
+        # Header starts with 14 bits of tbr_serial_id, 4 base64 chars are 3 bytes
+        header = base64.b64decode(json.loads(payload)["data"][:4])
+    except Exception:
+        return None
+    if len(header) < 2:
+        return None
+    return int.from_bytes(header[:2], "big") >> 2
+
+
+class WorkerPartition(NamedTuple):
+    """Part of the received MQTT messages handled by one client worker."""
+
+    index: int = 0
+    count: int = 1
+    partitioning: str = _defaults["partitioning"]
+    shareGroup: str = _defaults["share_group"]
+
+    @classmethod
+    def from_config(
+        cls, index: int, count: Optional[int] = None
+    ) -> "WorkerPartition":
+        config = load_workers_config()
+        return cls(
+            index,
+            config["count"] if count is None else count,
+            config["partitioning"],
+            config["share_group"],
+        )
+
+    def subscriptions(
+        self, topics: Topics, workers: Optional[List[int]] = None
+    ) -> Topics:
+        """
+        Returns the subscriptions of this worker. workers is the optional list from
+        topics.toml of which worker subscribes to each topic ('topic' partitioning).
+        """
+        if self.count <= 1:
+            return topics
+        if self.partitioning == "shared":
+            return [(f"$share/{self.shareGroup}/{top}", qos) for top, qos in topics]
+        if self.partitioning == "topic":
+            if workers is None or len(workers) != len(topics):
+                workers = list(range(len(topics)))
+            return [
+                topic
+                for topic, worker in zip(topics, workers)
+                if worker % self.count == self.index
+            ]
+        return topics
+
+    def accepts(self, payload: MQTTPayload) -> bool:
+        """Whether this worker handles payload. Invalid payloads go to worker 0."""
+        if self.count <= 1 or self.partitioning != "tbr":
+            return True
+        tbr_serial_id = payload_tbr_serial_id(payload)
+        if tbr_serial_id is None:
+            return self.index == 0
+        return partition_key(tbr_serial_id) % self.count == self.index
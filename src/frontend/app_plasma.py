@@ -4,7 +4,6 @@ import dash_html_components as html
 import dash_daq as daq
 from dash.dependencies import Input, Output, State
 import plotly.graph_objs as go
-import sqlite3
 import pandas as pd
 from flask_caching import Cache
 import pyarrow as pa
@@ -19,6 +18,7 @@ import plotly
 import os
 
 from layoutCode import app_page_layout, header_colors
+from dbconnect import connect_db
 from metaData import aq_cage, aq_cage_new, ref_cage
 
 
@@ -243,7 +243,7 @@ def clean_data(start_ts, name):
 
     # Read from databse
     print("Reading from database")
-    con = sqlite3.connect(db)
+    con = connect_db(db, start_ts)
     df = pd.read_sql(query, con)
     con.close()
 
@@ -0,0 +1,61 @@
+import os
+from datetime import datetime as dt
+
+import toml
+
+try:
+    import pyarrow.dataset as ds
+except ImportError:  # optional, without it data is always read from the database
+    ds = None
+
+# Parquet archive exported by the backend, see src/backend/archive.py
+archivePath = "../backend/dbmanager/archive/"
+stateFile = "export_state.toml"
+
+
+def exported_until(table):
+    """Largest timestamp of table in archive, None if table has not been exported."""
+    try:
+        state = toml.load(os.path.join(archivePath, stateFile))
+    except (FileNotFoundError, toml.decoder.TomlDecodeError):
+        return None
+    return state.get("exported_until", {}).get(table)
+
+
+def covers(table, end_ts):
+    """True if archive can be read instead of the database up to end_ts."""
+    until = exported_until(table)
+    return ds is not None and until is not None and end_ts <= until
+
+
+def read_archive(table, columns, filterChoices):
+    """
+    Reads columns of table from archive, with the filters of iof_app.clean_data:
+    filterChoices["IN"] as {column: values} and filterChoices["BETWEEN"] as
+    {column: (low, high)}. Only the day partitions of the timestamp range and the
+    selected columns are read, other filters are pushed down to the Parquet files.
+    Returns a dataframe ordered by timestamp, like the sql query of clean_data.
+    """
+    dataset = ds.dataset(
+        os.path.join(archivePath, table), format="parquet", partitioning="hive"
+    )
+    expression = None
+    for column, values in filterChoices["IN"].items():
+        expression = _and(expression, ds.field(column).isin(list(values)))
+    for column, (low, high) in filterChoices["BETWEEN"].items():
+        between = (ds.field(column) >= low) & (ds.field(column) <= high)
+        expression = _and(expression, between)
+        if column == "timestamp":
+            # 'date' of rows is in local time, like dt.fromtimestamp
+            first = dt.fromtimestamp(low).strftime("%Y-%m-%d")
+            last = dt.fromtimestamp(high).strftime("%Y-%m-%d")
+            days = (ds.field("day") >= first) & (ds.field("day") <= last)
+            expression = _and(expression, days)
+    readColumns = list(columns) + ["timestamp"] * ("timestamp" not in columns)
+    df = dataset.to_table(columns=readColumns, filter=expression).to_pandas()
+    df = df.sort_values("timestamp", kind="mergesort").reset_index(drop=True)
+    return df[list(columns)]
+
+
+def _and(expression, condition):
+    return condition if expression is None else expression & condition
@@ -1,10 +1,11 @@
-import sqlite3
 import pandas as pd
 import pyarrow as pa
 import pyarrow.plasma as plasma
 import numpy as np
 import pickle
 
+from dbconnect import connect_db
+
 start_project_time = 1541498400
 
 # Init
@@ -174,7 +175,7 @@ def clean_data(start_ts, name):
     query = db_sql_query(start_ts, name)
     # Read from databse
     print("Reading from database")
-    con = sqlite3.connect(db)
+    con = connect_db(db, start_ts)
     df = pd.read_sql(query, con)
     con.close()
     print("cleaning up dataframe")
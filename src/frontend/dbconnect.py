@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import toml
+from pathlib import Path
+
+# Storage profile shared with the backend, see [storage] in db_names.toml
+dbConfig = "../backend/.config/db_names.toml"
+_defaults = {"busy_timeout": 5000, "cache_size": -16000, "mmap_size": 268435456}
+# Data tables stored in shards of a sharded database, see backend dbmanager.shards
+_shardTables = ("tag", "tbr", "gps", "positions")
+_maxAttached = 10
+
+
+def load_storage_profile():
+    profile = dict(_defaults)
+    try:
+        storage = toml.load(dbConfig, _dict=dict).get("storage", {})
+    except (FileNotFoundError, toml.decoder.TomlDecodeError):
+        return profile
+    profile.update({k: storage[k] for k in _defaults if k in storage})
+    return profile
+
+
+def connect_db(db, start=None, end=None, shards=True):
+    """
+    Opens a read connection to db with the storage profile of the backend.
+    Journal mode and checkpoints are owned by the backend. With WAL, reads here do
+    not block the MQTT client from writing, and the reverse. busy_timeout makes a
+    read wait for a lock instead of failing with 'database is locked'.
+    If db is sharded, the shards overlapping timestamps [start, end] are attached,
+    unless shards is False, for reading tables of db only, such as the rollup tables.
+    """
+    profile = load_storage_profile()
+    con = sqlite3.connect(db, timeout=profile["busy_timeout"] / 1000, uri=True)
+    con.execute(f"pragma cache_size = {int(profile['cache_size'])}")
+    con.execute(f"pragma mmap_size = {int(profile['mmap_size'])}")
+    if shards:
+        attach_shards(con, db, start, end)
+    return con
+
+
+def attach_shards(con, db, start=None, end=None):
+    """
+    Attaches the shards of db overlapping timestamps [start, end] read-only, found in
+    the 'shards' catalog of db. Temporary views named like the data tables union db
+    and the shards, so queries written for a single database read them all.
+    Does nothing if db is not sharded.
+    """
+    catalog = con.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'shards'"
+    ).fetchall()
+    if not catalog:
+        return
+    start = -(2 ** 63) if start is None else start
+    end = 2 ** 63 - 1 if end is None else end
+    names = [
+        name
+        for name, in con.execute(
+            "SELECT name FROM shards WHERE end_timestamp > ? AND start_timestamp <= ? "
+            "ORDER BY start_timestamp",
+            (start, end),
+        )
+    ]
+    if len(names) > _maxAttached:
+        raise ValueError(
+            f"{len(names)} shards overlap time range, at most {_maxAttached} can be "
+            "read at once. Choose a shorter time range."
+        )
+    schemas = ["main"]
+    for i, name in enumerate(names):
+        path = Path(os.path.dirname(db), name).resolve()
+        con.execute(f"ATTACH DATABASE ? AS shard_{i}", (f"{path.as_uri()}?mode=ro",))
+        schemas.append(f"shard_{i}")
+    if len(schemas) == 1:
+        return
+    for table in _shardTables:
+        union = " UNION ALL ".join(f"SELECT * FROM {s}.{table}" for s in schemas)
+        con.execute(f"CREATE TEMP VIEW {table} AS {union}")
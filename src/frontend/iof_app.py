@@ -5,7 +5,6 @@ import dash_daq as daq
 from dash.dependencies import Input, Output, State
 import plotly.graph_objects as go
 import plotly.express as px
-import sqlite3
 import pandas as pd
 import numpy as np
 import pickle
@@ -18,6 +17,9 @@ import os
 from pathlib import Path
 
 from layoutCode import app_page_layout, header_colors
+from dbconnect import connect_db
+import archive
+import rollups
 from metaData import cages  # empty dict if positioning metadata not included
 
 
@@ -95,24 +97,30 @@ timeseries_xaxis_dict = dict(
 )
 
 
-def db_sql_query_and_columns(
-    table, timeRange, axisSelections, filterChoices, includeTimestamp=False
-):
-    # Column selection
+def db_select_columns(table, axisSelections, includeTimestamp=False):
+    # Column selection, returns selected columns and columns to clean
     if table == "tag" or table == "positions":
-        columns = "tag_id, "
+        selected = ["tag_id"]
         columnList = ["tag_id"]
     else:
-        columns = "tbr_serial_id, "
+        selected = ["tbr_serial_id"]
         columnList = ["tbr_serial_id"]
     if "date" not in axisSelections:
-        columns += "date, "
+        selected.append("date")
     if includeTimestamp:
-        columns += "timestamp, "
+        selected.append("timestamp")
     for column in axisSelections:
-        columns += f"{column}, "
+        selected.append(column)
         columnList.append(column)
-    columns = columns[:-2]
+    return selected, columnList
+
+
+def db_sql_query_and_columns(
+    table, timeRange, axisSelections, filterChoices, includeTimestamp=False
+):
+    # Column selection
+    selected, columnList = db_select_columns(table, axisSelections, includeTimestamp)
+    columns = ", ".join(selected)
 
     # Filtering of data
     filters = ""
@@ -163,22 +171,47 @@ def clean_df(df, columns):
     return df
 
 
-def clean_data(table, timeRange, axisSelections, filterChoices, includeTimestamp=False):
+def clean_data(
+    table,
+    timeRange,
+    axisSelections,
+    filterChoices,
+    includeTimestamp=False,
+    aggregate=False,
+):
     if table == "pos":
         table = "positions"
 
-    # create sql query
-    print("Creating SQL query")
-    query, columns = db_sql_query_and_columns(
-        table, timeRange, axisSelections, filterChoices, includeTimestamp
-    )
-    # Read from databse
-    print("Reading from database")
-    con = sqlite3.connect(dbName)
-    print(query)
-    df = pd.read_sql(query, con)
-    print(df)
-    con.close()
+    df = None
+    if aggregate:
+        # Coarse range, read means per minute, hour or day from rollup tables
+        selected, columns = db_select_columns(table, axisSelections, includeTimestamp)
+        # Rollup tables are in the main database, no shards to attach
+        con = connect_db(dbName, shards=False)
+        df = rollups.read_rollups(con, table, timeRange, selected, filterChoices)
+        con.close()
+        if df is not None:
+            print("Read from rollup tables")
+            print(df)
+    if df is None and archive.covers(table, timeRange[1]):
+        # Historical range, read from Parquet archive instead of database
+        print("Reading from archive")
+        selected, columns = db_select_columns(table, axisSelections, includeTimestamp)
+        df = archive.read_archive(table, selected, filterChoices)
+        print(df)
+    elif df is None:
+        # create sql query
+        print("Creating SQL query")
+        query, columns = db_sql_query_and_columns(
+            table, timeRange, axisSelections, filterChoices, includeTimestamp
+        )
+        # Read from databse
+        print("Reading from database")
+        con = connect_db(dbName, *timeRange)
+        print(query)
+        df = pd.read_sql(query, con)
+        print(df)
+        con.close()
 
     # Optimize memory usage and transform dataframe
     print("cleaning up dataframe")
@@ -1241,6 +1274,12 @@ def get_time_of_day(hour, minute, second):
     return f"{hour}:{minute}:{second}"
 
 
+def use_rollups(plotType, xAxis, start_time, end_time):
+    # Means of rollup buckets are only plotted as time series of whole days
+    wholeDays = start_time == "0:0:0" and end_time == "23:59:59"
+    return plotType == "scatter" and xAxis in ("date", "timestamp") and wholeDays
+
+
 # *--------------------------------------*
 # | SWITCHING BETWEEN DATA SETS CALLBACK |
 # *--------------------------------------*
@@ -1939,10 +1978,13 @@ def update_tag_graph(
     filterChoices = {"IN": inFilters, "BETWEEN": betweenFilters}
 
     # Read data from database and organize into ready-to-use dataframe
-    df = clean_data(table, timeRange, axisSelections, filterChoices)
-    marker, line = get_marker_line(markerSize, markerOpacity, lineWidth, lineDash)
     start_time = get_time_of_day(start_hour, start_min, start_sec)
     end_time = get_time_of_day(end_hour, end_min, end_sec)
+    aggregate = use_rollups(plotType, xAxis, start_time, end_time)
+    df = clean_data(
+        table, timeRange, axisSelections, filterChoices, aggregate=aggregate
+    )
+    marker, line = get_marker_line(markerSize, markerOpacity, lineWidth, lineDash)
     dff = df.between_time(start_time, end_time)
     # if xAxis != "millisecond" and yAxis != "millisecond":
     #    dff = dff.drop_duplicates(subset=["timestamp", "tag_id"], keep="first")
@@ -2049,11 +2091,14 @@ def update_tbr_graph(
     filterChoices = {"IN": inFilters, "BETWEEN": betweenFilters}
 
     # Read data from database and organize into ready-to-use dataframe
-    df = clean_data(table, timeRange, axisSelections, filterChoices)
-
-    marker, line = get_marker_line(markerSize, markerOpacity, lineWidth, lineDash)
     start_time = get_time_of_day(start_hour, start_min, start_sec)
     end_time = get_time_of_day(end_hour, end_min, end_sec)
+    aggregate = use_rollups(plotType, xAxis, start_time, end_time)
+    df = clean_data(
+        table, timeRange, axisSelections, filterChoices, aggregate=aggregate
+    )
+
+    marker, line = get_marker_line(markerSize, markerOpacity, lineWidth, lineDash)
 
     # Filter dataframe
     dff = df.between_time(start_time, end_time)
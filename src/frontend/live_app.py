@@ -4,7 +4,6 @@ import dash_html_components as html
 import dash_daq as daq
 from dash.dependencies import Input, Output, State
 import plotly.graph_objs as go
-import sqlite3
 import pandas as pd
 from datetime import timedelta
 from datetime import datetime as dt
@@ -13,6 +12,8 @@ import dash_auth
 import toml
 
 from layoutCode import app_page_layout, header_colors
+from dbconnect import connect_db
+import rollups
 
 usrpwd = toml.load("usrpwd.toml")
 VALID_USERNAME_PASSWORD_PAIR = [[usrpwd["username"], usrpwd["password"]]]
@@ -101,7 +102,8 @@ def clean_df(df, name):
         df.tag_id = df.tag_id.astype("uint8")
         df.tag_data = -df.tag_data
         df.snr = df.snr.astype("uint8")
-        df.millisecond = df.millisecond.astype("uint16")
+        if "millisecond" in df:  # not in means of rollup tables
+            df.millisecond = df.millisecond.astype("uint16")
         # Add metadata
         rename_dict = {
             "tbr_serial_id": "tbrSerialNo",
@@ -139,7 +141,7 @@ def clean_data_cached(start_ts, name):
     query = db_sql_query(start_ts, name)
     # Read from databse
     print("Reading from database")
-    con = sqlite3.connect(db)
+    con = connect_db(db, start_ts)
     df = pd.read_sql(query, con)
     con.close()
     print("cleaning up dataframe")
@@ -147,6 +149,31 @@ def clean_data_cached(start_ts, name):
     return df
 
 
+@cache.memoize(timeout=timeout)
+def clean_rollups_cached(start_ts, end_ts, name):
+    # Means per minute of tag data between start_ts and end_ts, None if unavailable
+    db = "../backend/src/backend/dbmanager/databases/iof.db"
+    columns = ["timestamp", "tbr_serial_id", "tag_id", "tag_data", "snr"]
+    inFilters = {
+        "frequency": (69,),
+        "comm_protocol": ("S256",),
+        "tag_id": all_tags,
+        "tbr_serial_id": all_tbrs,
+    }
+    filterChoices = {"IN": inFilters, "BETWEEN": {"timestamp": (start_ts, end_ts)}}
+    print("Reading from rollup tables")
+    # Rollup tables are in the main database, no shards to attach
+    con = connect_db(db, shards=False)
+    df = rollups.read_rollups(
+        con, name, (start_ts, end_ts), columns, filterChoices, "minute"
+    )
+    con.close()
+    if df is None:
+        return None
+    print("cleaning up dataframe")
+    return clean_df(df, name)
+
+
 def clean_data(start_ts, name):
     # db = "Aquatraz.db"
     db = "../backend/src/backend/dbmanager/databases/iof.db"
@@ -154,7 +181,7 @@ def clean_data(start_ts, name):
     query = db_sql_query(start_ts, name)
     # Read from databse
     print("Reading from database")
-    con = sqlite3.connect(db)
+    con = connect_db(db, start_ts)
     df = pd.read_sql(query, con)
     con.close()
     print("cleaning up dataframe")
@@ -769,7 +796,13 @@ def update_live_graph(
     now, prev = dt.now(), dt.now() - timedelta(hours=hour_offset)
     ts_now = int(dt.timestamp(now - timedelta(seconds=60 * 3)))
     ts_cache = int(dt.timestamp(now - timedelta(hours=hour_offset)))
-    df_old = clean_data_cached(ts_cache, "tag")
+    df_old = None
+    if "millisecond" not in (xAxis, yAxis) and tuple(snr) == (6, 60):
+        # Means per minute are plotted for the past, rows for the last minutes
+        ts_now -= ts_now % rollups.granularities["minute"] + 1
+        df_old = clean_rollups_cached(ts_cache, ts_now, "tag")
+    if df_old is None:
+        df_old = clean_data_cached(ts_cache, "tag")
     df_new = clean_data(ts_now, "tag")
     if df_new.empty:
         print("No new data since previous poll")
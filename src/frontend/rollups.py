@@ -0,0 +1,104 @@
+import sqlite3
+
+import pandas as pd
+
+# Rollup tables maintained by the backend, see src/backend/rollups.py
+# | {granularity: seconds}, finest first
+granularities = {"minute": 60, "hour": 3600, "day": 86400}
+# Ranges shorter than this are always read from rows
+minRange = 24 * 3600
+# Finest granularity giving at most this many buckets per group is used
+maxBuckets = 2000
+
+_localTime = "bucket, 'unixepoch', 'localtime'"
+_timeColumns = {
+    "timestamp": "bucket",
+    "date": f"strftime('%Y-%m-%d %H:%M:%S', {_localTime})",
+    "hour": f"CAST(strftime('%H', {_localTime}) AS INTEGER)",
+}
+# Expressions of the columns of the dashboards that a rollup table can give
+_columns = {
+    "tag": {
+        **_timeColumns,
+        "tag_id": "tag_id",
+        "frequency": "frequency",
+        "tbr_serial_id": "tbr_serial_id",
+        "tag_data": "tag_data_sum / tag_data_count",
+        "snr": "round(snr_sum / snr_count)",
+    },
+    "tbr": {
+        **_timeColumns,
+        "tbr_serial_id": "tbr_serial_id",
+        "temperature": "round(temperature_sum / temperature_count, 1)",
+        "noise_avg": "round(noise_avg_sum / noise_avg_count)",
+        "noise_peak": "noise_peak_max",
+    },
+}
+
+
+def granularity_of(timeRange):
+    """Granularity to read timeRange with, None if the range is too short."""
+    span = timeRange[1] - timeRange[0]
+    if span < minRange:
+        return None
+    for granularity, seconds in granularities.items():
+        if span / seconds <= maxBuckets:
+            return granularity
+    return granularity
+
+
+def can_read(table, columns):
+    """True if all columns of table can be read from its rollups."""
+    return table in _columns and all(c in _columns[table] for c in columns)
+
+
+def read_rollups(con, table, timeRange, columns, filterChoices, granularity=None):
+    """
+    Reads columns of table as one row per bucket, TBR and tag, with the mean of their
+    values (maximum of noise_peak), from the rollup table of granularity, by default
+    the one of timeRange. filterChoices are the filters of iof_app.clean_data.
+    Returns None if rows must be read instead: the range is too short, a column or
+    the rollup table is missing, or a value filter would exclude only some of the
+    rows of a bucket, so that the means of the bucket would not match the filter.
+    Otherwise returns a dataframe ordered by timestamp, like clean_data's query.
+    """
+    if granularity is None:
+        granularity = granularity_of(timeRange)
+    if granularity is None or not can_read(table, columns):
+        return None
+    name = f"{table}_rollup_{granularity}"
+    seconds = granularities[granularity]
+
+    # Buckets overlapping the time range, and rows of the IN filters
+    conditions = ["bucket BETWEEN ? AND ?"]
+    params = [timeRange[0] - timeRange[0] % seconds, timeRange[1]]
+    for column, values in filterChoices["IN"].items():
+        conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+        params += list(values)
+    where = " AND ".join(conditions)
+
+    # Buckets with values outside of a BETWEEN filter, or values that are NULL
+    partial = [
+        f"{column}_min < ? OR {column}_max > ? OR {column}_count < count"
+        for column in filterChoices["BETWEEN"]
+        if column != "timestamp"
+    ]
+    partialParams = [
+        value
+        for column, valueRange in filterChoices["BETWEEN"].items()
+        if column != "timestamp"
+        for value in valueRange
+    ]
+    try:
+        if partial:
+            partialWhere = f"{where} AND ({' OR '.join(partial)})"
+            query = f"SELECT count(*) FROM {name} WHERE {partialWhere}"
+            if con.execute(query, params + partialParams).fetchone()[0] > 0:
+                return None
+        selected = ", ".join(f"{_columns[table][c]} AS {c}" for c in columns)
+        query = f"SELECT {selected} FROM {name} WHERE {where} ORDER BY bucket ASC;"
+        return pd.read_sql(query, con, params=params)
+    except sqlite3.OperationalError as e:
+        if "no such" not in str(e):
+            raise
+        return None  # database without rollup tables, or rollup of another column
@@ -0,0 +1,50 @@
+# Python built-in modules and packages
+import os
+
+# Third-party modules and packages
+import pytest
+
+# Local modules and packages
+from src.backend import benchmark
+from src.backend import ingest
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+from src.backend.dbmanager import shards
+from src.frontend import dbconnect
+from src.frontend import rollups
+
+
+months = 12  # more than sqlite can attach
+monthStarts = [shards._month_start(2019 * 12 + month) for month in range(months)]
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = os.path.join(str(tmp_path), "iof.db")
+    dbinit.create_main_database(path)
+    monkeypatch.setitem(dbmanager._storageProfile, "shard_months", 1)
+    monkeypatch.setattr(dbmanager, "_dbPath", path)
+    dbmanager._msgIdAllocator.reset()
+    payloads = [benchmark.synthetic_mqtt_payload(1, ts + 3600) for ts in monthStarts]
+    msgs = [ingest.decode_mqtt_payload(payload)[1] for payload in payloads]
+    assert None not in dbmanager.insert_messages_in_db(msgs)
+    dbmanager.close_database_managers()
+    dbmanager._msgIdAllocator.reset()
+    return path
+
+
+def test_rollups_of_more_shards_than_attachable_are_read(database):
+    timeRange = (monthStarts[0], monthStarts[-1] + 24 * 3600)
+    with pytest.raises(ValueError):
+        dbconnect.connect_db(database)
+
+    con = dbconnect.connect_db(database, shards=False)
+    try:
+        filterChoices = {"IN": {}, "BETWEEN": {"timestamp": timeRange}}
+        columns = ["timestamp", "tag_id", "tag_data"]
+        df = rollups.read_rollups(con, "tag", timeRange, columns, filterChoices)
+    finally:
+        con.close()
+    # One day bucket of the two tags of every month
+    assert len(df) == 2 * months
+    assert sorted(set(df["timestamp"])) == monthStarts
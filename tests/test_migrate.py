@@ -0,0 +1,100 @@
+# Python built-in modules and packages
+import os
+
+# Third-party modules and packages
+import pytest
+
+# Local modules and packages
+from src.backend import migrate
+from src.backend.dbmanager import dbformat
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+
+
+# Indexes each hot query of migrate.hot_queries may be answered from
+expectedIndexes = {
+    "positioning tag_df": ("idx_tag_tag_id_frequency_timestamp",),
+    "positioning all_tag_freq_detections": ("idx_tag_tag_id_frequency_timestamp",),
+    "positioning latest_TBR_pos": ("idx_gps_tbr_serial_id_fix_timestamp",),
+    "message_id of tag": ("idx_tag_message_id",),
+    "message_id of tbr": ("idx_tbr_message_id",),
+    "message_id of gps": ("idx_gps_message_id",),
+    "frontend tag": ("idx_tag_tag_id_frequency_timestamp", "idx_tag_timestamp"),
+    "frontend tag live": ("idx_tag_timestamp",),
+    "frontend tbr": ("idx_tbr_timestamp",),
+    "frontend positions": ("idx_positions_tag_id_frequency_timestamp",),
+}
+
+
+@pytest.fixture
+def database(tmp_path):
+    path = os.path.join(str(tmp_path), "iof.db")
+    dbinit.create_main_database(path)
+    return path
+
+
+def test_every_hot_query_has_expected_indexes():
+    assert set(expectedIndexes) == set(migrate.hot_queries())
+    for indexes in expectedIndexes.values():
+        assert set(indexes) <= set(dbformat.indexes)
+
+
+def test_hot_queries_use_indexes(database):
+    dbObj = dbmanager.DatabaseManager(database)
+    try:
+        for name, query in migrate.hot_queries().items():
+            plan = " | ".join(migrate.query_plan(dbObj, query))
+            assert any(f"INDEX {index}" in plan for index in expectedIndexes[name]), (
+                name,
+                plan,
+            )
+        assert migrate.full_scans(dbObj) == {}
+    finally:
+        dbObj.close()
+
+
+def test_migration_adds_indexes_to_database_without_them(database):
+    dbObj = dbmanager.DatabaseManager(database)
+    try:
+        for name in dbformat.indexes:
+            dbObj.add_del_update_db_record(f"DROP INDEX {name};")
+        # The positions UNIQUE constraint's autoindex still serves its timestamp range
+        scanning = set(expectedIndexes) - {"frontend positions"}
+        assert set(migrate.full_scans(dbObj)) == scanning
+    finally:
+        dbObj.close()
+
+    assert sorted(migrate.migrate_database(database)) == sorted(dbformat.indexes)
+    assert migrate.migrate_database(database) == []
+
+    dbObj = dbmanager.DatabaseManager(database)
+    try:
+        assert migrate.full_scans(dbObj) == {}
+    finally:
+        dbObj.close()
+
+
+def test_migration_keeps_indexes_on_analyzed_tables(database):
+    dbObj = dbmanager.DatabaseManager(database)
+    try:
+        rows = [
+            (i, 1556555369 + i, "2019-04-29", 16, 730 + i % 3, "S256", 69, i % 50)
+            + (1.0, 1, 30, 0)
+            for i in range(2 * migrate.analysisRows)
+        ]
+        with dbObj.transaction():
+            dbObj.executemany_db_records(
+                f"INSERT INTO tag VALUES ({', '.join('?' * 12)});", rows
+            )
+    finally:
+        dbObj.close()
+
+    migrate.migrate_database(database)
+
+    dbObj = dbmanager.DatabaseManager(database)
+    try:
+        analyzed = dbObj.select_from_db_record("SELECT DISTINCT tbl FROM sqlite_stat1;")
+        assert analyzed == [("tag",)]
+        assert migrate.full_scans(dbObj) == {}
+    finally:
+        dbObj.close()
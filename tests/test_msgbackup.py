@@ -0,0 +1,63 @@
+# Python built-in modules and packages
+import base64
+import math
+import os
+
+# Third-party modules and packages
+import pytest
+
+# Local modules and packages
+from src.backend.dbmanager import dbmanager
+from src.backend.dbmanager import msgbackup
+
+
+@pytest.fixture
+def backup(tmp_path, monkeypatch):
+    path = os.path.join(str(tmp_path), "backup.db")
+    monkeypatch.setattr(msgbackup, "db", path)
+    dbObj = dbmanager.DatabaseManager(path)
+    msgbackup.create_backup_tables(dbObj)
+    dbObj.close()
+    yield path
+    dbmanager.close_database_managers()
+
+
+def _msg(data: bytes, **kwargs) -> msgbackup.JSONDict:
+    return dict(data=base64.b64encode(data).decode(), **kwargs)
+
+
+def _stored(path: str):
+    dbmanager.close_database_managers()
+    rows = [row for chunk in msgbackup.stream_backup_rows(path, 10) for row in chunk]
+    return [(msgID, data, snr) for _, msgID, data, snr in rows]
+
+
+def test_messages_without_valid_snr_are_stored_with_nan(backup):
+    msgbackup.store_messages_to_backup_db(
+        [
+            (_msg(b"\x01", snr=7.5), 1),
+            (_msg(b"\x02"), 2),
+            (_msg(b"\x03", snr=None), None),
+            (_msg(b"\x04", snr="bad"), 4),
+        ]
+    )
+    stored = _stored(backup)
+    assert [(msgID, data) for msgID, data, _ in stored] == [
+        (1, b"\x01"),
+        (2, b"\x02"),
+        (None, b"\x03"),
+        (4, b"\x04"),
+    ]
+    assert stored[0][2] == 7.5
+    assert all(math.isnan(snr) for _, _, snr in stored[1:])
+
+
+def test_bad_message_does_not_lose_rest_of_block(backup):
+    msgbackup.store_messages_to_backup_db(
+        [
+            (_msg(b"\x01", snr=7.5), 1),
+            (_msg(b"\x02", snr=7.5), 1 << 64),  # message_id not packable
+            (_msg(b"\x03", snr=7.5), 3),
+        ]
+    )
+    assert _stored(backup) == [(1, b"\x01", 7.5), (3, b"\x03", 7.5)]
@@ -0,0 +1,85 @@
+# Python built-in modules and packages
+import random
+from typing import List
+
+# Third-party modules and packages
+import pytest
+
+# Local modules and packages
+from src.backend.msghandler import packet as pack
+from src.backend.msghandler import protocol as C
+
+
+samples = 200
+
+
+def _codes(comm: str) -> List[int]:
+    return [code for code, (protocol, _) in C.codetypes.items() if protocol == comm]
+
+
+def _packets(code: int, length: int, seed: int) -> List[bytes]:
+    """Random packets of code, every tenth truncated, and packets of all 0 or 1 bits."""
+    rand = random.Random(seed)
+    packets = [bytes(length), b"\xff" * length]
+    for i in range(samples):
+        data = bytearray(rand.getrandbits(8 * length).to_bytes(length, "big"))
+        data[C.CODE_INDEX] = code
+        if i % 10 == 0:
+            data = data[: rand.randrange(1, length)]
+        packets.append(bytes(data))
+    return packets
+
+
+def _datafields(record: pack.records.PacketRecord) -> pack.Packet:
+    packet = record.asdict()
+    packet.pop("packetType", None)
+    return packet
+
+
+@pytest.mark.parametrize("comm", [p for p in C.COMM_PROTOCOL_LIST if p != "S64K"])
+def test_tag_decoders_match_unpack_packet(comm):
+    codes = _codes(comm)
+    assert codes
+    for code in codes:
+        length, type, format = pack.get_packet_length_type_and_format(code)
+        decoder = pack.get_packet_decoder(code)
+        assert (decoder.length, decoder.type, decoder.format) == (length, type, format)
+        for data in _packets(code, length, seed=code):
+            assert _datafields(decoder.decode(data)) == pack.unpack_packet(data, format)
+
+
+def test_tbr_decoder_matches_unpack_packet():
+    length, _, format = pack.get_packet_length_type_and_format(C.CODE_TBR)
+    decode = pack.get_packet_decoder(C.CODE_TBR).decode
+    for data in _packets(C.CODE_TBR, length, seed=C.CODE_TBR):
+        assert _datafields(decode(data)) == pack.unpack_packet(data, format)
+
+
+@pytest.mark.parametrize(
+    "decode, format",
+    [(pack.decode_header, C.header), (pack.decode_gps, C.gps)],
+    ids=["header", "gps"],
+)
+def test_header_and_gps_decoders_match_unpack_packet(decode, format):
+    rand = random.Random(0)
+    length = sum(segment.numBytes for segment in format)
+    for _ in range(samples):
+        data = rand.getrandbits(8 * length).to_bytes(length, "big")
+        assert _datafields(decode(data)) == pack.unpack_packet(data, format)
+
+
+def test_s64k_codes_raise_as_generic_unpacking():
+    # S64K is spelled 'S64k' in protocol.comm_protocols
+    codes = _codes("S64K")
+    assert codes
+    for code in codes:
+        with pytest.raises(KeyError):
+            pack.get_packet_length_type_and_format(code)
+        with pytest.raises(KeyError):
+            pack.get_packet_decoder(code)
+
+
+def test_unsupported_codes_raise_value_error():
+    for code in set(range(256)) - set(C.codetypes) - {C.CODE_TBR}:
+        with pytest.raises(ValueError):
+            pack.get_packet_decoder(code)
@@ -0,0 +1,235 @@
+# Python built-in modules and packages
+import os
+
+# Third-party modules and packages
+import pytest
+
+# Local modules and packages
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+from src.backend.dbmanager import positioning as pos
+
+
+t0 = 1556555369  # 2019-04-29 16:29:29 UTC
+A, B, C = TBRs = [730, 734, 836]
+
+
+class _Clock:
+    # Stands in for the time module of positioning, only monotonic() is used
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def dbObj(tmp_path):
+    path = os.path.join(str(tmp_path), "iof.db")
+    dbinit.create_main_database(path)
+    dbObj = dbmanager.DatabaseManager(path)
+    yield dbObj
+    dbObj.close()
+
+
+def _insert_detection(dbObj: dbmanager.DatabaseManager, msgID: int, packet) -> None:
+    dbObj.add_del_update_db_record(
+        "INSERT INTO tag (message_id, timestamp, date, hour, tbr_serial_id, "
+        "comm_protocol, frequency, tag_id, tag_data, tag_data_raw, snr, millisecond) "
+        "VALUES (?, ?, '2019-04-29', 16, ?, 'S256', ?, ?, ?, 35, 20, ?);",
+        (
+            msgID,
+            packet["timestamp"],
+            packet["tbr_serial_id"],
+            packet["frequency"],
+            packet["tag_id"],
+            packet["tag_data"],
+            packet["millisecond"],
+        ),
+    )
+
+
+def _rows(df):
+    # Detections of a triplet in order, with drift adjusted timestamps
+    if df is None:
+        return None
+    columns = zip(df.timestamp, df.millisecond, df.tbr_serial_id, df.tag_data)
+    return [(int(ts), int(ms), int(tbr), float(data)) for ts, ms, tbr, data in columns]
+
+
+def test_window_finds_same_triplets_as_database(dbObj, monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(pos, "time", clock)
+    window = pos.DetectionWindow(maxAge=600)
+    # (timestamp, millisecond, TBR) in order of arrival, None waits out maxAge
+    stream = [
+        # In order, millisecond wraps to the next second
+        (t0, 995, A),
+        (t0 + 1, 3, B),
+        (t0 + 1, 10, C),
+        # Out of order, interleaved with a transmission missing receiver C
+        (t0 + 30, 120, C),
+        (t0 + 30, 100, A),
+        (t0 + 60, 200, A),
+        (t0 + 30, 111, B),
+        (t0 + 60, 210, B),
+        # QoS1 duplicate of B after the triplet is complete
+        (t0 + 90, 300, A),
+        (t0 + 90, 305, B),
+        (t0 + 90, 310, C),
+        (t0 + 90, 305, B),
+        # QoS1 duplicate of A before the triplet is complete
+        (t0 + 120, 400, A),
+        (t0 + 120, 400, A),
+        (t0 + 120, 410, B),
+        (t0 + 120, 420, C),
+        # Detections added more than maxAge ago are evicted
+        None,
+        (t0 + 700, 500, B),
+        (t0 + 700, 505, C),
+        (t0 + 700, 510, A),
+    ]
+    windowTriplets, databaseTriplets = [], []
+    for msgID, detection in enumerate(stream):
+        if detection is None:
+            clock.now += window.maxAge + 1
+            continue
+        clock.now += 0.1
+        timestamp, millisecond, tbr = detection
+        packet = {
+            "timestamp": timestamp,
+            "millisecond": millisecond,
+            "frequency": 69,
+            "tag_id": 10,
+            "tag_data": 3.5,
+            "tbr_serial_id": tbr,
+        }
+        # The client inserts a message before positioning it
+        _insert_detection(dbObj, msgID, packet)
+        triplet, df = pos._get_tag_df(timestamp, 10, 69, TBRs, dbObj)
+        databaseTriplets.append(_rows(df) if triplet else None)
+        windowTriplets.append(_rows(window.add(packet, TBRs)))
+
+    assert windowTriplets == databaseTriplets
+    found = [triplet for triplet in windowTriplets if triplet is not None]
+    assert [triplet[0][:2] for triplet in found] == [
+        (t0, 995),
+        (t0 + 30, 100),
+        (t0 + 90, 300),
+        (t0 + 700, 500),
+    ]
+    # Only the last transmission is left, the others were evicted by age
+    assert len(window) == 3
+
+
+def _insert_gps(dbObj: dbmanager.DatabaseManager, rows) -> None:
+    # rows of (message_id, timestamp, tbr_serial_id, latitude, pdop, fix)
+    dbObj.executemany_db_records(
+        "INSERT INTO gps (message_id, timestamp, date, hour, tbr_serial_id, "
+        "slim_status, latitude, longitude, pdop, fix, num_sat_tracked) "
+        "VALUES (?, ?, '2019-04-29', 16, ?, 'OK', ?, 10.4, ?, ?, 9);",
+        rows,
+    )
+    dbmanager._db_update_derived_tables(dbObj, [row[0] for row in rows])
+
+
+def test_station_fixes_match_latest_gps_positions(dbObj):
+    stations = TBRs + [999]
+    _insert_gps(
+        dbObj,
+        [
+            (0, t0 + 100, A, 63.10, 2.5, "3D-fix"),
+            (1, t0 + 200, A, 63.20, 3.9, "3D-fix"),
+            (2, t0 + 300, A, 63.30, 1.0, "2D-fix"),
+            (3, t0 + 100, B, 63.40, 5.5, "3D-fix"),
+            (4, t0 + 200, B, 63.50, 6.0, "3D-fix"),
+            (5, t0 + 100, C, 63.60, 0.4, "3D-fix"),
+            (6, t0 + 100, 999, 63.70, 1.5, "2D-fix"),
+        ],
+    )
+    expected = [pos.tdoa.LatLong(lat, 10.4) for lat in [63.10, 63.40, 63.60]]
+    assert pos._get_station_positions(stations, dbObj) == expected
+    assert pos._get_latest_gps_positions(stations, dbObj) == expected
+
+    # Positions of a later batch, some older than the stored positions
+    _insert_gps(
+        dbObj,
+        [
+            (7, t0 + 150, A, 63.15, 2.2, "3D-fix"),
+            (8, t0 + 50, A, 63.05, 2.1, "3D-fix"),
+            (9, t0 + 400, B, 63.45, 1.0, "3D-fix"),
+            (10, t0 + 400, C, 63.65, 0.9, "3D-fix"),
+            (11, t0 + 50, C, 63.55, 0.1, "3D-fix"),
+        ],
+    )
+    expected = [pos.tdoa.LatLong(lat, 10.4) for lat in [63.15, 63.45, 63.65]]
+    assert pos._get_station_positions(stations, dbObj) == expected
+    assert pos._get_latest_gps_positions(stations, dbObj) == expected
+
+    # Databases created before station_fixes search the gps table
+    dbObj.add_del_update_db_record("DROP TABLE station_fixes;")
+    assert pos._get_station_positions(stations, dbObj) == expected
+
+
+_metadata = """
+[3D]
+active_cages = ["cage_1"]
+
+[3D.cages.cage_1]
+name = "{cage}"
+
+[3D.cages.cage_1.tbr]
+tbrs = [{tbrs}]
+depth = 5.0
+
+[tags.tag_1]
+tag_id = {tag_id}
+frequency = 69
+cage_name = "{cage}"
+"""
+
+
+def _write_metadata(path: str, content: str, mtime: int) -> None:
+    with open(path, "w") as f:
+        f.write(content)
+    os.utime(path, ns=(mtime, mtime))
+
+
+def test_metadata_index_is_reloaded_when_file_changes(tmp_path, monkeypatch):
+    clock = _Clock()
+    path = os.path.join(str(tmp_path), "metadata_positioning.toml")
+    monkeypatch.setattr(pos, "time", clock)
+    monkeypatch.setattr(pos, "_metaFile", path)
+    for name in ["_index", "_metaMtime", "_metaChecked", "_cages", "_depth_tags"]:
+        monkeypatch.setattr(pos, name, None)
+    mtime = 10 ** 18
+
+    metadata = _metadata.format(cage="ref", tbrs=TBRs, tag_id=10)
+    _write_metadata(path, metadata, mtime)
+    pos.init_metadata()
+    index = pos.get_metadata_index()
+    assert pos._is_depth_tag(10, 69, index)
+    cage, cageTBRs = pos._get_cage_and_TBR_data(A, index)
+    assert (cage.cageName, cageTBRs) == ("ref", TBRs)
+
+    # The new file is not loaded before the next check of its modification time
+    metadata = _metadata.format(cage="new", tbrs=[A, 900, 901], tag_id=11)
+    _write_metadata(path, metadata, mtime + 1)
+    assert pos.get_metadata_index() is index
+    clock.now += pos._reloadInterval
+    index = pos.get_metadata_index()
+    assert not pos._is_depth_tag(10, 69, index)
+    assert pos._is_depth_tag(11, 69, index)
+    cage, cageTBRs = pos._get_cage_and_TBR_data(A, index)
+    assert (cage.cageName, cageTBRs) == ("new", [A, 900, 901])
+    assert pos._get_cage_and_TBR_data(C, index) == (None, None)
+    assert pos._cages is index.cages
+
+    # A partly written file keeps the current metadata
+    _write_metadata(path, metadata[: len(metadata) // 2], mtime + 2)
+    clock.now += pos._reloadInterval
+    assert pos.get_metadata_index() is index
+
+    os.remove(path)
+    clock.now += pos._reloadInterval
+    assert pos.get_metadata_index() is None
@@ -0,0 +1,97 @@
+# Python built-in modules and packages
+import os
+
+# Third-party modules and packages
+import pytest
+
+# Local modules and packages
+from src.backend import benchmark
+from src.backend import ingest
+from src.backend import reposition
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+from src.backend.dbmanager import positioning as pos
+
+
+day = 24 * 3600
+firstDay = 1556582400  # 2019-04-30 00:00 UTC, the next day is in the next month
+TBRs = [730, 734, 836]
+cage = pos.CageMeta(
+    "ref",
+    [TBRs],
+    5.0,
+    pos.CageGeometry(
+        pos.CageCircle(pos.Point(0, 0), 30),
+        63.4400,
+        63.4404,
+        63.4402,
+        10.4000,
+        10.4000,
+        10.4010,
+    ),
+)
+
+
+@pytest.fixture(params=[0, 1], ids=["main", "sharded"])
+def database(request, tmp_path, monkeypatch):
+    path = os.path.join(str(tmp_path), "iof.db")
+    dbinit.create_main_database(path)
+    monkeypatch.setitem(dbmanager._storageProfile, "shard_months", request.param)
+    # Synthetic payloads have S256 detections of tag 10
+    monkeypatch.setattr(pos, "_cages", {"ref": cage})
+    monkeypatch.setattr(pos, "_depth_tags", [pos.TagsMeta(10, 69, "ref")])
+    yield path
+    dbmanager.close_database_managers()
+
+
+def _insert_triplet(path: str, msgID: int, timestamp: int) -> None:
+    # Detections of the depth tag by all TBRs of the cage, stored by one worker
+    payloads = [benchmark.synthetic_mqtt_payload(tbr, timestamp, 1) for tbr in TBRs]
+    msgs = [ingest.decode_mqtt_payload(payload)[1] for payload in payloads]
+    msgIDs = range(msgID, msgID + len(msgs))
+    dbObj = dbmanager.DatabaseManager(path)
+    try:
+        assert dbmanager.bulk_insert_messages(dbObj, msgs, msgIDs) == {0, 1, 2}
+    finally:
+        dbObj.close()
+
+
+def _planned_starts(path: str):
+    dbObj = dbmanager.DatabaseManager(path)
+    try:
+        units, _ = reposition.plan_work_units(
+            dbObj, 0, reposition.maxTimestamp, day, newOnly=True
+        )
+    finally:
+        dbObj.close()
+    return [unit.start for unit in units]
+
+
+def test_watermark_keeps_detections_of_lower_message_id_block(database):
+    # Worker 1 stores from its message_id block first
+    _insert_triplet(database, 1005, firstDay + 100)
+    counts = reposition.reposition_database(database, processes=1)
+    assert (counts["units"], counts["detections"]) == (1, 3)
+    assert _planned_starts(database) == []
+
+    # Worker 0 stores from its lower block afterwards
+    _insert_triplet(database, 500, firstDay + day + 100)
+    assert _planned_starts(database) == [firstDay + day]
+    counts = reposition.reposition_database(database, processes=1)
+    assert (counts["units"], counts["detections"]) == (1, 3)
+    assert _planned_starts(database) == []
+
+
+def test_watermark_of_message_ids_is_replaced(database):
+    dbObj = dbmanager.DatabaseManager(database)
+    dbObj.add_del_update_db_record(
+        "CREATE TABLE positioning_watermark (tag_id INTEGER, frequency INTEGER, "
+        "tbr_a INTEGER, tbr_b INTEGER, tbr_c INTEGER, message_id INTEGER);"
+    )
+    dbObj.add_del_update_db_record(
+        "INSERT INTO positioning_watermark VALUES (10, 69, 730, 734, 836, 2000);"
+    )
+    dbObj.close()
+    _insert_triplet(database, 500, firstDay + 100)
+    counts = reposition.reposition_database(database, processes=1)
+    assert (counts["units"], counts["detections"]) == (1, 3)
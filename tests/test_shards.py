@@ -0,0 +1,102 @@
+# Python built-in modules and packages
+import base64
+import glob
+import json
+import os
+import sqlite3
+import time
+
+# Third-party modules and packages
+import pytest
+
+# Local modules and packages
+from src.backend import benchmark
+from src.backend import ingest
+from src.backend.dbmanager import dbinit
+from src.backend.dbmanager import dbmanager
+from src.backend.dbmanager import shards
+from src.backend.msghandler import batchdecode
+
+
+months = 11  # one more than sqlite can attach
+monthStarts = [shards._month_start(2019 * 12 + month) for month in range(months)]
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    path = os.path.join(str(tmp_path), "iof.db")
+    dbinit.create_main_database(path)
+    monkeypatch.setitem(dbmanager._storageProfile, "shard_months", 1)
+    monkeypatch.setattr(dbmanager, "_dbPath", path)
+    dbmanager._msgIdAllocator.reset()
+    yield path
+    dbmanager.close_database_managers()
+    dbmanager._msgIdAllocator.reset()
+
+
+def _payloads(timestamps):
+    return [benchmark.synthetic_mqtt_payload(1, ts) for ts in timestamps]
+
+
+def _messages(timestamps):
+    return [ingest.decode_mqtt_payload(payload)[1] for payload in _payloads(timestamps)]
+
+
+def _tag_rows(path: str) -> int:
+    # Dummy row of main database has message_id -1
+    con = sqlite3.connect(path)
+    try:
+        sql_query = "SELECT count(*) FROM tag WHERE message_id >= 0"
+        return con.execute(sql_query).fetchone()[0]
+    finally:
+        con.close()
+
+
+def test_group_writes_attach_at_most_max_attached_shards():
+    router = shards.ShardRouter("iof.db")
+    # Items cycle through the months, an implausible timestamp needs no shard
+    timestamps = [{monthStarts[i % months] + i} for i in range(3 * months)] + [{0}]
+    groups = router.group_writes(timestamps)
+    assert sorted(i for items in groups for i in items) == list(range(len(timestamps)))
+    for items in groups:
+        schemas = {router.schema_of(t) for i in items for t in timestamps[i]}
+        assert len(schemas - {"main"}) <= shards.maxAttached
+    assert len(groups) == 2
+
+
+def test_plausible_timestamps():
+    assert shards.is_plausible(monthStarts[0])
+    assert shards.is_plausible(int(time.time()))
+    assert not shards.is_plausible(0)
+    assert not shards.is_plausible(int(time.time()) + 30 * 24 * 3600)
+
+
+def test_batch_over_more_shards_than_attachable_is_inserted(database):
+    timestamps = [monthStarts[i % months] + 60 * i for i in range(300)]
+    corrupt = [0, int(time.time()) + 30 * 24 * 3600]
+    msgIDs = dbmanager.insert_messages_in_db(_messages(timestamps + corrupt))
+    assert None not in msgIDs
+
+    directory = os.path.dirname(database)
+    shardPaths = sorted(glob.glob(os.path.join(directory, "iof_*.db")))
+    assert [os.path.basename(path) for path in shardPaths] == [
+        f"iof_2019-{month + 1:02d}.db" for month in range(months)
+    ]
+    # Two tag packets per message, rows of corrupt timestamps are in main database
+    assert sum(_tag_rows(path) for path in shardPaths) == 2 * len(timestamps)
+    assert _tag_rows(database) == 2 * len(corrupt)
+
+
+def test_decoded_batch_over_more_shards_than_attachable_is_inserted(database):
+    timestamps = [monthStarts[i % months] + 60 * i for i in range(300)] + [0]
+    data = [base64.b64decode(json.loads(p)["data"]) for p in _payloads(timestamps)]
+    batch = batchdecode.decode_messages(data)
+    dbObj = dbmanager.get_database_manager(database)
+    msgIDs = range(len(data))
+    assert dbmanager.bulk_insert_decoded_batch(dbObj, batch, msgIDs) == set(msgIDs)
+    dbmanager.close_database_managers()
+
+    directory = os.path.dirname(database)
+    shardPaths = glob.glob(os.path.join(directory, "iof_*.db"))
+    assert len(shardPaths) == months
+    assert sum(_tag_rows(path) for path in shardPaths) == 2 * (len(timestamps) - 1)